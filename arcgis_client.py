@@ -0,0 +1,449 @@
+import codecs
+import json
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import REGISTRY, SIZE_BUCKETS
+
+DEFAULT_MAPSERVER_URL = "https://gis.summitcountyco.gov/arcgis/rest/services/ParcelQueryTool/SummitMap1_Pro321/MapServer"
+
+# (connect, read) timeout in seconds for every request
+DEFAULT_TIMEOUT = (5, 60)
+# Attempts after the first one before a request is given up on
+MAX_RETRIES = 4
+# Base delay in seconds for exponential backoff between retries
+BACKOFF_BASE = 0.5
+# Upper bound in seconds on any single wait, including Retry-After
+MAX_BACKOFF = 30
+# HTTP (and ArcGIS JSON error) codes that are worth retrying
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Connections kept alive per host
+POOL_SIZE = 16
+# Hosts whose connection pools are kept (one per polled MapServer, plus detail pages)
+POOL_HOSTS = 16
+# Bytes read from the socket at a time when streaming a response
+STREAM_CHUNK_SIZE = 64 * 1024
+# Requests in flight the adaptive limiter starts at and may grow to,
+# overridable with ARCGIS_INITIAL_CONCURRENCY and ARCGIS_MAX_CONCURRENCY
+INITIAL_CONCURRENCY = 4
+MAX_CONCURRENCY = POOL_SIZE
+# A response whose headers take longer than this multiple of the fastest recent one counts as congestion
+LATENCY_TOLERANCE = 2.0
+# ...unless it still arrived within this many seconds
+LATENCY_FLOOR = 0.1
+# Per-response growth of the latency baseline, so a server that has become slower for good is relearned
+BASELINE_DRIFT = 1.02
+# Fraction of the limit kept after a throttled, failed or slow response
+BACKOFF_FACTOR = 0.5
+# Query parameters whose responses are small summaries rather than pages of features
+SUMMARY_PARAMS = ('returnCountOnly', 'returnIdsOnly', 'returnExtentOnly', 'outStatistics')
+
+_session = None
+_session_lock = threading.Lock()
+_limiters = {}
+
+class ArcGISError(requests.RequestException):
+    """Raised when an ArcGIS query fails or returns an error payload"""
+
+def mapserver_url():
+    """Return the MapServer base URL, overridable with ARCGIS_MAPSERVER_URL"""
+    return os.getenv('ARCGIS_MAPSERVER_URL', DEFAULT_MAPSERVER_URL).rstrip('/')
+
+def get_session():
+    """Return the shared, connection-pooled requests Session"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=POOL_SIZE, max_retries=0)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.headers.update({
+                    'Accept-Encoding': 'gzip, deflate',
+                    'User-Agent': 'summit-county-real-estate/1.0',
+                })
+                _session = session
+    return _session
+
+def close_session():
+    """Close the shared Session and its pooled connections"""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+class AdaptiveLimiter:
+    """AIMD limit on the number of requests in flight
+
+    Every attempt holds a slot while it runs. A healthy response raises
+    the limit by 1/limit, about one more slot per round of requests; a
+    throttled (429/503), failed or slow response multiplies it by
+    BACKOFF_FACTOR. Only requests started after the last decrease can
+    decrease it again, so one burst of failures backs off once.
+    """
+
+    def __init__(self, initial=INITIAL_CONCURRENCY, maximum=MAX_CONCURRENCY, minimum=1, host=None):
+        self.minimum = minimum
+        self.maximum = max(maximum, minimum)
+        self.limit = float(min(max(initial, minimum), self.maximum))
+        self.in_flight = 0
+        # Fastest recent time to response headers per (metric label, request kind), as the healthy latency
+        self.baselines = {}
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+        # Gauge labels telling the limiters of different hosts apart
+        self.labels = {'host': host} if host else {}
+        REGISTRY.set('arcgis_concurrency_limit', self.limit, **self.labels)
+
+    def acquire(self):
+        """Wait for a free slot and return the start time to pass to release"""
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+            REGISTRY.set('arcgis_requests_in_flight', self.in_flight, **self.labels)
+            return time.monotonic()
+
+    def release(self, started, key, latency=None, congested=False):
+        """Free a slot and adjust the limit from the attempt's outcome
+
+        Attempts with the same `key` (see request_kind) share a latency
+        baseline, so a full page is never judged against a count query.
+        `latency` is the time to response headers (None if there was no
+        response); `congested` marks throttling, retryable errors and
+        connection failures.
+        """
+        with self.condition:
+            self.in_flight -= 1
+            if latency is not None:
+                baseline = self.baselines.get(key, latency)
+                congested = congested or latency > max(baseline * LATENCY_TOLERANCE, LATENCY_FLOOR)
+                self.baselines[key] = min(latency, baseline * BASELINE_DRIFT)
+            if congested:
+                if started >= self.last_decrease:
+                    self.limit = max(self.minimum, self.limit * BACKOFF_FACTOR)
+                    self.last_decrease = time.monotonic()
+                    REGISTRY.inc('arcgis_concurrency_decreases_total', **self.labels)
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            REGISTRY.set('arcgis_concurrency_limit', round(self.limit, 2), **self.labels)
+            REGISTRY.set('arcgis_requests_in_flight', self.in_flight, **self.labels)
+            self.condition.notify_all()
+
+def request_kind(url, query=None):
+    """Classify a request for its latency baseline
+
+    Returns 'metadata' for layer descriptions, 'summary' for count, ID,
+    extent and statistics queries, and 'features' for everything else.
+    """
+    if not url.endswith('/query'):
+        return 'metadata'
+    query = query or {}
+    if any(str(query.get(name, 'false')).lower() != 'false' for name in SUMMARY_PARAMS):
+        return 'summary'
+    return 'features'
+
+def get_limiter(url):
+    """Return the AdaptiveLimiter shared by every request to url's host
+
+    Each host adapts on its own, so a throttling server does not slow
+    down the others.
+    """
+    host = urlsplit(url).netloc
+    limiter = _limiters.get(host)
+    if limiter is None:
+        with _session_lock:
+            limiter = _limiters.get(host)
+            if limiter is None:
+                limiter = _limiters[host] = AdaptiveLimiter(
+                    initial=int(os.getenv('ARCGIS_INITIAL_CONCURRENCY', INITIAL_CONCURRENCY)),
+                    maximum=int(os.getenv('ARCGIS_MAX_CONCURRENCY', MAX_CONCURRENCY)),
+                    host=host,
+                )
+    return limiter
+
+def response_latency(response):
+    """Return the seconds until a response's headers arrived, or None without a response"""
+    return response.elapsed.total_seconds() if response is not None else None
+
+def retry_delay(attempt, response=None):
+    """Return how long to wait before retry number `attempt`, honoring Retry-After"""
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), MAX_BACKOFF)
+        except ValueError:
+            try:
+                wait = parsedate_to_datetime(retry_after).timestamp() - time.time()
+                return min(max(wait, 0), MAX_BACKOFF)
+            except (TypeError, ValueError):
+                pass
+    # Full jitter keeps concurrent workers from retrying in lockstep
+    return random.uniform(0, min(BACKOFF_BASE * 2 ** attempt, MAX_BACKOFF))
+
+def record_response(layer, response, elapsed, size=None):
+    """Record request count, latency and wire bytes for one HTTP attempt"""
+    status = str(response.status_code) if response is not None else 'error'
+    REGISTRY.inc('arcgis_requests_total', layer=layer, status=status)
+    REGISTRY.observe('arcgis_request_seconds', elapsed, layer=layer)
+    if response is not None:
+        # Content-Length is the compressed size on the wire when the server gzips
+        size = int(response.headers.get('Content-Length') or (size if size is not None else len(response.content)))
+        REGISTRY.inc('arcgis_response_bytes_total', size, layer=layer)
+        REGISTRY.observe('arcgis_response_bytes', size, buckets=SIZE_BUCKETS, layer=layer)
+
+def request_json(method, url, params=None, data=None, timeout=DEFAULT_TIMEOUT, max_retries=MAX_RETRIES,
+                 metric_label='other'):
+    """Send a request on the shared Session and return decoded JSON, retrying transient failures"""
+    session = get_session()
+    limiter = get_limiter(url)
+    latency_key = (metric_label, request_kind(url, params if data is None else data))
+    attempt = 0
+    while True:
+        response = None
+        congested = True
+        slot = limiter.acquire()
+        started = time.perf_counter()
+        try:
+            response = session.request(method, url, params=params, data=data, timeout=timeout)
+            record_response(metric_label, response, time.perf_counter() - started)
+            failure = f"HTTP {response.status_code}"
+            if response.status_code not in RETRY_STATUSES:
+                congested = False
+                response.raise_for_status()
+                payload = response.json()
+                error = payload.get('error') if isinstance(payload, dict) else None
+                if not error:
+                    return payload
+                # ArcGIS reports many failures as HTTP 200 with an error body
+                if error.get('code') not in RETRY_STATUSES:
+                    raise ArcGISError(f"ArcGIS query failed: {error}")
+                congested = True
+                failure = f"ArcGIS error {error.get('code')}"
+        except (requests.ConnectionError, requests.Timeout) as e:
+            record_response(metric_label, None, time.perf_counter() - started)
+            failure = str(e)
+        finally:
+            limiter.release(slot, latency_key, response_latency(response), congested)
+
+        wait_before_retry(url, attempt, max_retries, failure, response)
+        attempt += 1
+
+def wait_before_retry(url, attempt, max_retries, failure, response=None):
+    """Sleep before the next attempt, or raise ArcGISError once retries are used up"""
+    if attempt >= max_retries:
+        raise ArcGISError(f"Giving up on {url} after {attempt + 1} attempts: {failure}")
+    delay = retry_delay(attempt, response)
+    print(f"🔁 Retrying {url} in {delay:.1f}s ({failure})")
+    time.sleep(delay)
+
+def iter_features(chunks, metadata):
+    """Incrementally parse an ArcGIS query response, yielding each feature as soon as it is complete
+
+    `chunks` are raw bytes as they arrive. Every top-level key other than
+    "features" (exceededTransferLimit, error, fields, ...) is stored in
+    `metadata`, which is complete once the generator is exhausted. Only
+    the unparsed tail of the body is held in memory, never the whole body.
+    """
+    # json.loads shares key strings across a whole document; decoding feature by
+    # feature would give every record its own copies, so share them per stream
+    keys = {}
+    decoder = json.JSONDecoder(object_pairs_hook=lambda pairs: {keys.setdefault(key, key): value for key, value in pairs})
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    position = 0
+    finished = False
+    chunks = iter(chunks)
+
+    def fill():
+        # Append the next chunk, dropping the already-parsed prefix; False once the body is exhausted
+        nonlocal buffer, position, finished
+        if finished:
+            return False
+        chunk = next(chunks, None)
+        if chunk is None:
+            finished = True
+            buffer = buffer[position:] + text_decoder.decode(b'', final=True)
+        else:
+            buffer = buffer[position:] + text_decoder.decode(chunk)
+        position = 0
+        return True
+
+    def skip(separators=' \t\r\n'):
+        # Advance past separators and return the next significant character ('' at end of body)
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in separators:
+                position += 1
+            if position < len(buffer):
+                return buffer[position]
+            if not fill():
+                return ''
+
+    def value():
+        # Decode one complete JSON value; a value ending exactly at the buffer end
+        # may be a truncated number, so it is only accepted once more text follows
+        nonlocal position
+        skip()
+        while True:
+            try:
+                result, end = decoder.raw_decode(buffer, position)
+                if end < len(buffer) or finished:
+                    position = end
+                    return result
+            except json.JSONDecodeError:
+                if finished:
+                    raise
+            fill()
+
+    def expect(character):
+        nonlocal position
+        found = skip()
+        if found != character:
+            raise json.JSONDecodeError(f"Expected {character!r}", buffer, position)
+        position += 1
+
+    expect('{')
+    while skip(' \t\r\n,') != '}':
+        key = value()
+        expect(':')
+        if key != 'features':
+            metadata[key] = value()
+            continue
+        expect('[')
+        while skip(' \t\r\n,') != ']':
+            yield value()
+        position += 1
+    position += 1
+
+class FeatureStream:
+    """Features of one query, parsed as the response body streams in
+
+    Iterate it once; `metadata` holds the other top-level keys (for
+    example exceededTransferLimit) after iteration finishes.
+    """
+
+    def __init__(self, method, url, params=None, data=None, timeout=DEFAULT_TIMEOUT, max_retries=MAX_RETRIES,
+                 metric_label='other'):
+        self.method = method
+        self.url = url
+        self.params = params
+        self.data = data
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.metric_label = metric_label
+        self.metadata = {}
+
+    def __iter__(self):
+        session = get_session()
+        limiter = get_limiter(self.url)
+        latency_key = (self.metric_label, request_kind(self.url, self.params if self.data is None else self.data))
+        attempt = 0
+        while True:
+            response = None
+            yielded = 0
+            congested = True
+            # The slot is held until the body has been read, which is when the server is done with the request
+            slot = limiter.acquire()
+            started = time.perf_counter()
+            try:
+                response = session.request(
+                    self.method, self.url, params=self.params, data=self.data, timeout=self.timeout, stream=True
+                )
+                failure = f"HTTP {response.status_code}"
+                if response.status_code not in RETRY_STATUSES:
+                    congested = False
+                    if not response.ok:
+                        record_response(self.metric_label, response, time.perf_counter() - started)
+                        response.raise_for_status()
+                    self.metadata.clear()
+                    size = 0
+
+                    def counted(chunks):
+                        nonlocal size
+                        for chunk in chunks:
+                            size += len(chunk)
+                            yield chunk
+
+                    with response:
+                        chunks = counted(response.iter_content(STREAM_CHUNK_SIZE))
+                        for feature in iter_features(chunks, self.metadata):
+                            yielded += 1
+                            yield feature
+                        # Read to EOF so the connection goes back to the pool instead of being dropped
+                        for _ in chunks:
+                            pass
+                    record_response(self.metric_label, response, time.perf_counter() - started, size)
+                    error = self.metadata.get('error')
+                    if not error:
+                        return
+                    if error.get('code') not in RETRY_STATUSES:
+                        raise ArcGISError(f"ArcGIS query failed: {error}")
+                    congested = True
+                    failure = f"ArcGIS error {error.get('code')}"
+                else:
+                    # Read the error body so the connection goes back to the pool instead of being reset
+                    record_response(self.metric_label, response, time.perf_counter() - started, len(response.content))
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                record_response(self.metric_label, None, time.perf_counter() - started)
+                congested = True
+                # Features already handed to the caller cannot be taken back, so only a clean start is retried
+                if yielded:
+                    raise ArcGISError(f"{self.url} failed after {yielded} features: {e}") from e
+                failure = str(e)
+            except json.JSONDecodeError as e:
+                raise ArcGISError(f"Malformed response from {self.url}: {e}") from e
+            finally:
+                limiter.release(slot, latency_key, response_latency(response), congested)
+
+            wait_before_retry(self.url, attempt, self.max_retries, failure, response)
+            attempt += 1
+
+def layer_url(layer, base_url=None):
+    """Return the REST URL of a MapServer layer (of ARCGIS_MAPSERVER_URL unless base_url is given)"""
+    return f"{(base_url or mapserver_url()).rstrip('/')}/{layer}"
+
+def layer_info(layer, max_retries=MAX_RETRIES, base_url=None, metric_label=None):
+    """Return a layer's description (fields, maxRecordCount, capabilities) from MapServer/<layer>?f=json
+
+    Use layer_metadata.get_layer_metadata for the cached copy.
+    """
+    return request_json('GET', layer_url(layer, base_url), params={'f': 'json'}, max_retries=max_retries,
+                        metric_label=metric_label or str(layer))
+
+def query_layer(layer, params, method='GET', base_url=None, metric_label=None):
+    """Run a query against a MapServer layer and return the decoded JSON response
+
+    POST sends the parameters form-encoded, which keeps long WHERE
+    clauses out of the URL.
+    """
+    query = {'f': 'json'}
+    query.update(params)
+    url = f"{layer_url(layer, base_url)}/query"
+    metric_label = metric_label or str(layer)
+    if method == 'POST':
+        return request_json('POST', url, data=query, metric_label=metric_label)
+    return request_json('GET', url, params=query, metric_label=metric_label)
+
+def stream_layer(layer, params, method='GET', base_url=None, metric_label=None):
+    """Run a query against a MapServer layer and return a FeatureStream over its features
+
+    Use this instead of query_layer for feature queries whose responses
+    can be large; count and ID queries are small and use query_layer.
+    """
+    query = {'f': 'json'}
+    query.update(params)
+    url = f"{layer_url(layer, base_url)}/query"
+    metric_label = metric_label or str(layer)
+    if method == 'POST':
+        return FeatureStream('POST', url, data=query, metric_label=metric_label)
+    return FeatureStream('GET', url, params=query, metric_label=metric_label)
@@ -0,0 +1,195 @@
+"""Backfill layer 19 history over an arbitrary date range
+
+A single query for a year of changes times out or is truncated at the
+server's record limit. Instead, each MODDATE window is probed with
+returnCountOnly: windows holding more rows than the layer's
+maxRecordCount are split in half, and windows that fit are fetched
+concurrently and written to their own JSON Lines file (one layer 19
+attribute record per line). The pending windows and the totals are
+checkpointed after every window, so an interrupted backfill picks up
+where it stopped when the same command is run again.
+
+    python backfill.py 2025-01-01 2026-01-01
+    python backfill.py --days 365 --max-workers 8
+"""
+import argparse
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+
+import requests
+
+from arcgis_client import close_session
+from layer_metadata import get_layer_metadata
+from real_estate_updates import fetch_layer_19_features, query_layer_19
+from sources import DEFAULT_SOURCE
+
+# Directory receiving one file per fetched window, overridable with BACKFILL_DIR
+BACKFILL_DIR = 'backfill'
+CHECKPOINT_FILE = 'checkpoint.json'
+# Windows probed or fetched at the same time
+BACKFILL_MAX_WORKERS = 4
+
+def window_where(start_ms, end_ms):
+    """WHERE clause selecting layer 19 rows with start_ms <= MODDATE < end_ms"""
+    return DEFAULT_SOURCE.window_where(start_ms, end_ms)
+
+def count_window(start_ms, end_ms):
+    return query_layer_19(window_where(start_ms, end_ms), returnCountOnly='true').get('count', 0)
+
+def window_path(directory, start_ms, end_ms):
+    return os.path.join(directory, f'layer19_{start_ms}_{end_ms}.jsonl')
+
+def fetch_window(directory, start_ms, end_ms):
+    """Fetch every row of a window into its JSON Lines file and return the row count"""
+    path = window_path(directory, start_ms, end_ms)
+    temp_path = f"{path}.tmp"
+    count = 0
+    with open(temp_path, 'w') as f:
+        for feature in fetch_layer_19_features(window_where(start_ms, end_ms)):
+            f.write(json.dumps(feature['attributes'], separators=(',', ':')) + '\n')
+            count += 1
+    os.replace(temp_path, path)
+    return count
+
+def process_window(directory, start_ms, end_ms, record_limit):
+    """Probe a window and either split it or fetch it
+
+    Returns ('split', [halves]), ('empty', 0) or ('fetched', row count).
+    """
+    count = count_window(start_ms, end_ms)
+    if count == 0:
+        return 'empty', 0
+    # A single millisecond cannot be split further; fetch_layer_19_features pages through it
+    if count > record_limit and end_ms - start_ms > 1:
+        middle = (start_ms + end_ms) // 2
+        return 'split', [(start_ms, middle), (middle, end_ms)]
+    return 'fetched', fetch_window(directory, start_ms, end_ms)
+
+def new_state(start_ms, end_ms):
+    return {'range': [start_ms, end_ms], 'pending': [[start_ms, end_ms]], 'windows': 0, 'rows': 0}
+
+def load_checkpoint(path, start_ms, end_ms):
+    """Return the saved state for this range, or a fresh one
+
+    Raises ValueError if an unfinished backfill of a different range is
+    checkpointed; a finished one is simply replaced.
+    """
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return new_state(start_ms, end_ms)
+    if state['range'] == [start_ms, end_ms]:
+        return state
+    if state['pending']:
+        raise ValueError(
+            f"{path} belongs to an unfinished backfill of a different range; "
+            f"finish it, or pass --restart to discard it"
+        )
+    return new_state(start_ms, end_ms)
+
+def save_checkpoint(path, state):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(temp_path, path)
+
+def backfill(start_ms, end_ms, directory=BACKFILL_DIR, max_workers=BACKFILL_MAX_WORKERS, restart=False):
+    """Fetch every layer 19 row with start_ms <= MODDATE < end_ms into directory, resuming any checkpoint"""
+    os.makedirs(directory, exist_ok=True)
+    checkpoint = os.path.join(directory, CHECKPOINT_FILE)
+    if restart and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    state = load_checkpoint(checkpoint, start_ms, end_ms)
+    if not state['pending']:
+        print(f"✅ Backfill already complete: {state['rows']} rows in {state['windows']} windows")
+        return state
+
+    record_limit = get_layer_metadata(19).page_size()
+    if state['windows']:
+        print(f"⏯️ Resuming backfill: {state['rows']} rows already fetched, {len(state['pending'])} windows left")
+
+    started = time.perf_counter()
+    pending = deque(tuple(window) for window in state['pending'])
+    in_flight = {}
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while pending or in_flight:
+                while pending and len(in_flight) < max_workers:
+                    window = pending.popleft()
+                    in_flight[executor.submit(process_window, directory, *window, record_limit)] = window
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    window = in_flight.pop(future)
+                    outcome, result = future.result()
+                    if outcome == 'split':
+                        pending.extend(result)
+                        continue
+                    state['windows'] += 1
+                    state['rows'] += result
+                    if outcome == 'fetched':
+                        print(f"   📥 {datetime.fromtimestamp(window[0] / 1000):%Y-%m-%d %H:%M} → "
+                              f"{datetime.fromtimestamp(window[1] / 1000):%Y-%m-%d %H:%M}: {result} rows")
+                # Windows still in flight are saved as pending, so an interruption only repeats them
+                state['pending'] = [list(window) for window in [*in_flight.values(), *pending]]
+                save_checkpoint(checkpoint, state)
+    except (KeyboardInterrupt, requests.RequestException):
+        state['pending'] = [list(window) for window in [*in_flight.values(), *pending]]
+        save_checkpoint(checkpoint, state)
+        print(f"⏸️ Backfill stopped with {len(state['pending'])} windows left; run the same command to resume")
+        raise
+
+    print(f"✅ Backfilled {state['rows']} rows in {state['windows']} windows "
+          f"in {time.perf_counter() - started:.1f}s to {directory}")
+    return state
+
+def parse_date(value):
+    return datetime.fromisoformat(value)
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill layer 19 changes over a date range")
+    parser.add_argument('start', nargs='?', type=parse_date, help="first day (YYYY-MM-DD or ISO timestamp)")
+    parser.add_argument('end', nargs='?', type=parse_date, help="end of the range, exclusive (default: now)")
+    parser.add_argument('--days', type=float, help="backfill this many days up to now instead of START")
+    parser.add_argument('--directory', default=os.getenv('BACKFILL_DIR', BACKFILL_DIR))
+    parser.add_argument('--max-workers', type=int, default=BACKFILL_MAX_WORKERS)
+    parser.add_argument('--restart', action='store_true', help="discard an existing checkpoint and start over")
+    args = parser.parse_args()
+
+    if args.days is not None and args.start is not None:
+        parser.error("give either START or --days, not both")
+    end = args.end or datetime.now()
+    if args.days is not None:
+        start = end - timedelta(days=args.days)
+    elif args.start is not None:
+        start = args.start
+    else:
+        parser.error("give a START date or --days")
+    if start >= end:
+        parser.error("START must be before END")
+    start_ms, end_ms = int(start.timestamp() * 1000), int(end.timestamp() * 1000)
+
+    # Without an explicit END the range moves with the clock, so an unfinished
+    # checkpoint for the same START (or any --days run) is resumed as saved
+    checkpoint = os.path.join(args.directory, CHECKPOINT_FILE)
+    if args.end is None and not args.restart and os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            saved = json.load(f)
+        if saved['pending'] and (args.days is not None or saved['range'][0] == start_ms):
+            start_ms, end_ms = saved['range']
+
+    try:
+        backfill(start_ms, end_ms, directory=args.directory, max_workers=args.max_workers, restart=args.restart)
+    except ValueError as e:
+        parser.error(str(e))
+    except (KeyboardInterrupt, requests.RequestException):
+        raise SystemExit(1)
+    finally:
+        close_session()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""End-to-end pipeline benchmark against a local fake MapServer
+
+Each scale serves synthetic (or recorded) layer 19 and layer 12 data from
+fake_mapserver.py and runs the pipeline stages in a fresh child process,
+timing each stage and recording the child's peak RSS. Results are
+compared against benchmarks/baseline.json so regressions are caught.
+
+    python benchmark.py                           # 10, 1k, 10k and 100k parcels
+    python benchmark.py --scales 10 1000 --save-baseline
+    python benchmark.py --fixtures fixtures       # replay recorded responses
+    python benchmark.py --record recorded --minutes 1440
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+BASELINE_FILE = os.path.join('benchmarks', 'baseline.json')
+DEFAULT_SCALES = [10, 1_000, 10_000, 100_000]
+STAGES = ['layer_19', 'layer_12_join', 'sort', 'render', 'deliver']
+# A stage regresses when it is this much slower than the baseline...
+TIME_TOLERANCE = 0.25
+# ...and slower by at least this many seconds, so tiny stages do not flap
+TIME_FLOOR = 0.010
+# Peak memory regresses when it grows by more than this fraction
+MEMORY_TOLERANCE = 0.20
+
+class NullSMTPPool:
+    """Stands in for SMTPPool so delivery is timed without a mail server"""
+
+    size = 1
+
+    class Connection:
+        def sendmail(self, sender_email, receiver_email, message):
+            pass
+
+    @contextmanager
+    def connection(self):
+        yield self.Connection()
+
+    def close(self):
+        pass
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def run_stages():
+    """Run every pipeline stage once against ARCGIS_MAPSERVER_URL and return the timings"""
+    from datetime import datetime
+    from delivery import RateLimiter, deliver_reports
+    from parcel_cache import ParcelCache
+    from real_estate_updates import (
+        build_watermark_where, fetch_changes, fetch_parcel_records, join_report, sort_report,
+    )
+    from report import create_html_emails
+
+    timings = {}
+    now = datetime.now()
+    with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(io.StringIO()):
+        cache = ParcelCache(os.path.join(directory, 'cache.sqlite3'))
+
+        started = time.perf_counter()
+        watermark = (0, 0)
+        ppi_to_moddate, _ = fetch_changes(build_watermark_where(watermark, int(time.time() * 1000) + 60_000), watermark)
+        timings['layer_19'] = time.perf_counter() - started
+
+        # Layer 12 records are joined as they stream in, so the two are timed together
+        started = time.perf_counter()
+        report_data = join_report(fetch_parcel_records(ppi_to_moddate, cache), ppi_to_moddate)
+        timings['layer_12_join'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        sort_report(report_data)
+        timings['sort'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        create_html_emails(report_data, now, now)
+        timings['render'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        deliver_reports(report_data, now, now, [{'email': 'benchmark@example.com'}], NullSMTPPool(),
+                        'sender@example.com', limiter=RateLimiter(0))
+        timings['deliver'] = time.perf_counter() - started
+        cache.close()
+
+    return {
+        'parcels': len(ppi_to_moddate),
+        'records': len(report_data),
+        'stages': timings,
+        'total': sum(timings.values()),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+def benchmark_scale(layers):
+    """Serve the given layers and run the stages in a child process"""
+    from fake_mapserver import FakeMapServer
+
+    server = FakeMapServer(layers)
+    url = server.start()
+    try:
+        # Each child fetches the layer descriptions afresh, as a first poll would
+        with tempfile.TemporaryDirectory() as directory:
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--child'],
+                env=dict(os.environ, ARCGIS_MAPSERVER_URL=url,
+                         LAYER_METADATA_FILE=os.path.join(directory, 'layer_metadata.json')),
+                capture_output=True, text=True, check=True,
+            ).stdout
+    finally:
+        server.stop()
+    return json.loads(output.strip().splitlines()[-1])
+
+def compare(results, baseline):
+    """Return human-readable regressions of results against the baseline"""
+    regressions = []
+    for scale, result in results.items():
+        expected = baseline.get(scale)
+        if not expected:
+            continue
+        for stage, seconds in result['stages'].items():
+            before = expected['stages'].get(stage)
+            if before is not None and seconds > before * (1 + TIME_TOLERANCE) and seconds - before > TIME_FLOOR:
+                regressions.append(f"{scale} parcels, {stage}: {before * 1000:.0f} ms → {seconds * 1000:.0f} ms")
+        before = expected.get('peak_rss_mb')
+        if before and result['peak_rss_mb'] > before * (1 + MEMORY_TOLERANCE):
+            regressions.append(f"{scale} parcels, peak memory: {before:.0f} MB → {result['peak_rss_mb']:.0f} MB")
+    return regressions
+
+def print_table(results):
+    header = f"{'parcels':>9} " + ''.join(f"{stage:>14}" for stage in STAGES) + f"{'total':>10}{'peak MB':>10}"
+    print(header)
+    print('-' * len(header))
+    for scale, result in results.items():
+        row = f"{scale:>9} " + ''.join(f"{result['stages'][stage] * 1000:>12.0f}ms" for stage in STAGES)
+        print(row + f"{result['total'] * 1000:>8.0f}ms{result['peak_rss_mb']:>10.0f}")
+
+def record_fixtures(directory, minutes):
+    """Record layer 19 and layer 12 responses from the configured MapServer as fixture files"""
+    from real_estate_updates import LAYER_12_FIELDS, fetch_layer_12_features, fetch_layer_19_features
+    from sources import DEFAULT_SOURCE
+
+    end_ms = int(time.time() * 1000) + 1
+    start_ms = end_ms - 1 - minutes * 60_000
+    layer_19 = list(fetch_layer_19_features(DEFAULT_SOURCE.window_where(start_ms, end_ms)))
+    ppi_values = list(dict.fromkeys(feature['attributes']['PPI'] for feature in layer_19))
+    layer_12 = fetch_layer_12_features(ppi_values) if ppi_values else []
+    os.makedirs(directory, exist_ok=True)
+    for layer, features in ((12, layer_12), (19, layer_19)):
+        with open(os.path.join(directory, f'layer_{layer}.json'), 'w') as f:
+            json.dump({'fields': [{'name': name} for name in LAYER_12_FIELDS.split(',')] if layer == 12 else [],
+                       'features': features}, f)
+    print(f"💾 Recorded {len(layer_19)} layer 19 and {len(layer_12)} layer 12 features to {directory}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stage by stage")
+    parser.add_argument('--scales', type=int, nargs='+', default=DEFAULT_SCALES)
+    parser.add_argument('--fixtures', help="replay layer_12.json/layer_19.json from this directory instead")
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true', help="store these results as the new baseline")
+    parser.add_argument('--record', metavar='DIR', help="record responses from ARCGIS_MAPSERVER_URL into DIR")
+    parser.add_argument('--minutes', type=int, default=24 * 60, help="how far back --record looks")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_stages()))
+        return
+    if args.record:
+        record_fixtures(args.record, args.minutes)
+        return
+
+    from fake_mapserver import generate_parcels, rebase_moddates
+
+    results = {}
+    if args.fixtures:
+        with open(os.path.join(args.fixtures, 'layer_12.json')) as f:
+            layer_12 = json.load(f)['features']
+        with open(os.path.join(args.fixtures, 'layer_19.json')) as f:
+            layer_19 = json.load(f)['features']
+        rebase_moddates(layer_19)
+        results[str(len(layer_12))] = benchmark_scale({12: layer_12, 19: layer_19})
+    else:
+        for scale in args.scales:
+            layer_12, layer_19 = generate_parcels(scale)
+            results[str(scale)] = benchmark_scale({12: layer_12, 19: layer_19})
+            del layer_12, layer_19
+
+    print_table(results)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline)
+    for regression in regressions:
+        print(f"⚠️ Regression: {regression}")
+
+    if args.save_baseline:
+        baseline.update(results)
+        os.makedirs(os.path.dirname(args.baseline) or '.', exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"💾 Saved baseline to {args.baseline}")
+    elif regressions:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
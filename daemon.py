@@ -0,0 +1,77 @@
+import signal
+import threading
+import time
+from datetime import datetime
+
+# Shortest gap between polls, reached after consecutive bursts of changes
+POLL_MIN_MINUTES = 1
+# Normal gap between polls during business hours
+POLL_BUSINESS_MINUTES = 5
+# Normal gap between polls outside business hours
+POLL_IDLE_MINUTES = 30
+# Longest gap between polls once nothing has changed for a while
+POLL_MAX_MINUTES = 60
+# Local hours (start inclusive, end exclusive) on weekdays that count as business hours
+BUSINESS_HOURS = (8, 18)
+# A cycle with at least this many changed PPIs counts as a burst
+BURST_THRESHOLD = 25
+# How much the gap grows after each cycle without changes
+BACKOFF_FACTOR = 1.5
+
+def is_business_hours(now):
+    """Return True on weekdays within BUSINESS_HOURS"""
+    return now.weekday() < 5 and BUSINESS_HOURS[0] <= now.hour < BUSINESS_HOURS[1]
+
+def next_poll_interval(previous_minutes, changes, now):
+    """Return the minutes to wait before the next poll
+
+    Bursts of changes shorten the gap, quiet cycles back it off towards a
+    ceiling that is lower during business hours.
+    """
+    if is_business_hours(now):
+        base, ceiling = POLL_BUSINESS_MINUTES, POLL_BUSINESS_MINUTES * 3
+    else:
+        base, ceiling = POLL_IDLE_MINUTES, POLL_MAX_MINUTES
+
+    if changes >= BURST_THRESHOLD:
+        return max(POLL_MIN_MINUTES, min(previous_minutes, base) / 2)
+    if changes:
+        return base
+    return min(max(previous_minutes, base) * BACKOFF_FACTOR, ceiling)
+
+def run_daemon(run_cycle):
+    """Call run_cycle() on an adaptive schedule until SIGTERM or SIGINT
+
+    run_cycle returns the number of changed PPIs it found (or None on
+    failure). A shutdown signal only stops the loop between cycles, so an
+    in-flight cycle always finishes and persists its watermark.
+    """
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        if not stop.is_set():
+            print(f"🛑 Received {signal.Signals(signum).name}, stopping after the current cycle")
+        stop.set()
+
+    previous_handlers = {
+        signum: signal.signal(signum, request_stop) for signum in (signal.SIGTERM, signal.SIGINT)
+    }
+
+    interval = POLL_BUSINESS_MINUTES if is_business_hours(datetime.now()) else POLL_IDLE_MINUTES
+    try:
+        while not stop.is_set():
+            started = time.monotonic()
+            try:
+                changes = run_cycle()
+            except Exception as e:
+                # A failed cycle must not take the daemon down; retry on the normal schedule
+                print(f"❌ Poll cycle failed: {e}")
+                changes = None
+            interval = next_poll_interval(interval, changes or 0, datetime.now())
+            elapsed = time.monotonic() - started
+            print(f"⏰ Cycle took {elapsed:.1f}s, next poll in {interval:.1f} minutes")
+            stop.wait(max(interval * 60 - elapsed, 0))
+    finally:
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+    print("👋 Daemon stopped")
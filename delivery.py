@@ -0,0 +1,214 @@
+"""Multi-subscriber email delivery over a pool of reused SMTP connections
+
+Each subscriber can narrow the report with saved searches (see
+alerts.py). Subscribers whose searches select the same properties share
+one rendering, and messages go out over a small pool of authenticated
+SMTP connections with rate limiting and retries. A failure for one
+recipient never blocks the others. Pointing SMTP_HOST/SMTP_PORT at a local sink (for example
+`python -m aiosmtpd -n -l localhost:1025` with SMTP_STARTTLS=false)
+exercises the whole path offline.
+"""
+import json
+import queue
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from alerts import RuleIndex, subscriber_rules
+from metrics import REGISTRY, SIZE_BUCKETS
+from report import REPORT_REGION, REPORT_TITLE, create_html_emails
+
+SMTP_HOST = "smtp.gmail.com"
+SMTP_PORT = 587
+# Authenticated connections kept open at once, overridable with SMTP_POOL_SIZE
+SMTP_POOL_SIZE = 3
+# Upper bound on messages handed to the SMTP server per second, overridable with SEND_RATE_PER_SECOND
+SEND_RATE_PER_SECOND = 2.0
+# Attempts per message before a recipient is marked as failed
+SEND_MAX_ATTEMPTS = 3
+# Subscriber list, overridable with SUBSCRIBERS_FILE; RECEIVER_EMAIL is used when it does not exist
+SUBSCRIBERS_FILE = 'subscribers.json'
+
+class SMTPConnection:
+    """Authenticated SMTP connection reused across sends, reconnecting when it goes stale"""
+
+    def __init__(self, sender_email, password, host=SMTP_HOST, port=SMTP_PORT, starttls=True):
+        self.sender_email = sender_email
+        self.password = password
+        self.host = host
+        self.port = port
+        self.starttls = starttls
+        self.server = None
+
+    def connect(self):
+        """Return a live connection, logging in again if the old one was dropped"""
+        if self.server is not None:
+            try:
+                if self.server.noop()[0] == 250:
+                    return self.server
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.close()
+        self.server = smtplib.SMTP(self.host, self.port, timeout=30)
+        if self.starttls:
+            self.server.starttls()
+        if self.password:
+            self.server.login(self.sender_email, self.password)
+        return self.server
+
+    def sendmail(self, sender_email, receiver_email, message):
+        self.connect().sendmail(sender_email, receiver_email, message)
+
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.server = None
+
+class SMTPPool:
+    """Fixed-size pool of SMTPConnections, connected lazily and reused across sends"""
+
+    def __init__(self, sender_email, password, size=SMTP_POOL_SIZE, host=SMTP_HOST, port=SMTP_PORT, starttls=True):
+        self.size = size
+        self.connections = [
+            SMTPConnection(sender_email, password, host=host, port=port, starttls=starttls) for _ in range(size)
+        ]
+        self.idle = queue.Queue()
+        for connection in self.connections:
+            self.idle.put(connection)
+
+    @contextmanager
+    def connection(self):
+        connection = self.idle.get()
+        try:
+            yield connection
+        finally:
+            self.idle.put(connection)
+
+    def close(self):
+        for connection in self.connections:
+            connection.close()
+
+class RateLimiter:
+    """Spaces calls to wait() at least 1/rate seconds apart across threads"""
+
+    def __init__(self, rate_per_second=SEND_RATE_PER_SECOND):
+        self.interval = 1.0 / rate_per_second if rate_per_second > 0 else 0.0
+        self.lock = threading.Lock()
+        self.next_slot = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+def load_subscribers(path=SUBSCRIBERS_FILE, default_email=None):
+    """Load [{'email': ..., 'filters' or 'searches': ...}] from path, falling back to a single unfiltered recipient"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return [{'email': default_email, 'filters': {}}] if default_email else []
+
+def build_message(rendered, total, sender_email, receiver_email, title=REPORT_TITLE):
+    """Wrap one rendered report part in a MIME message for a recipient"""
+    msg = MIMEMultipart('mixed' if rendered['attachments'] else 'alternative')
+    subject = f'{title} Property Report - {total} Properties Modified'
+    if rendered['parts'] > 1:
+        subject += f" (Part {rendered['part']} of {rendered['parts']})"
+    msg['Subject'] = subject
+    msg['From'] = sender_email
+    msg['To'] = receiver_email
+    # utf-8 forces base64 bodies, so minified single-line HTML never exceeds SMTP line limits
+    msg.attach(MIMEText(rendered['html'], 'html', 'utf-8'))
+    for filename, text in rendered['attachments']:
+        attachment = MIMEText(text, 'csv', 'utf-8')
+        attachment.add_header('Content-Disposition', 'attachment', filename=filename)
+        msg.attach(attachment)
+    return msg.as_string()
+
+def send_with_retry(pool, limiter, sender_email, receiver_email, message, max_attempts=SEND_MAX_ATTEMPTS):
+    """Send one message, reconnecting and retrying transient SMTP failures"""
+    for attempt in range(1, max_attempts + 1):
+        limiter.wait()
+        with pool.connection() as connection:
+            started = time.perf_counter()
+            try:
+                connection.sendmail(sender_email, receiver_email, message)
+                REGISTRY.observe('email_send_seconds', time.perf_counter() - started)
+                REGISTRY.observe('email_size_bytes', len(message), buckets=SIZE_BUCKETS)
+                return
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPAuthenticationError):
+                raise
+            except (smtplib.SMTPException, OSError):
+                REGISTRY.inc('email_send_retries_total')
+                # Drop the connection so the next attempt starts from a fresh login
+                connection.close()
+                if attempt == max_attempts:
+                    raise
+        time.sleep(2 ** (attempt - 1))
+
+def deliver_reports(report_data, start_date, end_date, subscribers, pool, sender_email, limiter=None, locations=None,
+                    title=REPORT_TITLE, region=REPORT_REGION, metric_labels=None):
+    """Send each subscriber their filtered report; returns {email: True/False}
+
+    locations maps PPIs to (longitude, latitude) for spatial saved searches;
+    title and region name the county in the subject, header and footer;
+    metric_labels label the render stage timings.
+    """
+    limiter = limiter or RateLimiter()
+
+    # Match every property against every saved search through the compiled rule index
+    started = time.perf_counter()
+    rules, owners = subscriber_rules(subscribers)
+    index = RuleIndex(rules)
+    selections = [set() for _ in subscribers]
+    locations = locations or {}
+    for position, property_data in enumerate(report_data):
+        location = locations.get(property_data.ppi)
+        for subscriber in set(owners[index.match(property_data.full_attributes, location)].tolist()):
+            selections[subscriber].add(position)
+    elapsed = time.perf_counter() - started
+    REGISTRY.observe('alert_match_seconds', elapsed)
+    print(f"🔎 Matched {len(report_data)} properties against {len(rules)} saved searches in {elapsed * 1000:.1f} ms "
+          f"({len(report_data) / elapsed if elapsed else 0:,.0f} properties/s)")
+
+    # Subscribers that select the same properties share one rendering
+    groups = {}
+    for subscriber, selected in zip(subscribers, selections):
+        groups.setdefault(tuple(sorted(selected)), []).append(subscriber['email'])
+
+    jobs = []
+    for selected, emails in groups.items():
+        if not selected:
+            print(f"📭 No matching properties for {len(emails)} subscriber(s)")
+            continue
+        subset = [report_data[position] for position in selected]
+        with REGISTRY.stage('render', metric_labels, records=len(subset)):
+            rendered = create_html_emails(subset, start_date, end_date, title=title, region=region)
+        for email in emails:
+            jobs.append((email, [build_message(part, len(subset), sender_email, email, title) for part in rendered]))
+
+    def deliver(job):
+        email, messages = job
+        try:
+            for message in messages:
+                send_with_retry(pool, limiter, sender_email, email, message)
+            REGISTRY.inc('emails_sent_total', len(messages), status='ok')
+            return email, True
+        except (smtplib.SMTPException, OSError) as e:
+            print(f"❌ Error sending email to {email}: {e}")
+            REGISTRY.inc('emails_sent_total', status='failed')
+            return email, False
+
+    with ThreadPoolExecutor(max_workers=pool.size) as executor:
+        return dict(executor.map(deliver, jobs))
@@ -0,0 +1,362 @@
+"""Daily and weekly change digests built from grouped counts
+
+A digest counts layer 19 changes per day, MODTYPE, TownName and PostCode
+without downloading the changed rows. Counts over layer 19 fields are
+computed by the MapServer itself with outStatistics and
+groupByFieldsForStatistics, one small query per day. TownName and
+PostCode only exist on layer 12, so those counts (and everything, when
+the server does not support statistics or --local is given) come from a
+vectorized local aggregator. It reads layer 19 rows already on disk from
+backfill.py and joins them to the newest layer 12 snapshot by PPI.
+
+    python digest.py daily                  # yesterday
+    python digest.py weekly --email         # the 7 days before today
+    python digest.py weekly --end 2025-06-02 --local --html digest.html
+"""
+import argparse
+import glob
+import html
+import json
+import os
+import re
+import smtplib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from email.mime.text import MIMEText
+
+import numpy as np
+import requests
+
+from arcgis_client import ArcGISError, close_session, query_layer
+from backfill import BACKFILL_DIR, CHECKPOINT_FILE, window_where
+from layer_metadata import get_layer_metadata
+from snapshot import SNAPSHOT_DIR, latest_snapshot_path, load_snapshot
+
+# Breakdowns in a digest, in display order; 'day' is the local calendar day of MODDATE
+DIMENSIONS = ('day', 'MODTYPE', 'TownName', 'PostCode')
+# Per-day statistics queries sent at the same time
+DIGEST_MAX_WORKERS = 4
+# Group label for changes whose value is missing or whose PPI is not in the snapshot
+UNKNOWN = 'Unknown'
+STATISTIC_FIELD = 'change_count'
+
+BACKFILL_FILE_PATTERN = re.compile(r'layer19_(\d+)_(\d+)\.jsonl$')
+
+def day_bounds(start, days):
+    """Return the epoch milliseconds of `days + 1` consecutive local midnights from start"""
+    midnight = datetime(start.year, start.month, start.day)
+    return [int((midnight + timedelta(days=offset)).timestamp() * 1000) for offset in range(days + 1)]
+
+def day_labels(bounds):
+    return [datetime.fromtimestamp(ms / 1000).strftime('%Y-%m-%d') for ms in bounds[:-1]]
+
+def supports_statistics(info):
+    """Return whether a layer description advertises outStatistics queries"""
+    return bool(info.get('advancedQueryCapabilities', {}).get('supportsStatistics', info.get('supportsStatistics')))
+
+# --- Server-side statistics ---
+
+def server_counts(where, group_by, layer=19):
+    """Return {(value, ...): count} of layer rows matching where, grouped by the MapServer"""
+    statistics = [{'statisticType': 'count', 'onStatisticField': 'OBJECTID', 'outStatisticFieldName': STATISTIC_FIELD}]
+    data = query_layer(layer, {
+        'where': where,
+        'outStatistics': json.dumps(statistics, separators=(',', ':')),
+        'groupByFieldsForStatistics': ','.join(group_by),
+        'returnGeometry': 'false',
+    })
+    counts = {}
+    for feature in data.get('features', []):
+        # Some servers change the case of output field names
+        attributes = {name.lower(): value for name, value in feature['attributes'].items()}
+        key = tuple(UNKNOWN if attributes.get(field.lower()) in (None, '') else attributes[field.lower()]
+                    for field in group_by)
+        counts[key] = counts.get(key, 0) + int(attributes.get(STATISTIC_FIELD) or 0)
+    return counts
+
+def server_daily_counts(bounds, group_by, max_workers=DIGEST_MAX_WORKERS):
+    """Return {(day label, value, ...): count} from one grouped statistics query per day"""
+    labels = day_labels(bounds)
+    windows = list(zip(bounds[:-1], bounds[1:]))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(lambda window: server_counts(window_where(*window), group_by), windows)
+        return {(label, *key): count for label, counts in zip(labels, results) for key, count in counts.items()}
+
+# --- Local aggregation ---
+
+def load_backfilled_changes(start_ms, end_ms, directory=BACKFILL_DIR):
+    """Return layer 19 columns {'MODDATE', 'PPI', 'MODTYPE'} for start_ms <= MODDATE < end_ms from backfill files
+
+    Only files whose window overlaps the range are read, and rows
+    backfilled more than once are counted once.
+    """
+    object_ids, moddates, ppis, modtypes = [], [], [], []
+    for path in glob.glob(os.path.join(directory, 'layer19_*.jsonl')):
+        match = BACKFILL_FILE_PATTERN.search(path)
+        if not match or int(match.group(2)) <= start_ms or int(match.group(1)) >= end_ms:
+            continue
+        with open(path) as f:
+            for line in f:
+                attributes = json.loads(line)
+                moddate = attributes.get('MODDATE')
+                if moddate is None or not start_ms <= moddate < end_ms:
+                    continue
+                object_ids.append(attributes.get('OBJECTID', -1))
+                moddates.append(moddate)
+                ppis.append(attributes.get('PPI') or '')
+                modtypes.append(attributes.get('MODTYPE') or UNKNOWN)
+
+    _, first = np.unique(np.array(object_ids, dtype=np.int64), return_index=True)
+    return {
+        'MODDATE': np.array(moddates, dtype=np.int64)[first],
+        'PPI': np.array(ppis, dtype=str)[first],
+        'MODTYPE': np.array(modtypes, dtype=str)[first],
+    }
+
+def backfill_coverage(start_ms, end_ms, directory=BACKFILL_DIR):
+    """Return whether a finished backfill checkpoint covers start_ms..end_ms"""
+    try:
+        with open(os.path.join(directory, CHECKPOINT_FILE)) as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return False
+    covered_start, covered_end = state['range']
+    return covered_start <= start_ms and end_ms <= covered_end and not any(
+        window_start < end_ms and window_end > start_ms for window_start, window_end in state['pending']
+    )
+
+def join_parcel_fields(changes, snapshot, fields):
+    """Add layer 12 columns to layer 19 change columns by looking each PPI up in a snapshot"""
+    ppis, first = np.unique(snapshot['PPI'], return_index=True)
+    if not len(ppis):
+        for field in fields:
+            changes[field] = np.full(len(changes['PPI']), UNKNOWN)
+        return changes
+    positions = np.minimum(np.searchsorted(ppis, changes['PPI']), len(ppis) - 1)
+    found = ppis[positions] == changes['PPI']
+    for field in fields:
+        values = snapshot[field][first][positions].astype(str)
+        changes[field] = np.where(found & (values != ''), values, UNKNOWN)
+    return changes
+
+def aggregate(columns, group_by):
+    """Count rows per combination of group_by columns; returns {(value, ...): count}"""
+    if not group_by or not len(columns[group_by[0]]):
+        return {}
+    uniques = []
+    codes = np.zeros(len(columns[group_by[0]]), dtype=np.int64)
+    for field in group_by:
+        values, inverse = np.unique(columns[field], return_inverse=True)
+        uniques.append(values.tolist())
+        codes = codes * len(values) + inverse
+    combined, counts = np.unique(codes, return_counts=True)
+    result = {}
+    for code, count in zip(combined.tolist(), counts.tolist()):
+        key = []
+        for values in reversed(uniques):
+            code, index = divmod(code, len(values))
+            key.append(values[index])
+        result[tuple(reversed(key))] = count
+    return result
+
+def local_daily_columns(bounds, backfill_dir=BACKFILL_DIR, snapshot_dir=SNAPSHOT_DIR, parcel_fields=()):
+    """Load backfilled changes in the digest range with a 'day' label column and any layer 12 fields
+
+    Returns None when there is nothing backfilled for the range.
+    """
+    changes = load_backfilled_changes(bounds[0], bounds[-1], backfill_dir)
+    if not len(changes['MODDATE']) and not backfill_coverage(bounds[0], bounds[-1], backfill_dir):
+        return None
+    labels = np.array(day_labels(bounds), dtype=str)
+    changes['day'] = labels[np.searchsorted(bounds, changes['MODDATE'], side='right') - 1]
+    if parcel_fields:
+        path = latest_snapshot_path(snapshot_dir)
+        if path is None:
+            return changes
+        join_parcel_fields(changes, load_snapshot(path), parcel_fields)
+    return changes
+
+# --- Digests ---
+
+def collapse(counts, position):
+    """Sum {(value, ...): count} down to {value: count} over one key position"""
+    totals = {}
+    for key, count in counts.items():
+        totals[key[position]] = totals.get(key[position], 0) + count
+    return totals
+
+def build_digest(start, days, local=False, backfill_dir=BACKFILL_DIR, snapshot_dir=SNAPSHOT_DIR,
+                 max_workers=DIGEST_MAX_WORKERS):
+    """Count changes from start's local midnight over `days` days, per dimension
+
+    Returns {'start', 'end', 'days': [labels], 'total', 'counts': {dimension: {value: count}},
+    'day_by_type': {(day, MODTYPE): count}, 'sources': {dimension: 'server'|'local'|None}, 'complete'}.
+    """
+    bounds = day_bounds(start, days)
+    info = {} if local else get_layer_metadata(19).description
+    server_fields = {field['name'] for field in info.get('fields', [])} if supports_statistics(info) else set()
+    server_dimensions = [field for field in DIMENSIONS[1:] if field in server_fields]
+
+    counts, sources, day_by_type = {}, dict.fromkeys(DIMENSIONS), {}
+    if 'MODTYPE' in server_dimensions:
+        try:
+            day_by_type = server_daily_counts(bounds, ['MODTYPE'], max_workers)
+            counts['day'], counts['MODTYPE'] = collapse(day_by_type, 0), collapse(day_by_type, 1)
+            sources['day'] = sources['MODTYPE'] = 'server'
+            for field in server_dimensions:
+                if field != 'MODTYPE':
+                    counts[field] = collapse(server_daily_counts(bounds, [field], max_workers), 1)
+                    sources[field] = 'server'
+        except (ArcGISError, requests.RequestException) as e:
+            print(f"⚠️ Server-side statistics failed, counting locally instead: {e}")
+            counts, day_by_type = {}, {}
+            sources = dict.fromkeys(DIMENSIONS)
+
+    missing = [field for field in DIMENSIONS if sources[field] is None]
+    if missing:
+        parcel_fields = [field for field in missing if field in ('TownName', 'PostCode')]
+        columns = local_daily_columns(bounds, backfill_dir, snapshot_dir, parcel_fields)
+        if columns is None:
+            print(f"⚠️ No backfilled changes in range for {', '.join(missing)}; run backfill.py to count them")
+        else:
+            if sources['day'] is None:
+                day_by_type = aggregate(columns, ['day', 'MODTYPE'])
+                counts['day'], counts['MODTYPE'] = collapse(day_by_type, 0), collapse(day_by_type, 1)
+                sources['day'] = sources['MODTYPE'] = 'local'
+            for field in missing:
+                if sources[field] is None and field in columns:
+                    counts[field] = collapse(aggregate(columns, [field]), 0)
+                    sources[field] = 'local'
+            if parcel_fields and parcel_fields[0] not in columns:
+                print(f"⚠️ No layer 12 snapshot to look up {', '.join(parcel_fields)}; run snapshot.py download")
+
+    local_sources = [field for field, source in sources.items() if source == 'local']
+    return {
+        'start': datetime.fromtimestamp(bounds[0] / 1000),
+        'end': datetime.fromtimestamp(bounds[-1] / 1000),
+        'days': day_labels(bounds),
+        'total': sum(counts.get('day', {}).values()),
+        'counts': counts,
+        'day_by_type': day_by_type,
+        'sources': sources,
+        # Local counts only see what has been backfilled
+        'complete': all(sources.values()) and (
+            not local_sources or backfill_coverage(bounds[0], bounds[-1], backfill_dir)
+        ),
+    }
+
+# --- Rendering and delivery ---
+
+def digest_title(digest):
+    if len(digest['days']) == 1:
+        return f"Daily Change Digest for {digest['start']:%B %d, %Y}"
+    last_day = digest['end'] - timedelta(days=1)
+    return f"Weekly Change Digest for {digest['start']:%B %d} - {last_day:%B %d, %Y}"
+
+def ranked(counts):
+    return sorted(counts.items(), key=lambda item: (-item[1], str(item[0])))
+
+def render_digest_html(digest):
+    """Render a digest as an HTML email in the report's style"""
+    from report import DOCUMENT_HEAD, DOCUMENT_TAIL
+
+    types = sorted({modtype for _, modtype in digest['day_by_type']})
+    parts = [
+        DOCUMENT_HEAD,
+        f'<div class="header"><h1>Summit County {html.escape(digest_title(digest))}</h1>'
+        f'<p>{digest["total"]:,} property changes</p>'
+        f'<p>Generated on {datetime.now():%B %d, %Y at %I:%M %p}</p></div>',
+    ]
+    if not digest['complete']:
+        parts.append('<div class="notice">Some counts are missing or only cover backfilled history.</div>')
+    if digest['sources']['day']:
+        parts.append('<div class="property-card"><div class="property-header"><h3>📅 Changes per Day</h3></div>'
+                     '<table class="summary-table"><tr><th>Day</th>'
+                     + ''.join(f'<th>{html.escape(str(modtype))}</th>' for modtype in types)
+                     + '<th>Total</th></tr>')
+        for day in digest['days']:
+            cells = ''.join(f"<td>{digest['day_by_type'].get((day, modtype), 0):,}</td>" for modtype in types)
+            parts.append(f"<tr><td>{day}</td>{cells}<td>{digest['counts']['day'].get(day, 0):,}</td></tr>")
+        parts.append('</table></div>')
+    for field, title in (('TownName', '📍 Changes per Town'), ('PostCode', '📮 Changes per Postal Code'),
+                         ('MODTYPE', '🛠️ Changes per Modification Type')):
+        if not digest['sources'][field]:
+            continue
+        rows = ''.join(f'<tr><td>{html.escape(str(value))}</td><td>{count:,}</td></tr>'
+                       for value, count in ranked(digest['counts'][field]))
+        parts.append(f'<div class="property-card"><div class="property-header"><h3>{title}</h3></div>'
+                     f'<table class="summary-table"><tr><th>{field}</th><th>Changes</th></tr>{rows}</table></div>')
+    parts.append(DOCUMENT_TAIL)
+    return ''.join(parts)
+
+def print_digest(digest):
+    print(f"📊 {digest_title(digest)}: {digest['total']:,} changes")
+    for field in DIMENSIONS:
+        source = digest['sources'][field]
+        if not source:
+            print(f"   {field}: not available")
+            continue
+        values = digest['counts'][field].items() if field == 'day' else ranked(digest['counts'][field])
+        print(f"   {field} ({source}): " + ', '.join(f"{value} {count:,}" for value, count in values))
+
+def send_digest(digest):
+    """Email a digest to every subscriber (unfiltered); returns {email: True/False}"""
+    from delivery import RateLimiter, load_subscribers, send_with_retry
+    from real_estate_updates import create_smtp_pool, load_config
+
+    config = load_config()
+    sender_email = config['sender_email']
+    subscribers = load_subscribers(config['subscribers_file'], config['receiver_email'])
+    body = render_digest_html(digest)
+    pool = create_smtp_pool(config)
+    limiter = RateLimiter()
+    results = {}
+    try:
+        for email in dict.fromkeys(subscriber['email'] for subscriber in subscribers):
+            msg = MIMEText(body, 'html', 'utf-8')
+            msg['Subject'] = f"Summit County {digest_title(digest)} - {digest['total']} Changes"
+            msg['From'] = sender_email
+            msg['To'] = email
+            try:
+                send_with_retry(pool, limiter, sender_email, email, msg.as_string())
+                results[email] = True
+            except (smtplib.SMTPException, OSError) as e:
+                print(f"❌ Error sending digest to {email}: {e}")
+                results[email] = False
+    finally:
+        pool.close()
+    print(f"✅ Digest sent to {sum(results.values())} of {len(results)} subscribers")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Count changes per day, town, postal code and type")
+    parser.add_argument('period', choices=['daily', 'weekly'])
+    parser.add_argument('--end', type=datetime.fromisoformat,
+                        help="day after the digest period, YYYY-MM-DD (default: today)")
+    parser.add_argument('--local', action='store_true',
+                        help="count backfilled changes only, without server-side statistics")
+    parser.add_argument('--backfill-dir', default=os.getenv('BACKFILL_DIR', BACKFILL_DIR))
+    parser.add_argument('--snapshot-dir', default=os.getenv('SNAPSHOT_DIR', SNAPSHOT_DIR))
+    parser.add_argument('--html', metavar='PATH', help="also write the digest email to this file")
+    parser.add_argument('--email', action='store_true', help="email the digest to every subscriber")
+    args = parser.parse_args()
+
+    days = 1 if args.period == 'daily' else 7
+    start = (args.end or datetime.now()) - timedelta(days=days)
+    started = time.perf_counter()
+    try:
+        digest = build_digest(start, days, local=args.local, backfill_dir=args.backfill_dir,
+                              snapshot_dir=args.snapshot_dir)
+        print_digest(digest)
+        print(f"⏱️ Counted in {time.perf_counter() - started:.2f}s")
+        if args.html:
+            with open(args.html, 'w') as f:
+                f.write(render_digest_html(digest))
+        if args.email:
+            send_digest(digest)
+    finally:
+        close_session()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+"""Owner, valuation and sale details from the county's DetailData.aspx pages
+
+Report cards link to a DetailData.aspx page per schedule, which holds the
+owner, actual and assessed values and the sales history. The enrichment
+stage fetches those pages concurrently from a bounded pool, parses the
+key fields into each record's extra fields (so they show up on cards and
+in the CSV), and keeps the parsed fields in a SQLite cache with the
+page's ETag and Last-Modified. Pages checked within
+DETAIL_CACHE_MAX_AGE_HOURS are not requested at all; older ones are
+revalidated with a conditional GET, which costs a 304 and no parsing when
+the page is unchanged.
+
+    python enrichment.py 100001 100002       # print the parsed fields of schedules
+    python enrichment.py --benchmark 500     # cold, revalidated and warm runs against a local server
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from html.parser import HTMLParser
+
+import requests
+
+from arcgis_client import (
+    DEFAULT_TIMEOUT, MAX_RETRIES, RETRY_STATUSES, close_session, get_limiter, get_session, record_response,
+    response_latency, wait_before_retry,
+)
+from metrics import REGISTRY
+
+DEFAULT_DETAIL_PAGE_URL = 'https://gis.summitcountyco.gov/map/DetailData.aspx'
+# Default location of the detail page cache, overridable with DETAIL_CACHE_FILE
+DETAIL_CACHE_FILE = 'detail_cache.sqlite3'
+# Pages checked more recently than this are used without asking the server, overridable with DETAIL_CACHE_MAX_AGE_HOURS
+DETAIL_CACHE_MAX_AGE_HOURS = 24
+# Detail pages requested at the same time, overridable with DETAIL_MAX_WORKERS
+DETAIL_MAX_WORKERS = 8
+
+# Page labels (lowercased, without the colon) and the record fields they fill
+DETAIL_LABELS = {
+    'owner name': 'Owner',
+    'owner': 'Owner',
+    'mailing address': 'MailingAddress',
+    'tax year': 'TaxYear',
+    'actual value': 'ActualValue',
+    'total actual value': 'ActualValue',
+    'assessed value': 'AssessedValue',
+    'total assessed value': 'AssessedValue',
+}
+MONEY_FIELDS = {'ActualValue', 'AssessedValue', 'LastSalePrice'}
+DATE_FORMATS = ('%m/%d/%Y', '%Y-%m-%d', '%m/%d/%y')
+
+def detail_page_url():
+    """Return the DetailData.aspx URL, overridable with DETAIL_PAGE_URL"""
+    return os.getenv('DETAIL_PAGE_URL', DEFAULT_DETAIL_PAGE_URL)
+
+def schedule_key(schedule):
+    """Return a schedule number as the string used in Schno= (layer 12 may return it as a float)"""
+    if isinstance(schedule, float) and schedule.is_integer():
+        schedule = int(schedule)
+    return str(schedule)
+
+class DetailCache:
+    """SQLite cache of parsed detail page fields and their validators, keyed by schedule"""
+
+    def __init__(self, path=DETAIL_CACHE_FILE):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "schedule TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, fields TEXT NOT NULL, checked_at REAL NOT NULL)"
+        )
+        self.connection.commit()
+
+    def get_many(self, schedules):
+        """Return {schedule: {'etag', 'last_modified', 'fields', 'checked_at'}} for cached schedules"""
+        schedules = list(schedules)
+        entries = {}
+        with self.lock:
+            for i in range(0, len(schedules), 500):
+                chunk = schedules[i:i + 500]
+                placeholders = ','.join('?' * len(chunk))
+                for schedule, etag, last_modified, fields, checked_at in self.connection.execute(
+                    f"SELECT schedule, etag, last_modified, fields, checked_at FROM pages WHERE schedule IN ({placeholders})",
+                    chunk,
+                ):
+                    entries[schedule] = {
+                        'etag': etag, 'last_modified': last_modified, 'fields': json.loads(fields), 'checked_at': checked_at,
+                    }
+        return entries
+
+    def put_many(self, rows, now=None):
+        """Store (schedule, etag, last_modified, fields) rows checked now"""
+        now = now or time.time()
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO pages (schedule, etag, last_modified, fields, checked_at) VALUES (?, ?, ?, ?, ?)",
+                [(schedule, etag, last_modified, json.dumps(fields), now) for schedule, etag, last_modified, fields in rows],
+            )
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+class TableParser(HTMLParser):
+    """Collect every table as a list of rows of (is_header, text) cells"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.tables = []
+        self.open_tables = []
+        self.cell = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'table':
+            table = []
+            self.tables.append(table)
+            self.open_tables.append(table)
+        elif tag == 'tr' and self.open_tables:
+            self.open_tables[-1].append([])
+        elif tag in ('td', 'th') and self.open_tables and self.open_tables[-1]:
+            self.cell = (tag == 'th', [])
+        elif tag == 'br' and self.cell is not None:
+            self.cell[1].append(' ')
+
+    def handle_endtag(self, tag):
+        if tag in ('td', 'th') and self.cell is not None:
+            self.open_tables[-1][-1].append((self.cell[0], ' '.join(''.join(self.cell[1]).split())))
+            self.cell = None
+        elif tag == 'table' and self.open_tables:
+            self.open_tables.pop()
+
+    def handle_data(self, data):
+        if self.cell is not None:
+            self.cell[1].append(data)
+
+def parse_money(text):
+    """Return "$1,234,500" as 1234500, or None"""
+    digits = (text or '').replace('$', '').replace(',', '').strip()
+    try:
+        return int(float(digits))
+    except ValueError:
+        return None
+
+def parse_date(text):
+    """Return a page date as YYYY-MM-DD, or None"""
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime((text or '').strip(), date_format).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    return None
+
+def parse_detail_page(markup):
+    """Extract owner, valuation and sale fields from a DetailData.aspx page
+
+    Label cells end with a colon and are followed by their value cell; the
+    sales history is the table whose header row has a "Sale Date" column.
+    """
+    parser = TableParser()
+    parser.feed(markup)
+    parser.close()
+
+    fields = {}
+    sales = []
+    for table in parser.tables:
+        if table and table[0] and all(is_header for is_header, _ in table[0]):
+            header = [text.lower() for _, text in table[0]]
+            if 'sale date' in header:
+                for row in table[1:]:
+                    values = dict(zip(header, (text for _, text in row)))
+                    date = parse_date(values.get('sale date'))
+                    if date:
+                        sales.append((date, parse_money(values.get('sale price'))))
+                continue
+        for row in table:
+            texts = [text for _, text in row]
+            for label, value in zip(texts, texts[1:]):
+                field = DETAIL_LABELS.get(label.rstrip(':').strip().lower()) if label.endswith(':') else None
+                if field and field not in fields and value:
+                    fields[field] = parse_money(value) if field in MONEY_FIELDS else value
+
+    if sales:
+        sales.sort(reverse=True)
+        fields['LastSaleDate'], fields['LastSalePrice'] = sales[0]
+    fields['SaleCount'] = len(sales)
+    return fields
+
+def fetch_detail_page(schedule, entry=None, url=None):
+    """Fetch one detail page, conditionally when a cached entry has validators
+
+    Returns ('not_modified', None, etag, last_modified) or ('fetched', fields, etag, last_modified).
+    """
+    url = url or detail_page_url()
+    headers = {}
+    if entry:
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+    session = get_session()
+    limiter = get_limiter(url)
+    attempt = 0
+    while True:
+        response = None
+        congested = True
+        slot = limiter.acquire()
+        started = time.perf_counter()
+        try:
+            response = session.get(url, params={'Schno': schedule}, headers=headers, timeout=DEFAULT_TIMEOUT)
+            record_response('detail', response, time.perf_counter() - started)
+            failure = f"HTTP {response.status_code}"
+            congested = response.status_code in RETRY_STATUSES
+            if response.status_code == 304:
+                return ('not_modified', None, response.headers.get('ETag') or entry['etag'],
+                        response.headers.get('Last-Modified') or entry['last_modified'])
+            if response.status_code not in RETRY_STATUSES:
+                response.raise_for_status()
+                return ('fetched', parse_detail_page(response.text),
+                        response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        except (requests.ConnectionError, requests.Timeout) as e:
+            record_response('detail', None, time.perf_counter() - started)
+            failure = str(e)
+        finally:
+            limiter.release(slot, ('detail', 'page'), response_latency(response), congested)
+
+        wait_before_retry(f"{url}?Schno={schedule}", attempt, MAX_RETRIES, failure, response)
+        attempt += 1
+
+def enrich_report(report_data, cache, max_workers=DETAIL_MAX_WORKERS, max_age_hours=DETAIL_CACHE_MAX_AGE_HOURS, url=None):
+    """Add detail page fields to each record's extra fields, fetching only pages the cache cannot answer
+
+    A page that fails to load falls back to its cached fields, if any, and
+    never stops the others. Returns {'cached', 'not_modified', 'fetched', 'failed'} counts.
+    """
+    now = time.time()
+    schedules = list(dict.fromkeys(
+        schedule_key(property_data.schedule) for property_data in report_data if property_data.schedule is not None
+    ))
+    entries = cache.get_many(schedules)
+    counts = dict.fromkeys(('cached', 'not_modified', 'fetched', 'failed'), 0)
+    fields_by_schedule = {}
+    to_check = []
+    for schedule in schedules:
+        entry = entries.get(schedule)
+        if entry and now - entry['checked_at'] <= max_age_hours * 3600:
+            fields_by_schedule[schedule] = entry['fields']
+            counts['cached'] += 1
+        else:
+            to_check.append(schedule)
+
+    checked = []
+    if to_check:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(fetch_detail_page, schedule, entries.get(schedule), url): schedule
+                       for schedule in to_check}
+            for future in as_completed(futures):
+                schedule = futures[future]
+                try:
+                    status, fields, etag, last_modified = future.result()
+                except requests.RequestException as e:
+                    print(f"⚠️ Could not fetch the detail page of schedule {schedule}: {e}")
+                    counts['failed'] += 1
+                    if schedule in entries:
+                        fields_by_schedule[schedule] = entries[schedule]['fields']
+                    continue
+                if status == 'not_modified':
+                    fields = entries[schedule]['fields']
+                counts[status] += 1
+                fields_by_schedule[schedule] = fields
+                checked.append((schedule, etag, last_modified, fields))
+        cache.put_many(checked, now)
+
+    for property_data in report_data:
+        fields = fields_by_schedule.get(schedule_key(property_data.schedule))
+        if fields:
+            property_data.extra = dict(property_data.extra or {}, **fields)
+
+    for status, count in counts.items():
+        if count:
+            REGISTRY.inc('detail_pages_total', count, status=status)
+    print(f"🏷️ Detail pages: {counts['cached']} cached, {counts['not_modified']} not modified, "
+          f"{counts['fetched']} fetched, {counts['failed']} failed")
+    return counts
+
+def benchmark(count, max_workers=DETAIL_MAX_WORKERS):
+    """Time cold, revalidated and warm enrichment of `count` schedules against a local fixture server"""
+    import tempfile
+    from fake_mapserver import FakeMapServer, generate_parcels
+    from property_record import PropertyRecord
+
+    layer_12, layer_19 = generate_parcels(count)
+    server = FakeMapServer({12: layer_12, 19: layer_19}, latency=0.02)
+    server.start()
+    report_data = [PropertyRecord(feature['attributes']) for feature in layer_12]
+    with tempfile.TemporaryDirectory() as directory:
+        cache = DetailCache(os.path.join(directory, 'details.sqlite3'))
+        try:
+            for name, max_age_hours in (('cold', DETAIL_CACHE_MAX_AGE_HOURS), ('revalidated', 0),
+                                        ('warm', DETAIL_CACHE_MAX_AGE_HOURS)):
+                started = time.perf_counter()
+                enrich_report(report_data, cache, max_workers=max_workers, max_age_hours=max_age_hours,
+                              url=server.detail_url)
+                print(f"⏱️ {name}: {count:,} schedules in {time.perf_counter() - started:.2f}s")
+        finally:
+            cache.close()
+            server.stop()
+            close_session()
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch and parse DetailData.aspx pages")
+    parser.add_argument('schedules', nargs='*')
+    parser.add_argument('--benchmark', type=int, metavar='N', help="enrich N synthetic schedules from a local server")
+    parser.add_argument('--max-workers', type=int, default=int(os.getenv('DETAIL_MAX_WORKERS', DETAIL_MAX_WORKERS)))
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark, max_workers=args.max_workers)
+        return
+    if not args.schedules:
+        parser.error("give schedule numbers or --benchmark N")
+    try:
+        for schedule in args.schedules:
+            _, fields, _, _ = fetch_detail_page(schedule)
+            print(f"{schedule}  {json.dumps(fields)}")
+    finally:
+        close_session()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,728 @@
+"""Local stand-in for the Summit County ArcGIS MapServer
+
+Serves layers 12 and 19 from fixture JSON (or synthetic parcels) with the
+query features the pipeline relies on: WHERE clauses, outFields,
+orderByFields, resultOffset paging with exceededTransferLimit,
+returnCountOnly, returnIdsOnly, grouped outStatistics, and layer 19
+parcel shapes with returnExtentOnly and quantizationParameters. It also
+serves a DetailData.aspx page per layer 12 schedule, rendered from
+fixtures/detail_page.html, with ETag/Last-Modified validators. Point the pipeline at it with
+
+    python fake_mapserver.py --port 8765
+    ARCGIS_MAPSERVER_URL=http://127.0.0.1:8765/arcgis/rest/services/ParcelQueryTool/SummitMap1_Pro321/MapServer python real_estate_updates.py
+"""
+import argparse
+import gzip
+import hashlib
+import html
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from string import Template
+from urllib.parse import parse_qs, urlparse
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+SERVICE_PATH = "/arcgis/rest/services/ParcelQueryTool/SummitMap1_Pro321/MapServer"
+DETAIL_PATH = "/map/DetailData.aspx"
+MAX_RECORD_COUNT = 1000
+
+TOWNS = [
+    ('BRECKENRIDGE', '80424'),
+    ('FRISCO', '80443'),
+    ('SILVERTHORNE', '80498'),
+    ('DILLON', '80435'),
+    ('KEYSTONE', '80435'),
+    ('BLUE RIVER', '80424'),
+]
+OWNER_NAMES = ['SMITH JOHN', 'GARCIA MARIA', 'PEAK HOLDINGS LLC', 'NGUYEN TRAN', 'MILLER FAMILY TRUST',
+               'JOHNSON ROBERT & LINDA', 'SUMMIT RENTALS LLC', 'BROWN DAVID']
+STREETS = ['MAIN ST', 'FRENCH ST', 'RIDGE ST', 'GRANITE ST', 'COUNTY ROAD 450', 'SWAN MOUNTAIN RD', 'PEAK ONE DR']
+# Approximate town centres (longitude, latitude) that synthetic parcels are scattered around
+TOWN_CENTERS = {
+    'BRECKENRIDGE': (-106.0384, 39.4817),
+    'FRISCO': (-106.0975, 39.5744),
+    'SILVERTHORNE': (-106.0717, 39.6297),
+    'DILLON': (-106.0434, 39.6303),
+    'KEYSTONE': (-105.9547, 39.6050),
+    'BLUE RIVER': (-106.0328, 39.4461),
+}
+GARAGE_TYPES = ['Attached', 'Detached', 'Built-In', 'Carport', None]
+BASEMENT_TYPES = ['Full', 'Partial', 'Crawl', 'None', None]
+
+# --- WHERE clause evaluation ---
+
+TOKEN_PATTERN = re.compile(r"""
+    \s*(?:
+        (?P<string>'(?:[^']|'')*')
+      | (?P<number>-?\d+(?:\.\d+)?)
+      | (?P<op>>=|<=|<>|!=|=|>|<)
+      | (?P<punct>[(),])
+      | (?P<word>[A-Za-z_][A-Za-z0-9_.]*)
+    )""", re.VERBOSE)
+
+def tokenize(where):
+    """Split an ArcGIS SQL WHERE clause into (kind, value) tokens"""
+    tokens = []
+    position = 0
+    where = where.strip()
+    while position < len(where):
+        match = TOKEN_PATTERN.match(where, position)
+        if not match or match.end() == position:
+            raise ValueError(f"Unsupported WHERE syntax near: {where[position:]!r}")
+        position = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'string':
+            value = value[1:-1].replace("''", "'")
+        elif kind == 'number':
+            value = float(value) if '.' in value else int(value)
+        elif kind == 'word' and value.upper() in ('AND', 'OR', 'NOT', 'IN', 'IS', 'NULL', 'DATE', 'TIMESTAMP', 'BETWEEN'):
+            kind, value = 'keyword', value.upper()
+        tokens.append((kind, value))
+    return tokens
+
+def date_literal_to_ms(text):
+    """Convert a DATE/TIMESTAMP literal to epoch milliseconds (UTC)"""
+    for pattern in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d'):
+        try:
+            parsed = datetime.strptime(text, pattern).replace(tzinfo=timezone.utc)
+            return int(parsed.timestamp() * 1000)
+        except ValueError:
+            continue
+    raise ValueError(f"Unsupported date literal: {text!r}")
+
+class WhereParser:
+    """Recursive descent parser compiling a WHERE clause into a predicate over attributes"""
+
+    COMPARISONS = {
+        '=': lambda a, b: a == b,
+        '<>': lambda a, b: a != b,
+        '!=': lambda a, b: a != b,
+        '>': lambda a, b: a is not None and b is not None and a > b,
+        '<': lambda a, b: a is not None and b is not None and a < b,
+        '>=': lambda a, b: a is not None and b is not None and a >= b,
+        '<=': lambda a, b: a is not None and b is not None and a <= b,
+    }
+
+    def __init__(self, where):
+        self.tokens = tokenize(where)
+        self.position = 0
+
+    def simple_in(self):
+        """Return (field, values) if the whole clause is `field IN (literal, ...)`, else None"""
+        tokens = self.tokens
+        if len(tokens) < 5 or tokens[0][0] != 'word' or tokens[1] != ('keyword', 'IN') or tokens[2] != ('punct', '('):
+            return None
+        if tokens[-1] != ('punct', ')'):
+            return None
+        values = set()
+        for position, (kind, value) in enumerate(tokens[3:-1]):
+            if position % 2 == 0 and kind in ('string', 'number'):
+                values.add(value)
+            elif position % 2 == 1 and (kind, value) == ('punct', ','):
+                continue
+            else:
+                return None
+        return tokens[0][1], values
+
+    def parse(self):
+        if not self.tokens:
+            return lambda attributes: True
+        predicate = self.parse_or()
+        if self.position != len(self.tokens):
+            raise ValueError(f"Unexpected token {self.tokens[self.position][1]!r}")
+        return predicate
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def take(self, kind=None, value=None):
+        token = self.peek()
+        if (kind and token[0] != kind) or (value is not None and token[1] != value):
+            raise ValueError(f"Expected {value or kind}, found {token[1]!r}")
+        self.position += 1
+        return token
+
+    def accept(self, kind, value):
+        if self.peek() == (kind, value):
+            self.position += 1
+            return True
+        return False
+
+    def parse_or(self):
+        terms = [self.parse_and()]
+        while self.accept('keyword', 'OR'):
+            terms.append(self.parse_and())
+        return terms[0] if len(terms) == 1 else (lambda attributes: any(term(attributes) for term in terms))
+
+    def parse_and(self):
+        terms = [self.parse_not()]
+        while self.accept('keyword', 'AND'):
+            terms.append(self.parse_not())
+        return terms[0] if len(terms) == 1 else (lambda attributes: all(term(attributes) for term in terms))
+
+    def parse_not(self):
+        if self.accept('keyword', 'NOT'):
+            term = self.parse_not()
+            return lambda attributes: not term(attributes)
+        if self.accept('punct', '('):
+            term = self.parse_or()
+            self.take('punct', ')')
+            return term
+        return self.parse_comparison()
+
+    def parse_operand(self):
+        kind, value = self.take()
+        if kind == 'keyword' and value in ('DATE', 'TIMESTAMP'):
+            literal = date_literal_to_ms(self.take('string')[1])
+            return lambda attributes: literal
+        if kind == 'word':
+            return lambda attributes: attributes.get(value)
+        if kind in ('string', 'number'):
+            return lambda attributes: value
+        raise ValueError(f"Unexpected token {value!r}")
+
+    def parse_comparison(self):
+        left = self.parse_operand()
+        if self.accept('keyword', 'IS'):
+            negate = self.accept('keyword', 'NOT')
+            self.take('keyword', 'NULL')
+            return lambda attributes: (left(attributes) is None) != negate
+        negate = self.accept('keyword', 'NOT')
+        if self.accept('keyword', 'IN'):
+            self.take('punct', '(')
+            values = {self.parse_operand()({})}
+            while self.accept('punct', ','):
+                values.add(self.parse_operand()({}))
+            self.take('punct', ')')
+            return lambda attributes: (left(attributes) in values) != negate
+        if self.accept('keyword', 'BETWEEN'):
+            low = self.parse_operand()
+            self.take('keyword', 'AND')
+            high = self.parse_operand()
+            compare = self.COMPARISONS['>='], self.COMPARISONS['<=']
+            return lambda attributes: (
+                compare[0](left(attributes), low(attributes)) and compare[1](left(attributes), high(attributes))
+            ) != negate
+        operator = self.COMPARISONS[self.take('op')[1]]
+        right = self.parse_operand()
+        return lambda attributes: operator(left(attributes), right(attributes))
+
+# --- Fixture data ---
+
+def load_fixture(layer):
+    """Load a layer's features from fixtures/layer_<layer>.json"""
+    with open(os.path.join(FIXTURES_DIR, f'layer_{layer}.json')) as f:
+        return json.load(f)['features']
+
+def rebase_moddates(layer_19_features, now_ms=None):
+    """Shift fixture MODDATEs so the newest one lands a minute before now"""
+    moddates = [feature['attributes']['MODDATE'] for feature in layer_19_features]
+    if not moddates:
+        return
+    now_ms = now_ms or int(time.time() * 1000)
+    shift = now_ms - 60_000 - max(moddates)
+    for feature in layer_19_features:
+        feature['attributes']['MODDATE'] += shift
+
+def parcel_ring(rng, town):
+    """Return a small clockwise WGS84 rectangle within a few kilometres of a town centre"""
+    lon, lat = TOWN_CENTERS[town]
+    x = round(lon + rng.uniform(-0.03, 0.03), 7)
+    y = round(lat + rng.uniform(-0.02, 0.02), 7)
+    width = round(rng.uniform(0.0003, 0.0015), 7)
+    height = round(rng.uniform(0.0002, 0.001), 7)
+    return [[x, y], [x, y + height], [x + width, y + height], [x + width, y], [x, y]]
+
+def generate_parcels(count, seed=0, now_ms=None, window_ms=30 * 60_000):
+    """Generate synthetic layer 12 and layer 19 features for `count` parcels
+
+    Layer 19 MODDATEs are spread over the `window_ms` before `now_ms`, and
+    each layer 19 parcel gets a rectangular shape near its town.
+    """
+    rng = random.Random(seed)
+    # Shapes come from their own generator so attributes stay the same for a given seed
+    shape_rng = random.Random(seed + 1)
+    now_ms = now_ms or int(time.time() * 1000)
+    layer_12, layer_19 = [], []
+    for i in range(count):
+        ppi = f"{6500 + i // 100000:04d}-{(i // 1000) % 100:02d}{(i // 10) % 100:02d}-{i % 10:02d}-{i % 1000:03d}"
+        town, post_code = rng.choice(TOWNS)
+        house = rng.randint(1, 9999)
+        street = rng.choice(STREETS)
+        living = rng.choice([-1, rng.randint(400, 6500)])
+        acres = round(rng.uniform(0.02, 40), 3)
+        full_bath = rng.randint(0, 5)
+        layer_12.append({'attributes': {
+            'PPI': ppi,
+            'Schedule': 100000 + i,
+            'Filing': str(rng.randint(1, 12)),
+            'Phase': str(rng.randint(1, 4)),
+            'ShortDesc': f"LOT {rng.randint(1, 200)} {town.title()} SUBDIVISION",
+            'HouseNum': str(house),
+            'FullStreet': street,
+            'StreetName': street.rsplit(' ', 1)[0],
+            'TownName': town,
+            'PostCode': post_code,
+            'FullAdd': f"{house} {street} {town}",
+            'TotAcres': acres,
+            'SquareFeet': int(acres * 43560),
+            'SqeFtLiving': living,
+            'BsmtType': rng.choice(BASEMENT_TYPES),
+            'GarageType': rng.choice(GARAGE_TYPES),
+            'NumOfCars': rng.randint(0, 4),
+            'GarSqFt': rng.randint(0, 900),
+            'NumOfRms': rng.randint(1, 14),
+            'NumBedRms': rng.randint(0, 7),
+            'NumLofts': rng.randint(0, 2),
+            'NumKitch': rng.randint(0, 2),
+            'MasterBath': rng.randint(0, 2),
+            'FullBath': full_bath,
+            'TotBath': full_bath + rng.choice([0, 0.5, 0.75]),
+        }})
+        layer_19.append({'attributes': {
+            'OBJECTID': i + 1,
+            'PPI': ppi,
+            'SOURCE': 1,
+            'MODDATE': now_ms - rng.randint(0, window_ms),
+            'MODTYPE': rng.choice(['Attribute', 'Geometry', 'New']),
+            'METHOD': rng.choice(['Edit', 'Split', 'Merge']),
+            'OPERATOR': rng.choice(['ASSESSOR', 'GIS']),
+        }, 'geometry': {'rings': [parcel_ring(shape_rng, town)]}})
+    return layer_12, layer_19
+
+# --- Query execution ---
+
+def first_value(params, name, default=None):
+    values = params.get(name)
+    return values[0] if values and values[0] != '' else default
+
+def layer_metadata(layer, features, max_record_count, supports_statistics=True):
+    """Return a minimal layer description in the shape of MapServer/<layer>?f=json"""
+    field_names = list(features[0]['attributes']) if features else []
+    return {
+        'currentVersion': 10.91,
+        'id': layer,
+        'name': {12: 'Schedule', 19: 'Parcel'}.get(layer, f'Layer {layer}'),
+        'type': 'Table' if layer == 12 else 'Feature Layer',
+        'maxRecordCount': max_record_count,
+        'supportsAdvancedQueries': True,
+        'advancedQueryCapabilities': {
+            'supportsPagination': True,
+            'supportsOrderBy': True,
+            'supportsStatistics': supports_statistics,
+            'supportsReturningQueryExtent': True,
+        },
+        'fields': [{'name': name, 'type': 'esriFieldTypeString'} for name in field_names],
+    }
+
+def sort_key(value):
+    return (value is None, 0 if value is None else value)
+
+class LayerStore:
+    """A layer's features plus the indexes and result caches that keep large fixtures fast"""
+
+    # Number of recent (where, objectIds, orderByFields) results kept for paging
+    RESULT_CACHE_SIZE = 16
+
+    def __init__(self, features):
+        self.features = features
+        self.lock = threading.Lock()
+        self.field_indexes = {}
+        self.results = OrderedDict()
+
+    def field_index(self, field):
+        """Return {value: [features]} for a field, built on first use"""
+        with self.lock:
+            index = self.field_indexes.get(field)
+            if index is None:
+                index = {}
+                for feature in self.features:
+                    index.setdefault(feature['attributes'].get(field), []).append(feature)
+                self.field_indexes[field] = index
+            return index
+
+    def select(self, where, object_ids, order_by):
+        """Return the features matching a query, sorted, reusing recent results while paging"""
+        key = (where, object_ids, order_by)
+        with self.lock:
+            if key in self.results:
+                self.results.move_to_end(key)
+                return self.results[key]
+
+        parser = WhereParser(where)
+        simple_in = parser.simple_in()
+        if simple_in and not object_ids:
+            field, values = simple_in
+            index = self.field_index(field)
+            matches = [feature for value in values for feature in index.get(value, [])]
+        else:
+            predicate = parser.parse()
+            if object_ids:
+                wanted = {int(object_id) for object_id in object_ids.split(',')}
+                matches = [f for f in self.features if f['attributes'].get('OBJECTID') in wanted and predicate(f['attributes'])]
+            else:
+                matches = [f for f in self.features if predicate(f['attributes'])]
+
+        if order_by:
+            for clause in reversed(order_by.split(',')):
+                parts = clause.split()
+                if not parts:
+                    continue
+                field = parts[0]
+                descending = len(parts) > 1 and parts[1].upper() == 'DESC'
+                matches.sort(key=lambda f: sort_key(f['attributes'].get(field)), reverse=descending)
+
+        with self.lock:
+            self.results[key] = matches
+            if len(self.results) > self.RESULT_CACHE_SIZE:
+                self.results.popitem(last=False)
+        return matches
+
+def average(values):
+    return sum(values) / len(values) if values else None
+
+# statisticType -> function of the non-null values of a field
+STATISTICS = {
+    'count': len,
+    'sum': sum,
+    'min': lambda values: min(values, default=None),
+    'max': lambda values: max(values, default=None),
+    'avg': average,
+}
+
+def run_statistics(matches, out_statistics, group_by):
+    """Compute outStatistics over matching features, one output feature per group"""
+    statistics = json.loads(out_statistics)
+    fields = [field.strip() for field in (group_by or '').split(',') if field.strip()]
+    groups = {}
+    for feature in matches:
+        attributes = feature['attributes']
+        groups.setdefault(tuple(attributes.get(field) for field in fields), []).append(attributes)
+    if not fields and not groups:
+        groups[()] = []
+    features = []
+    for key, rows in groups.items():
+        attributes = dict(zip(fields, key))
+        for statistic in statistics:
+            function = STATISTICS.get(statistic['statisticType'].lower())
+            if function is None:
+                raise ValueError(f"Unsupported statisticType: {statistic['statisticType']!r}")
+            field = statistic['onStatisticField']
+            name = statistic.get('outStatisticFieldName') or f"{statistic['statisticType']}_{field}"
+            attributes[name] = function([row[field] for row in rows if row.get(field) is not None])
+        features.append({'attributes': attributes})
+    return {'displayFieldName': '', 'features': features}
+
+def geometry_extent(features):
+    """Return the bounding box of the features' rings as an ArcGIS extent"""
+    xs = [x for f in features if f.get('geometry') for ring in f['geometry']['rings'] for x, _ in ring]
+    ys = [y for f in features if f.get('geometry') for ring in f['geometry']['rings'] for _, y in ring]
+    if not xs:
+        return {'xmin': None, 'ymin': None, 'xmax': None, 'ymax': None, 'spatialReference': {'wkid': 4326}}
+    return {'xmin': min(xs), 'ymin': min(ys), 'xmax': max(xs), 'ymax': max(ys), 'spatialReference': {'wkid': 4326}}
+
+def quantization_transform(quantization):
+    """Return the response transform for quantizationParameters"""
+    extent = quantization['extent']
+    upper_left = quantization.get('originPosition', 'upperLeft') == 'upperLeft'
+    tolerance = quantization['tolerance']
+    return {
+        'originPosition': 'upperLeft' if upper_left else 'lowerLeft',
+        'scale': [tolerance, tolerance],
+        'translate': [extent['xmin'], extent['ymax'] if upper_left else extent['ymin']],
+    }
+
+def quantize_rings(rings, transform):
+    """Snap rings to the quantization grid, delta-encoding each vertex after the first of its ring"""
+    (scale_x, scale_y), (origin_x, origin_y) = transform['scale'], transform['translate']
+    flip = transform['originPosition'] == 'upperLeft'
+    encoded = []
+    for ring in rings:
+        points, previous = [], None
+        for x, y in ring:
+            point = (round((x - origin_x) / scale_x), round(((origin_y - y) if flip else (y - origin_y)) / scale_y))
+            if previous is None:
+                points.append(list(point))
+            elif point != previous:
+                points.append([point[0] - previous[0], point[1] - previous[1]])
+            else:
+                continue
+            previous = point
+        encoded.append(points)
+    return encoded
+
+def output_feature(feature, names, return_geometry, transform):
+    """Shape one stored feature as a query result with the requested fields and geometry"""
+    attributes = feature['attributes']
+    if names is not None:
+        attributes = {name: attributes.get(name) for name in names}
+    geometry = feature.get('geometry') if return_geometry else None
+    if geometry is None:
+        return {'attributes': attributes}
+    if transform is not None:
+        geometry = {'rings': quantize_rings(geometry['rings'], transform)}
+    return {'attributes': attributes, 'geometry': geometry}
+
+def run_query(store, params, max_record_count, supports_statistics=True):
+    """Execute an ArcGIS-style query over a LayerStore"""
+    matches = store.select(
+        first_value(params, 'where', ''), first_value(params, 'objectIds'), first_value(params, 'orderByFields')
+    )
+
+    out_statistics = first_value(params, 'outStatistics')
+    if out_statistics:
+        if not supports_statistics:
+            raise ValueError("Statistics are not supported by this layer")
+        return run_statistics(matches, out_statistics, first_value(params, 'groupByFieldsForStatistics'))
+
+    if first_value(params, 'returnCountOnly', 'false').lower() == 'true':
+        return {'count': len(matches)}
+    if first_value(params, 'returnIdsOnly', 'false').lower() == 'true':
+        return {'objectIdFieldName': 'OBJECTID', 'objectIds': [f['attributes'].get('OBJECTID') for f in matches]}
+    # Shapes are stored and served in WGS84, whatever outSR asks for; maxAllowableOffset is ignored
+    if first_value(params, 'returnExtentOnly', 'false').lower() == 'true':
+        return {'extent': geometry_extent(matches)}
+
+    offset = int(first_value(params, 'resultOffset', 0))
+    page_size = min(int(first_value(params, 'resultRecordCount', max_record_count)), max_record_count)
+    page = matches[offset:offset + page_size]
+
+    out_fields = first_value(params, 'outFields', '*')
+    names = None if out_fields.strip() == '*' else [name.strip() for name in out_fields.split(',') if name.strip()]
+    return_geometry = first_value(params, 'returnGeometry', 'true').lower() == 'true'
+    quantization = first_value(params, 'quantizationParameters')
+    transform = quantization_transform(json.loads(quantization)) if return_geometry and quantization else None
+
+    result = {}
+    if return_geometry and any('geometry' in f for f in page):
+        result.update(geometryType='esriGeometryPolygon', spatialReference={'wkid': 4326})
+        if transform is not None:
+            result['transform'] = transform
+    result['features'] = [output_feature(f, names, return_geometry, transform) for f in page]
+    if offset + page_size < len(matches):
+        result['exceededTransferLimit'] = True
+    return result
+
+# --- Detail pages ---
+
+_detail_template = None
+
+def render_detail_page(attributes, version=0):
+    """Render a DetailData.aspx page for a layer 12 record and return (html, last modified datetime)
+
+    The page content is derived from the schedule and version, so it only
+    changes when the version is bumped.
+    """
+    global _detail_template
+    if _detail_template is None:
+        with open(os.path.join(FIXTURES_DIR, 'detail_page.html')) as f:
+            _detail_template = Template(f.read())
+    schedule = attributes.get('Schedule')
+    rng = random.Random(f"{schedule}/{version}")
+    actual_value = rng.randrange(250_000, 4_000_000, 1_000)
+    sale_date = datetime(2025, 6, 1) - timedelta(days=rng.randint(30, 8000))
+    sales = []
+    for number in range(rng.randint(0, 4)):
+        price = actual_value * rng.uniform(0.5, 1.1) / (1.04 ** number)
+        sales.append(
+            f'  <tr><td>{rng.randint(100000, 1400000)}</td><td>{sale_date:%m/%d/%Y}</td>'
+            f'<td>${price:,.0f}</td><td>{rng.choice(["WD", "SWD", "QCD"])}</td></tr>'
+        )
+        sale_date -= timedelta(days=rng.randint(200, 3000))
+    page = _detail_template.substitute(
+        schedule=schedule,
+        owner=html.escape(rng.choice(OWNER_NAMES)),
+        mailing_address=html.escape(f"PO BOX {rng.randint(1, 9999)} {attributes.get('TownName') or ''} CO"),
+        address=html.escape(attributes.get('FullAdd') or ''),
+        tax_year=2025,
+        tax_area=rng.choice(['1200', '1300', '2100', '3500']),
+        actual_value=f"${actual_value:,}",
+        assessed_value=f"${round(actual_value * 0.0625):,}",
+        sales='\n'.join(sales),
+    )
+    last_modified = datetime(2025, 1, 1, tzinfo=timezone.utc) + timedelta(days=version)
+    return page, last_modified
+
+class FakeMapServer:
+    """Threaded HTTP server answering MapServer layer and query requests and detail pages"""
+
+    def __init__(self, layers, port=0, max_record_count=MAX_RECORD_COUNT, latency=0.0, error_rate=0.0,
+                 supports_statistics=True, capacity=None):
+        self.layers = {layer: LayerStore(features) for layer, features in layers.items()}
+        self.max_record_count = max_record_count
+        self.supports_statistics = supports_statistics
+        self.latency = latency
+        self.error_rate = error_rate
+        # Requests handled at once before further ones are answered with HTTP 429
+        self.capacity = capacity
+        self.active = 0
+        self.active_lock = threading.Lock()
+        self.request_count = 0
+        # Bump a schedule's version to change its detail page
+        self.detail_versions = {}
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), self.make_handler())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}{SERVICE_PATH}"
+
+    @property
+    def detail_url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}{DETAIL_PATH}"
+
+    def start(self):
+        """Serve in a background thread and return the MapServer URL"""
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body are separate writes; with Nagle on, keep-alive requests stall on delayed ACKs
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                self.respond(parsed.path, parse_qs(parsed.query, keep_blank_values=True))
+
+            def do_POST(self):
+                parsed = urlparse(self.path)
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length).decode('utf-8')
+                params = parse_qs(parsed.query, keep_blank_values=True)
+                params.update(parse_qs(body, keep_blank_values=True))
+                self.respond(parsed.path, params)
+
+            def respond(self, path, params):
+                server.request_count += 1
+                with server.active_lock:
+                    throttled = server.capacity is not None and server.active >= server.capacity
+                    if not throttled:
+                        server.active += 1
+                if throttled:
+                    return self.send_json({'error': {'code': 429, 'message': 'Too many requests'}}, status=429)
+                try:
+                    self.handle_request(path, params)
+                finally:
+                    with server.active_lock:
+                        server.active -= 1
+
+            def handle_request(self, path, params):
+                if server.latency:
+                    time.sleep(server.latency)
+                if server.error_rate and random.random() < server.error_rate:
+                    return self.send_json({'error': {'code': 503, 'message': 'Injected failure'}}, status=503,
+                                          headers={'Retry-After': '1'})
+
+                if path == DETAIL_PATH:
+                    return self.send_detail_page(first_value(params, 'Schno', ''))
+                match = re.search(r'/MapServer/(\d+)(/query)?/?$', path)
+                if not match or int(match.group(1)) not in server.layers:
+                    return self.send_json({'error': {'code': 400, 'message': 'Invalid URL'}})
+                layer = int(match.group(1))
+                store = server.layers[layer]
+                if not match.group(2):
+                    return self.send_json(layer_metadata(layer, store.features, server.max_record_count,
+                                                         server.supports_statistics))
+                try:
+                    return self.send_json(run_query(store, params, server.max_record_count, server.supports_statistics))
+                except (ValueError, KeyError) as e:
+                    return self.send_json({'error': {'code': 400, 'message': str(e)}})
+
+            def send_detail_page(self, schedule):
+                store = server.layers.get(12)
+                records = store.field_index('Schedule').get(int(schedule)) if store and schedule.isdigit() else None
+                if not records:
+                    return self.send_body(b'<html><body>Schedule not found</body></html>', 'text/html', status=404)
+                version = server.detail_versions.get(int(schedule), 0)
+                page, last_modified = render_detail_page(records[0]['attributes'], version)
+                etag = '"' + hashlib.sha1(page.encode('utf-8')).hexdigest()[:16] + '"'
+                validators = {'ETag': etag, 'Last-Modified': format_datetime(last_modified, usegmt=True)}
+                if_none_match = self.headers.get('If-None-Match')
+                if_modified_since = self.headers.get('If-Modified-Since')
+                if if_none_match is not None:
+                    not_modified = etag in [tag.strip() for tag in if_none_match.split(',')]
+                else:
+                    try:
+                        not_modified = bool(if_modified_since) and parsedate_to_datetime(if_modified_since) >= last_modified
+                    except (TypeError, ValueError):
+                        not_modified = False
+                if not_modified:
+                    self.send_response(304)
+                    for name, value in validators.items():
+                        self.send_header(name, value)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_body(page.encode('utf-8'), 'text/html', headers=validators)
+
+            def send_json(self, payload, status=200, headers=None):
+                self.send_body(json.dumps(payload, separators=(',', ':')).encode('utf-8'), 'application/json',
+                               status=status, headers=headers)
+
+            def send_body(self, body, content_type, status=200, headers=None):
+                gzipped = 'gzip' in self.headers.get('Accept-Encoding', '')
+                if gzipped:
+                    body = gzip.compress(body, compresslevel=5)
+                self.send_response(status)
+                self.send_header('Content-Type', f'{content_type}; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                if gzipped:
+                    self.send_header('Content-Encoding', 'gzip')
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the Summit County MapServer")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--synthetic', type=int, metavar='N', help="serve N generated parcels instead of the fixtures")
+    parser.add_argument('--no-rebase', action='store_true', help="keep fixture MODDATEs instead of shifting them to now")
+    parser.add_argument('--max-record-count', type=int, default=MAX_RECORD_COUNT)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds of delay added to every request")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests answered with HTTP 503")
+    parser.add_argument('--no-statistics', action='store_true', help="reject outStatistics queries")
+    parser.add_argument('--capacity', type=int, help="answer requests beyond this many at once with HTTP 429")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        layer_12, layer_19 = generate_parcels(args.synthetic)
+    else:
+        layer_12, layer_19 = load_fixture(12), load_fixture(19)
+        if not args.no_rebase:
+            rebase_moddates(layer_19)
+
+    server = FakeMapServer({12: layer_12, 19: layer_19}, port=args.port, max_record_count=args.max_record_count,
+                           latency=args.latency, error_rate=args.error_rate,
+                           supports_statistics=not args.no_statistics, capacity=args.capacity)
+    print(f"🗺️ Serving {len(layer_12)} parcels at {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
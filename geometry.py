@@ -0,0 +1,307 @@
+"""Parcel locations from layer 19 shapes, fetched once and cached by PPI
+
+Spatial saved searches ("near" a point, "within" a polygon; see
+alerts.py) need to know where each changed parcel is, but the layer 19
+shapes are far larger than the attributes. Shapes are therefore asked
+for in WGS84 with maxAllowableOffset, which lets the server drop
+vertices closer than about a metre, and with quantizationParameters,
+which turns coordinates into small delta-encoded integers. Each shape is
+decoded once into a centroid and bounding box and stored in a SQLite
+cache, so a poll only fetches PPIs the cache has never seen or holds
+for longer than GEOMETRY_CACHE_TTL_DAYS.
+
+    python geometry.py download              # prefetch every parcel once
+    python geometry.py locate 6500-0000-01-001
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+from arcgis_client import close_session
+from sources import DEFAULT_SOURCE, in_clause
+
+# Default location of the geometry cache, overridable with GEOMETRY_CACHE_FILE
+GEOMETRY_CACHE_FILE = 'parcel_geometry.sqlite3'
+# Parcel shapes older than this are re-fetched, overridable with GEOMETRY_CACHE_TTL_DAYS
+GEOMETRY_CACHE_TTL_DAYS = 30
+# Generalization and quantization step in degrees (about a metre)
+GEOMETRY_RESOLUTION = 1e-5
+# Number of PPIs per PPI IN (...) geometry query
+GEOMETRY_BATCH_SIZE = 250
+# Number of geometry queries sent at the same time
+GEOMETRY_MAX_WORKERS = 4
+WGS84 = 4326
+
+class GeometryCache:
+    """SQLite cache of parcel centroids and bounding boxes keyed by PPI
+
+    A PPI fetched without a shape is stored with NULL coordinates, so it
+    is not asked for again until it expires.
+    """
+
+    def __init__(self, path=GEOMETRY_CACHE_FILE, ttl_days=GEOMETRY_CACHE_TTL_DAYS):
+        self.ttl_seconds = ttl_days * 86400
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS locations ("
+            "ppi TEXT PRIMARY KEY, x REAL, y REAL, xmin REAL, ymin REAL, xmax REAL, ymax REAL, "
+            "fetched_at REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.connection.commit()
+
+    def get_many(self, ppis, now=None):
+        """Return ({ppi: (longitude, latitude) or None} for fresh entries, [ppis that must be fetched])"""
+        now = now or time.time()
+        ppis = list(dict.fromkeys(ppis))
+        found = {}
+        with self.lock:
+            for i in range(0, len(ppis), 500):
+                chunk = ppis[i:i + 500]
+                placeholders = ','.join('?' * len(chunk))
+                found.update(
+                    (ppi, (x, y, fetched_at)) for ppi, x, y, fetched_at in self.connection.execute(
+                        f"SELECT ppi, x, y, fetched_at FROM locations WHERE ppi IN ({placeholders})", chunk
+                    )
+                )
+        fresh, to_fetch = {}, []
+        for ppi in ppis:
+            entry = found.get(ppi)
+            if entry is None or now - entry[2] > self.ttl_seconds:
+                to_fetch.append(ppi)
+            else:
+                fresh[ppi] = None if entry[0] is None else (entry[0], entry[1])
+        return fresh, to_fetch
+
+    def put_many(self, locations, missing=(), now=None):
+        """Store (ppi, x, y, xmin, ymin, xmax, ymax) rows, and PPIs that came back without a shape"""
+        now = now or time.time()
+        rows = [(*location, now) for location in locations]
+        rows.extend((ppi, None, None, None, None, None, None, now) for ppi in missing)
+        with self.lock:
+            self.connection.executemany("INSERT OR REPLACE INTO locations VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.connection.commit()
+
+    def get_meta(self, key):
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_meta(self, key, value):
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, json.dumps(value)))
+            self.connection.commit()
+
+    def count(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM locations WHERE x IS NOT NULL").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+def dequantize(rings, transform):
+    """Turn delta-encoded quantized rings back into coordinate rings"""
+    (scale_x, scale_y), (origin_x, origin_y) = transform['scale'][:2], transform['translate'][:2]
+    sign_y = -1 if transform.get('originPosition', 'upperLeft') == 'upperLeft' else 1
+    decoded = []
+    for ring in rings:
+        x = y = 0
+        points = []
+        for dx, dy in ring:
+            x += dx
+            y += dy
+            points.append((origin_x + x * scale_x, origin_y + sign_y * y * scale_y))
+        decoded.append(points)
+    return decoded
+
+def summarize_rings(rings):
+    """Return (x, y, xmin, ymin, xmax, ymax): the area-weighted centroid and bounding box of a polygon
+
+    Holes wind the other way and so subtract from the area. Degenerate
+    shapes fall back to the mean of their vertices.
+    """
+    xs = [x for ring in rings for x, _ in ring]
+    ys = [y for ring in rings for _, y in ring]
+    if not xs:
+        return None
+    # Work relative to the first vertex; parcels are tiny next to their coordinates, and the
+    # shoelace products would otherwise cancel away most of the precision
+    origin_x, origin_y = xs[0], ys[0]
+    area = cx = cy = 0.0
+    for ring in rings:
+        ring = [(x - origin_x, y - origin_y) for x, y in ring]
+        for (x0, y0), (x1, y1) in zip(ring, ring[1:]):
+            cross = x0 * y1 - x1 * y0
+            area += cross
+            cx += (x0 + x1) * cross
+            cy += (y0 + y1) * cross
+    if abs(area) > 1e-18:
+        x, y = origin_x + cx / (3 * area), origin_y + cy / (3 * area)
+    else:
+        x, y = sum(xs) / len(xs), sum(ys) / len(ys)
+    return x, y, min(xs), min(ys), max(xs), max(ys)
+
+def geometry_query(where, extent=None, source=DEFAULT_SOURCE):
+    """Return layer 19 query parameters for generalized (and, given an extent, quantized) WGS84 shapes"""
+    params = {
+        'where': where,
+        'outFields': source.field('PPI'),
+        'returnGeometry': 'true',
+        'outSR': WGS84,
+        'maxAllowableOffset': GEOMETRY_RESOLUTION,
+    }
+    if extent:
+        params['quantizationParameters'] = json.dumps({
+            'mode': 'view',
+            'originPosition': 'upperLeft',
+            'tolerance': GEOMETRY_RESOLUTION,
+            'extent': extent,
+        }, separators=(',', ':'))
+    return params
+
+def layer_extent(cache=None, source=DEFAULT_SOURCE):
+    """Return the WGS84 extent of layer 19, which anchors the quantization grid, or None if unsupported"""
+    extent = cache.get_meta('extent') if cache is not None else None
+    if extent is None:
+        try:
+            extent = source.query_changes({'where': '1=1', 'returnExtentOnly': 'true', 'outSR': WGS84}).get('extent')
+        except requests.RequestException as e:
+            print(f"⚠️ Could not get the layer 19 extent, fetching shapes unquantized: {e}")
+            return None
+        if not extent or extent.get('xmin') is None:
+            return None
+        if cache is not None:
+            cache.set_meta('extent', extent)
+    return extent
+
+def fetch_locations(params, method='GET', source=DEFAULT_SOURCE):
+    """Run one geometry query and return (ppi, x, y, xmin, ymin, xmax, ymax) rows and PPIs without a shape"""
+    stream = source.stream_changes(params, method=method)
+    features = list(stream)
+    return summarize_features(features, stream.metadata, source)
+
+def summarize_features(features, metadata, source=DEFAULT_SOURCE):
+    """Return (location rows, PPIs without a shape) for the features of one completed geometry query"""
+    ppi_field = source.field('PPI')
+    # The transform precedes the features in practice, but is only read once the response is complete
+    transform = metadata.get('transform')
+    locations, missing = [], []
+    for feature in features:
+        ppi = feature['attributes'].get(ppi_field)
+        rings = (feature.get('geometry') or {}).get('rings')
+        summary = summarize_rings(dequantize(rings, transform) if rings and transform else rings or [])
+        if summary is None:
+            missing.append(ppi)
+        else:
+            locations.append((ppi, *summary))
+    return locations, missing
+
+def fetch_locations_for(ppis, extent=None, batch_size=GEOMETRY_BATCH_SIZE, max_workers=GEOMETRY_MAX_WORKERS,
+                        source=DEFAULT_SOURCE):
+    """Fetch the shapes of the given PPIs in concurrent POST batches
+
+    Returns (location rows, PPIs that have no shape on layer 19). A PPI
+    can have several layer 19 rows, so a batch whose response is cut off
+    at the transfer limit is fetched again as two half batches.
+    """
+    def fetch_batch(batch):
+        where = in_clause(source.field('PPI'), batch)
+        stream = source.stream_changes(geometry_query(where, extent, source), method='POST')
+        features = list(stream)
+        if stream.metadata.get('exceededTransferLimit'):
+            if len(batch) > 1:
+                middle = len(batch) // 2
+                first_locations, first_missing = fetch_batch(batch[:middle])
+                second_locations, second_missing = fetch_batch(batch[middle:])
+                return first_locations + second_locations, first_missing + second_missing
+            print(f"⚠️ Layer {source.change_layer} returned only {len(features)} shapes for PPI {batch[0]} "
+                  f"(transfer limit reached)")
+        return summarize_features(features, stream.metadata, source)
+
+    batch_size = source.change_metadata().batch_size(batch_size)
+    batches = [ppis[i:i + batch_size] for i in range(0, len(ppis), batch_size)]
+    locations = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for batch_locations, _ in executor.map(fetch_batch, batches):
+            locations.extend(batch_locations)
+    found = {location[0] for location in locations}
+    return locations, [ppi for ppi in ppis if ppi not in found]
+
+def locate_parcels(ppis, cache, batch_size=GEOMETRY_BATCH_SIZE, max_workers=GEOMETRY_MAX_WORKERS,
+                   source=DEFAULT_SOURCE):
+    """Return {ppi: (longitude, latitude)} for the given PPIs, fetching only shapes the cache lacks
+
+    The cache must belong to the source (see Source.state_path).
+    """
+    fresh, to_fetch = cache.get_many(ppis)
+    if to_fetch:
+        locations, missing = fetch_locations_for(
+            to_fetch, layer_extent(cache, source), batch_size, max_workers, source
+        )
+        cache.put_many(locations, missing)
+        fresh.update((ppi, (x, y)) for ppi, x, y, *_ in locations)
+        print(f"🗺️ Parcel geometry: {len(ppis) - len(to_fetch)} cached, {len(locations)} fetched, "
+              f"{len(missing)} without a shape")
+    return {ppi: location for ppi, location in fresh.items() if location is not None}
+
+def download_all(cache, max_workers=GEOMETRY_MAX_WORKERS, source=DEFAULT_SOURCE):
+    """Fetch every layer 19 shape into the cache in parallel pages and return the number stored"""
+    extent = layer_extent(cache, source)
+    base = dict(geometry_query('1=1', extent, source), orderByFields=source.field('OBJECTID'))
+    total = source.query_changes({'where': '1=1', 'returnCountOnly': 'true'}).get('count', 0)
+    locations, missing = fetch_locations(base, source=source)
+    cache.put_many(locations, missing)
+    page_size = len(locations) + len(missing)
+    stored = len(locations)
+    if not page_size:
+        return stored
+
+    offsets = range(page_size, total, page_size)
+    print(f"📥 Downloading {total} parcel shapes in {len(offsets) + 1} pages")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(fetch_locations, dict(base, resultOffset=offset, resultRecordCount=page_size), 'GET', source)
+            for offset in offsets
+        ]
+        for future in as_completed(futures):
+            locations, missing = future.result()
+            cache.put_many(locations, missing)
+            stored += len(locations)
+    return stored
+
+def main():
+    parser = argparse.ArgumentParser(description="Cache layer 19 parcel locations for spatial saved searches")
+    parser.add_argument('--cache', default=os.getenv('GEOMETRY_CACHE_FILE', GEOMETRY_CACHE_FILE))
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    download = subparsers.add_parser('download', help="fetch every parcel shape into the cache")
+    download.add_argument('--max-workers', type=int, default=GEOMETRY_MAX_WORKERS)
+    locate = subparsers.add_parser('locate', help="print the cached (or fetched) location of PPIs")
+    locate.add_argument('ppis', nargs='+')
+    args = parser.parse_args()
+
+    cache = GeometryCache(args.cache, ttl_days=float(os.getenv('GEOMETRY_CACHE_TTL_DAYS', GEOMETRY_CACHE_TTL_DAYS)))
+    try:
+        if args.command == 'download':
+            started = time.perf_counter()
+            stored = download_all(cache, max_workers=args.max_workers)
+            print(f"✅ Cached {stored} parcel locations in {args.cache} in {time.perf_counter() - started:.1f}s")
+        else:
+            locations = locate_parcels(args.ppis, cache)
+            for ppi in args.ppis:
+                location = locations.get(ppi)
+                print(f"{ppi}  " + (f"{location[1]:.6f}, {location[0]:.6f}" if location else "no shape"))
+    finally:
+        cache.close()
+        close_session()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,390 @@
+"""Date-partitioned columnar history of reported changes
+
+Every poll appends the records it reported (layer 12 fields, any detail
+page fields and the layer 19 MODDATE) to HISTORY_DIR. Rows are split
+into one partition per local MODDATE day, and each partition stores
+every column as an uncompressed .npy file sorted by MODDATE, next to a
+meta.json with its row count, MODDATE range and the towns and postal
+codes it contains:
+
+    history/2026-10-15/00000003/{meta.json,MODDATE.npy,PPI.npy,TownName.npy,...}
+
+Appending to a day writes the merged rows as the next generation of its
+partition and then removes the previous one, so readers always see a
+complete partition and a day never holds more than one set of files.
+Scans skip the partitions outside the MODDATE range or without the
+requested towns, memory-map only the columns they need, and cut the
+MODDATE range out of the sorted rows with a binary search, so months of
+history load in milliseconds instead of re-parsing pretty JSON dumps.
+
+    python history.py scan --start 2026-09-01 --town FRISCO --town DILLON --fields PPI,MODDATE,FullAdd
+    python history.py import parcel_query_20250616_135555.json backfill/layer19_*.jsonl
+    python history.py --benchmark 100000
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from enrichment import MONEY_FIELDS
+from property_record import FIELDS
+from snapshot import NUMERIC_FIELDS, parse_number
+
+# Directory holding the change history, overridable with HISTORY_DIR (empty disables it)
+HISTORY_DIR = 'history'
+# Columns stored as int64 epoch milliseconds or ids
+INTEGER_FIELDS = ('MODDATE', 'OBJECTID')
+# Columns stored as float64: the numeric layer 12 fields and the numeric detail page fields. Schedule
+# is a string here, since it is part of the row key and other sources use alphanumeric schedules
+FLOAT_FIELDS = frozenset((NUMERIC_FIELDS - {'Schedule'}) | MONEY_FIELDS | {'TaxYear', 'SaleCount'})
+# String columns whose distinct values are kept in each partition's meta.json to skip partitions
+PARTITION_VALUE_FIELDS = ('TownName', 'PostCode')
+# Rows that agree on these (present) columns are the same change; the newest copy is kept
+KEY_FIELDS = ('MODDATE', 'OBJECTID', 'PPI', 'Schedule')
+META_FILE = 'meta.json'
+
+PARTITION_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2}$')
+GENERATION_PATTERN = re.compile(r'\d{8}$')
+
+_lock = threading.Lock()
+_mapped = {}
+
+def to_column(field, values):
+    """Return values as a column of the field's fixed type
+
+    int64 for INTEGER_FIELDS (-1 for None), float64 for FLOAT_FIELDS (NaN
+    for None) and strings for everything else, whatever the values look
+    like, so a field keeps one type across appends. Values that are not
+    numbers (a TaxYear like "2024 Payable 2025") are stored as missing in
+    numeric columns.
+    """
+    if field in INTEGER_FIELDS:
+        numbers = np.array([parse_number(value) for value in values], dtype=np.float64)
+        return np.where(np.isnan(numbers), -1, numbers).astype(np.int64)
+    if field in FLOAT_FIELDS:
+        return np.array([parse_number(value) for value in values], dtype=np.float64)
+    return np.array(['' if value is None else str(value) for value in values], dtype=str)
+
+def blank_column(like, length):
+    """Return a column of missing values with the kind of `like`"""
+    if like.dtype.kind == 'i':
+        return np.full(length, -1, dtype=np.int64)
+    if like.dtype.kind == 'f':
+        return np.full(length, np.nan)
+    return np.full(length, '', dtype=like.dtype)
+
+def columns_from_attributes(rows):
+    """Build {field: column} from a list of attribute dicts, over the union of their fields"""
+    fields = {}
+    for attributes in rows:
+        fields.update(dict.fromkeys(attributes))
+    return {field: to_column(field, [attributes.get(field) for attributes in rows]) for field in fields}
+
+def columns_from_records(records):
+    """Build {field: column} from PropertyRecords, with MODDATE as epoch milliseconds"""
+    rows = []
+    for record in records:
+        attributes = dict(zip(FIELDS, record.values))
+        if record.extra:
+            attributes.update(record.extra)
+        attributes['MODDATE'] = record.moddate_ms
+        rows.append(attributes)
+    return columns_from_attributes(rows)
+
+def row_count(columns):
+    return len(next(iter(columns.values()))) if columns else 0
+
+def take(columns, index):
+    return {field: column[index] for field, column in columns.items()}
+
+def concat(parts):
+    """Concatenate column dicts, filling columns a part lacks with missing values"""
+    parts = [part for part in parts if row_count(part)]
+    fields = {}
+    for part in parts:
+        for field, column in part.items():
+            fields.setdefault(field, column)
+    return {
+        field: np.concatenate([
+            part[field] if field in part else blank_column(like, row_count(part)) for part in parts
+        ])
+        for field, like in fields.items()
+    }
+
+def drop_duplicates(columns):
+    """Keep the last copy of rows that agree on every KEY_FIELDS column present"""
+    keys = [columns[field] for field in KEY_FIELDS if field in columns]
+    count = row_count(columns)
+    if not keys or count < 2:
+        return columns
+    # lexsort sorts by its last key first; the row index keeps later copies after earlier ones
+    order = np.lexsort([np.arange(count), *keys[::-1]])
+    same_as_next = np.ones(count - 1, dtype=bool)
+    for key in keys:
+        ordered = key[order]
+        equal = ordered[1:] == ordered[:-1]
+        if key.dtype.kind == 'f':
+            equal |= np.isnan(ordered[1:]) & np.isnan(ordered[:-1])
+        same_as_next &= equal
+    keep = np.append(~same_as_next, True)
+    return take(columns, np.sort(order[keep]))
+
+def day_name(moddate_ms):
+    return time.strftime('%Y-%m-%d', time.localtime(moddate_ms // 1000))
+
+def next_midnight_ms(day):
+    """Return the epoch milliseconds of the local midnight after a YYYY-MM-DD day"""
+    following = datetime.strptime(day, '%Y-%m-%d') + timedelta(days=1)
+    return int(following.timestamp() * 1000)
+
+def split_by_day(columns):
+    """Yield (YYYY-MM-DD, columns) for each local MODDATE day, rows sorted by MODDATE"""
+    columns = take(columns, np.argsort(columns['MODDATE'], kind='stable'))
+    moddates = columns['MODDATE']
+    start = 0
+    while start < len(moddates):
+        day = day_name(int(moddates[start]))
+        end = int(np.searchsorted(moddates, next_midnight_ms(day), side='left'))
+        yield day, take(columns, slice(start, end))
+        start = end
+
+def latest_generation(partition_dir):
+    """Return the path of a partition's newest complete generation, or None"""
+    try:
+        names = [name for name in os.listdir(partition_dir) if GENERATION_PATTERN.match(name)]
+    except FileNotFoundError:
+        return None
+    return os.path.join(partition_dir, max(names)) if names else None
+
+def read_meta(generation_dir):
+    with open(os.path.join(generation_dir, META_FILE)) as f:
+        return json.load(f)
+
+def load_columns(generation_dir, fields=None, meta=None):
+    """Load a generation's columns into memory (all, or the listed ones it has)"""
+    meta = meta or read_meta(generation_dir)
+    fields = meta['columns'] if fields is None else [field for field in fields if field in meta['columns']]
+    return {field: np.load(os.path.join(generation_dir, f'{field}.npy')) for field in fields}
+
+def map_columns(generation_dir, fields, meta):
+    """Memory-map the listed columns a generation has, reusing maps from earlier scans
+
+    Generations are never modified, only replaced, so a map stays valid
+    for as long as its generation's meta.json is unchanged.
+    """
+    stamp = os.stat(os.path.join(generation_dir, META_FILE)).st_mtime_ns
+    columns = {}
+    for field in fields:
+        if field not in meta['columns'] or field in columns:
+            continue
+        # Keyed by partition, so a replaced generation's map is dropped
+        key = (os.path.dirname(generation_dir), field)
+        cached = _mapped.get(key)
+        if cached is None or cached[:2] != (generation_dir, stamp):
+            column = np.load(os.path.join(generation_dir, f'{field}.npy'), mmap_mode='r')
+            cached = _mapped[key] = (generation_dir, stamp, column)
+        columns[field] = cached[2]
+    return columns
+
+def write_partition(partition_dir, columns):
+    """Write columns as the next generation of a partition and remove the older ones"""
+    os.makedirs(partition_dir, exist_ok=True)
+    previous = latest_generation(partition_dir)
+    generation = int(os.path.basename(previous)) + 1 if previous else 1
+    temp_dir = tempfile.mkdtemp(prefix='.tmp-', dir=partition_dir)
+    for field, column in columns.items():
+        np.save(os.path.join(temp_dir, f'{field}.npy'), column)
+    moddates = columns['MODDATE']
+    meta = {
+        'rows': len(moddates),
+        'moddate_min': int(moddates[0]),
+        'moddate_max': int(moddates[-1]),
+        'columns': list(columns),
+        'values': {
+            field: sorted(set(columns[field].tolist())) for field in PARTITION_VALUE_FIELDS if field in columns
+        },
+    }
+    with open(os.path.join(temp_dir, META_FILE), 'w') as f:
+        json.dump(meta, f)
+    os.rename(temp_dir, os.path.join(partition_dir, f'{generation:08d}'))
+    # Readers that already mapped the old files keep them until they let go
+    for name in os.listdir(partition_dir):
+        if name != f'{generation:08d}':
+            shutil.rmtree(os.path.join(partition_dir, name), ignore_errors=True)
+
+def append_columns(columns, directory=HISTORY_DIR):
+    """Merge change rows {field: column} into their day partitions and return the number of new rows
+
+    Rows without a MODDATE are not stored.
+    """
+    if not row_count(columns) or 'MODDATE' not in columns:
+        return 0
+    columns = {field: np.asarray(column) for field, column in columns.items()}
+    columns = take(columns, columns['MODDATE'] >= 0)
+    added = 0
+    with _lock:
+        for day, rows in split_by_day(columns):
+            partition_dir = os.path.join(directory, day)
+            existing_dir = latest_generation(partition_dir)
+            existing = load_columns(existing_dir) if existing_dir else {}
+            merged = drop_duplicates(concat([existing, rows]))
+            merged = take(merged, np.argsort(merged['MODDATE'], kind='stable'))
+            added += row_count(merged) - row_count(existing)
+            write_partition(partition_dir, merged)
+    return added
+
+def append_records(records, directory=HISTORY_DIR):
+    """Append reported PropertyRecords to the history and return the number of new rows"""
+    return append_columns(columns_from_records(records), directory)
+
+def matches(meta, filters):
+    """Return whether a partition can hold rows matching every {field: values} filter"""
+    for field, values in filters.items():
+        if field not in meta['columns']:
+            return False
+        known = meta['values'].get(field)
+        if known is not None and not set(known) & values:
+            return False
+    return True
+
+def scan(start_ms=None, end_ms=None, fields=None, directory=HISTORY_DIR, **filters):
+    """Return {field: column} of the stored changes with start_ms <= MODDATE < end_ms, oldest first
+
+    Keyword filters keep rows whose field equals one of the given values,
+    e.g. scan(start_ms, TownName=['FRISCO', 'DILLON']). fields lists the
+    columns to return (default: every column in the matching partitions).
+    """
+    filters = {field: {str(v) for v in (values if isinstance(values, (list, tuple, set)) else [values])}
+               for field, values in filters.items()}
+    first_day = day_name(start_ms) if start_ms is not None else ''
+    last_day = day_name(end_ms - 1) if end_ms is not None else '9999'
+    try:
+        days = sorted(name for name in os.listdir(directory) if PARTITION_PATTERN.match(name))
+    except FileNotFoundError:
+        days = []
+
+    parts = []
+    for day in days:
+        if not first_day <= day <= last_day:
+            continue
+        generation_dir = latest_generation(os.path.join(directory, day))
+        if generation_dir is None:
+            continue
+        meta = read_meta(generation_dir)
+        if not matches(meta, filters) or (start_ms is not None and meta['moddate_max'] < start_ms) or (
+                end_ms is not None and meta['moddate_min'] >= end_ms):
+            continue
+        wanted = meta['columns'] if fields is None else fields
+        columns = map_columns(generation_dir, ['MODDATE', *filters, *wanted], meta)
+        moddates = columns['MODDATE']
+        lo = 0 if start_ms is None else int(np.searchsorted(moddates, start_ms, side='left'))
+        hi = len(moddates) if end_ms is None else int(np.searchsorted(moddates, end_ms, side='left'))
+        selection = np.arange(lo, hi)
+        for field, values in filters.items():
+            column = columns[field][lo:hi]
+            if column.dtype.kind != 'U':
+                column = column.astype(str)
+            selection = selection[np.isin(column, list(values))[selection - lo]]
+        parts.append({field: np.asarray(columns[field][selection]) for field in wanted if field in columns})
+
+    result = concat(parts)
+    for field in fields or ():
+        result.setdefault(field, np.array([], dtype=str))
+    return result
+
+# --- Import and benchmark ---
+
+def read_change_file(path):
+    """Return the attribute dicts of a saved query: a query response JSON, or JSON Lines of attributes"""
+    with open(path) as f:
+        if path.endswith('.jsonl'):
+            return [json.loads(line) for line in f if line.strip()]
+        data = json.load(f)
+    return [feature['attributes'] for feature in data.get('features', [])]
+
+def benchmark(count, days=90):
+    """Compare filtering `count` changes from a pretty JSON dump with a history scan"""
+    from fake_mapserver import generate_parcels
+    now_ms = int(time.time() * 1000)
+    layer_12, layer_19 = generate_parcels(count, now_ms=now_ms, window_ms=days * 86_400_000)
+    moddates = {feature['attributes']['PPI']: feature['attributes']['MODDATE'] for feature in layer_19}
+    rows = [dict(feature['attributes'], MODDATE=moddates.get(feature['attributes']['PPI'])) for feature in layer_12]
+    start_ms = now_ms - 30 * 86_400_000
+    with tempfile.TemporaryDirectory() as temp_dir:
+        dump_path = os.path.join(temp_dir, 'parcel_query.json')
+        with open(dump_path, 'w') as f:
+            json.dump({'features': [{'attributes': row} for row in rows]}, f, indent=2)
+        directory = os.path.join(temp_dir, 'history')
+        started = time.perf_counter()
+        append_columns(columns_from_attributes(rows), directory)
+        ingest_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        with open(dump_path) as f:
+            data = json.load(f)
+        from_json = [feature['attributes'] for feature in data['features']
+                     if feature['attributes']['MODDATE'] >= start_ms and feature['attributes']['TownName'] == 'FRISCO']
+        json_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        from_history = scan(start_ms, directory=directory, fields=['PPI', 'MODDATE', 'FullAdd'], TownName='FRISCO')
+        scan_seconds = time.perf_counter() - started
+        assert len(from_history['PPI']) == len(from_json)
+        size_mb = os.path.getsize(dump_path) / 1e6
+    print(f"📊 {count:,} changes over {days} days, {len(from_json):,} in FRISCO in the last 30 days")
+    print(f"   ingest: {ingest_seconds * 1000:.0f} ms")
+    print(f"   json.load + filter ({size_mb:.1f} MB): {json_seconds * 1000:.0f} ms")
+    print(f"   history scan: {scan_seconds * 1000:.1f} ms ({json_seconds / scan_seconds:.0f}x faster)")
+
+def parse_date(value):
+    return datetime.fromisoformat(value)
+
+def main():
+    parser = argparse.ArgumentParser(description="Query and import the columnar change history")
+    parser.add_argument('--directory', default=os.getenv('HISTORY_DIR') or HISTORY_DIR)
+    parser.add_argument('--benchmark', type=int, metavar='N', help="time a scan of N synthetic changes against json.load")
+    subparsers = parser.add_subparsers(dest='command')
+    query = subparsers.add_parser('scan', help="print stored changes as JSON lines")
+    query.add_argument('--start', type=parse_date, help="first MODDATE (YYYY-MM-DD or ISO timestamp)")
+    query.add_argument('--end', type=parse_date, help="end of the MODDATE range, exclusive")
+    query.add_argument('--town', action='append', help="only changes in this TownName (repeatable)")
+    query.add_argument('--fields', help="comma-separated columns to print (default: all)")
+    query.add_argument('--count', action='store_true', help="only print the number of matching changes")
+    load = subparsers.add_parser('import', help="append saved query JSON files or backfill JSON Lines files")
+    load.add_argument('paths', nargs='+')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark)
+    elif args.command == 'import':
+        for path in args.paths:
+            added = append_columns(columns_from_attributes(read_change_file(path)), args.directory)
+            print(f"📥 {path}: {added} new changes")
+    elif args.command == 'scan':
+        filters = {'TownName': args.town} if args.town else {}
+        started = time.perf_counter()
+        columns = scan(
+            int(args.start.timestamp() * 1000) if args.start else None,
+            int(args.end.timestamp() * 1000) if args.end else None,
+            fields=args.fields.split(',') if args.fields else None,
+            directory=args.directory,
+            **filters,
+        )
+        elapsed = time.perf_counter() - started
+        if not args.count:
+            names = list(columns)
+            for row in zip(*(columns[name].tolist() for name in names)):
+                print(json.dumps(dict(zip(names, row))))
+        print(f"📊 {row_count(columns)} changes ({elapsed * 1000:.1f} ms)")
+    else:
+        parser.error("give a command or --benchmark")
+
+if __name__ == "__main__":
+    main()
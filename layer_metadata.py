@@ -0,0 +1,218 @@
+"""Cached, versioned MapServer layer descriptions
+
+Each layer's description (MapServer/<layer>?f=json) lists its fields,
+its maxRecordCount and which query features it supports. The pipeline
+sizes its pages and PPI batches from it and checks its outFields
+against it before querying. Descriptions are fetched once per
+LAYER_METADATA_TTL_HOURS and kept in LAYER_METADATA_FILE with a version
+number that goes up whenever a refreshed description differs from the
+cached one, so a schema change on the county server is reported instead
+of surfacing as failed queries. When the server cannot be reached the
+cached description is used however old it is, and without one the
+pipeline falls back to its previous fixed behavior.
+
+    python layer_metadata.py              # summarize the descriptions of layers 12 and 19
+    python layer_metadata.py 19 --refresh
+"""
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+
+import requests
+
+from arcgis_client import ArcGISError, close_session, layer_info, layer_url
+
+# Where layer descriptions are cached, overridable with LAYER_METADATA_FILE
+LAYER_METADATA_FILE = '.layer_metadata.json'
+# How long a cached description is used before it is fetched again, overridable with LAYER_METADATA_TTL_HOURS
+LAYER_METADATA_TTL_HOURS = 24
+# Page size assumed when a layer does not report maxRecordCount
+DEFAULT_MAX_RECORD_COUNT = 1000
+# Records per key that batch_size leaves room for
+RECORDS_PER_KEY = 4
+# Seconds before a description that could not be fetched is tried again
+METADATA_RETRY_SECONDS = 300
+
+# Guards the metadata file and _key_locks; each layer URL is fetched under its own lock
+_lock = threading.Lock()
+_key_locks = {}
+_loaded = {}
+_warned = set()
+
+class LayerMetadata:
+    """One layer's description with the limits and capabilities the pipeline relies on
+
+    Capabilities the description does not mention are None, meaning unknown.
+    """
+
+    def __init__(self, layer, description=None, version=0, fetched_at=None):
+        self.layer = layer
+        self.description = description or {}
+        self.version = version
+        self.fetched_at = fetched_at
+
+    @property
+    def max_record_count(self):
+        return self.description.get('maxRecordCount')
+
+    @property
+    def supports_advanced_queries(self):
+        return self.description.get('supportsAdvancedQueries')
+
+    @property
+    def supports_pagination(self):
+        return self.description.get('advancedQueryCapabilities', {}).get('supportsPagination')
+
+    @property
+    def supports_statistics(self):
+        return self.description.get('advancedQueryCapabilities', {}).get('supportsStatistics')
+
+    @property
+    def field_names(self):
+        """Return the set of the layer's field names, or None if the description lists none"""
+        fields = self.description.get('fields')
+        return {field['name'] for field in fields} if fields else None
+
+    def page_size(self):
+        """Return the most records one query returns"""
+        return self.max_record_count or DEFAULT_MAX_RECORD_COUNT
+
+    def batch_size(self, requested):
+        """Cap a batch of keys well below the most records one response holds
+
+        A key can match several records (a PPI with several schedules), so
+        a batch is allowed RECORDS_PER_KEY records per key. Batches that
+        still come back truncated are split by the caller.
+        """
+        if not self.max_record_count:
+            return requested
+        return max(1, min(requested, self.max_record_count // RECORDS_PER_KEY))
+
+    def select_fields(self, out_fields, required=()):
+        """Return the comma-separated out_fields the layer has
+
+        Unknown fields are dropped with a warning (once per process), so a
+        renamed column shows as Not Available instead of failing every
+        query. Raises ArcGISError if any of the `required` fields is missing.
+        """
+        names = self.field_names
+        requested = out_fields.split(',')
+        if names is None:
+            return out_fields
+        unknown = [field for field in requested if field not in names]
+        if not unknown:
+            return out_fields
+        missing = [field for field in required if field not in names]
+        if missing:
+            raise ArcGISError(f"Layer {self.layer} lacks the required fields {', '.join(missing)} (version {self.version})")
+        key = (self.layer, self.version, tuple(unknown))
+        if key not in _warned:
+            _warned.add(key)
+            print(f"⚠️ Layer {self.layer} lacks the fields {', '.join(unknown)}; querying without them")
+        return ','.join(field for field in requested if field in names)
+
+def metadata_path():
+    return os.getenv('LAYER_METADATA_FILE', LAYER_METADATA_FILE)
+
+def metadata_ttl_seconds():
+    return float(os.getenv('LAYER_METADATA_TTL_HOURS', LAYER_METADATA_TTL_HOURS)) * 3600
+
+def description_digest(description):
+    return hashlib.sha1(json.dumps(description, sort_keys=True).encode('utf-8')).hexdigest()
+
+def load_entries(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_entries(path, entries):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(entries, f)
+    os.replace(temp_path, path)
+
+def key_lock(key):
+    with _lock:
+        return _key_locks.setdefault(key, threading.Lock())
+
+def get_layer_metadata(layer, refresh=False, base_url=None):
+    """Return the LayerMetadata of a layer, fetching its description when the cached one has expired
+
+    Layers are those of ARCGIS_MAPSERVER_URL unless base_url is given.
+    Only lookups of the same layer URL wait for each other, so a slow
+    server does not hold up the layers of other servers.
+    """
+    key = layer_url(layer, base_url)
+    ttl = metadata_ttl_seconds()
+    with key_lock(key):
+        metadata = _loaded.get(key)
+        if metadata is not None and not refresh and time.time() - metadata.fetched_at < ttl:
+            return metadata
+
+        path = metadata_path()
+        with _lock:
+            entry = load_entries(path).get(key)
+        if entry and not refresh and time.time() - entry['fetched_at'] < ttl:
+            metadata = LayerMetadata(layer, entry['description'], entry['version'], entry['fetched_at'])
+            _loaded[key] = metadata
+            return metadata
+
+        try:
+            # Retry only once; the queries that need the description retry on their own
+            description = layer_info(layer, max_retries=1, base_url=base_url)
+        except requests.RequestException as e:
+            if entry:
+                print(f"⚠️ Could not refresh the layer {layer} description, using the cached one: {e}")
+                metadata = LayerMetadata(layer, entry['description'], entry['version'], time.time())
+            else:
+                print(f"⚠️ Could not get the layer {layer} description, using default limits: {e}")
+                metadata = LayerMetadata(layer, fetched_at=time.time())
+            # Ask the server again after METADATA_RETRY_SECONDS rather than on every query
+            metadata.fetched_at -= ttl - METADATA_RETRY_SECONDS
+            _loaded[key] = metadata
+            return metadata
+
+        digest = description_digest(description)
+        version = entry['version'] if entry else 1
+        if entry and entry['digest'] != digest:
+            version += 1
+            print(f"🗂️ Layer {layer} description changed (now version {version})")
+        now = time.time()
+        with _lock:
+            # Reread the file so descriptions saved by other lookups meanwhile are kept
+            entries = load_entries(path)
+            # Forget servers not seen for a while (e.g. fake MapServers on random ports)
+            entries = {url: saved for url, saved in entries.items() if now - saved['fetched_at'] < 30 * ttl}
+            entries[key] = {'fetched_at': now, 'version': version, 'digest': digest, 'description': description}
+            save_entries(path, entries)
+        metadata = LayerMetadata(layer, description, version, now)
+        _loaded[key] = metadata
+        return metadata
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the cached MapServer layer descriptions")
+    parser.add_argument('layers', nargs='*', type=int, default=[12, 19])
+    parser.add_argument('--refresh', action='store_true', help="fetch the descriptions even if the cached ones are fresh")
+    args = parser.parse_args()
+    try:
+        for layer in args.layers:
+            metadata = get_layer_metadata(layer, refresh=args.refresh)
+            print(json.dumps({
+                'layer': layer,
+                'version': metadata.version,
+                'maxRecordCount': metadata.max_record_count,
+                'supportsAdvancedQueries': metadata.supports_advanced_queries,
+                'supportsPagination': metadata.supports_pagination,
+                'supportsStatistics': metadata.supports_statistics,
+                'fields': len(metadata.field_names or ()),
+            }))
+    finally:
+        close_session()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""In-process metrics: counters, gauges, histograms and stage timers
+
+Instrumented code records into the module-level REGISTRY; recording is a
+dict lookup and an addition under a lock, so the hot path stays cheap.
+Metrics leave the process as
+
+- structured JSON log lines (one per stage and event) when METRICS_LOG
+  is set to a file path or "-" for stderr,
+- a Prometheus text-format file rewritten after every cycle when
+  METRICS_FILE is set (e.g. for node_exporter's textfile collector),
+- an HTTP /metrics endpoint in daemon mode when METRICS_PORT is set.
+"""
+import bisect
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Histogram bucket upper bounds for durations in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Histogram bucket upper bounds for sizes in bytes
+SIZE_BUCKETS = (1_000, 10_000, 50_000, 100_000, 250_000, 1_000_000, 5_000_000)
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Registry:
+    """Thread-safe store of labelled metrics"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.log_stream = None
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def log(self, event, **fields):
+        """Write one structured JSON log line, if JSON logging is enabled"""
+        if self.log_stream is None:
+            return
+        line = json.dumps(dict(ts=round(time.time(), 3), event=event, **fields), default=str)
+        with self.lock:
+            self.log_stream.write(line + '\n')
+            self.log_stream.flush()
+
+    @contextmanager
+    def stage(self, name, labels=None, **fields):
+        """Time a pipeline stage into pipeline_stage_seconds and log it
+
+        labels (e.g. a source's metric_labels) label the histogram and the
+        log line; other fields only go to the log line.
+        """
+        labels = labels or {}
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.observe('pipeline_stage_seconds', elapsed, stage=name, **labels)
+            self.log('stage', stage=name, seconds=round(elapsed, 6), **labels, **fields)
+
+    def snapshot(self):
+        """Return a plain-dict copy of every metric, for JSON output"""
+        with self.lock:
+            return {
+                'counters': {format_key(key): value for key, value in self.counters.items()},
+                'gauges': {format_key(key): value for key, value in self.gauges.items()},
+                'histograms': {
+                    format_key(key): {'count': h.count, 'sum': h.sum} for key, h in self.histograms.items()
+                },
+            }
+
+    def to_prometheus(self):
+        """Render every metric in the Prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            for kind, metrics in (('counter', self.counters), ('gauge', self.gauges)):
+                seen = set()
+                for (name, labels), value in sorted(metrics.items()):
+                    if name not in seen:
+                        seen.add(name)
+                        lines.append(f"# TYPE {name} {kind}")
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+            seen = set()
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                if name not in seen:
+                    seen.add(name)
+                    lines.append(f"# TYPE {name} histogram")
+                cumulative = 0
+                for bound, count in zip(list(histogram.buckets) + ['+Inf'], histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', str(bound)),))} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+def format_key(key):
+    name, labels = key
+    return name + format_labels(labels)
+
+REGISTRY = Registry()
+
+def configure(log_target=None):
+    """Enable JSON logs to a file path, or to stderr with "-" """
+    if not log_target:
+        REGISTRY.log_stream = None
+    elif log_target == '-':
+        REGISTRY.log_stream = sys.stderr
+    else:
+        REGISTRY.log_stream = open(log_target, 'a', buffering=1)
+
+def write_prometheus_file(path):
+    """Atomically rewrite a Prometheus text-format file with the current metrics"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as f:
+        f.write(REGISTRY.to_prometheus())
+    os.replace(temp_path, path)
+
+def serve_metrics(port):
+    """Serve GET /metrics from a background thread and return the server"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = REGISTRY.to_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,122 @@
+import json
+import sqlite3
+import threading
+import time
+
+# Default location of the on-disk cache, overridable with PARCEL_CACHE_FILE
+PARCEL_CACHE_FILE = 'parcel_cache.sqlite3'
+# Layer 12 records older than this are re-fetched, overridable with PARCEL_CACHE_TTL_HOURS
+PARCEL_CACHE_TTL_HOURS = 24 * 7
+# Least recently used PPIs are evicted past this size, overridable with PARCEL_CACHE_MAX_ENTRIES
+PARCEL_CACHE_MAX_ENTRIES = 100_000
+
+class ParcelCache:
+    """SQLite cache of layer 12 attribute records keyed by PPI
+
+    Each PPI maps to the list of layer 12 records returned for it (a PPI
+    can carry more than one schedule), stamped with when it was fetched
+    and when it was last read. Entries past the TTL, or fetched before
+    the PPI's latest layer 19 change, count as stale and the least
+    recently read entries are evicted once the cache grows past
+    max_entries.
+    """
+
+    def __init__(self, path=PARCEL_CACHE_FILE, ttl_hours=PARCEL_CACHE_TTL_HOURS, max_entries=PARCEL_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_hours * 3600
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS parcels ("
+            "ppi TEXT PRIMARY KEY, records TEXT NOT NULL, fetched_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS parcels_accessed_at ON parcels (accessed_at)")
+        self.connection.commit()
+
+    def get_many(self, ppis, now=None, moddates=None):
+        """Return ({ppi: [attributes, ...]} for fresh entries, [ppis that must be fetched])
+
+        moddates maps PPIs to their layer 19 MODDATE (epoch milliseconds);
+        an entry fetched before its PPI's MODDATE predates the change and
+        is fetched again.
+        """
+        now = now or time.time()
+        moddates = moddates or {}
+        ppis = list(dict.fromkeys(ppis))
+        found = {}
+        with self.lock:
+            # Stay well under SQLite's bound-parameter limit
+            for i in range(0, len(ppis), 500):
+                chunk = ppis[i:i + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = self.connection.execute(
+                    f"SELECT ppi, records, fetched_at FROM parcels WHERE ppi IN ({placeholders})", chunk
+                ).fetchall()
+                found.update((ppi, (records, fetched_at)) for ppi, records, fetched_at in rows)
+
+            fresh, to_fetch = {}, []
+            for ppi in ppis:
+                entry = found.get(ppi)
+                if entry is None:
+                    self.misses += 1
+                    to_fetch.append(ppi)
+                elif now - entry[1] > self.ttl_seconds or (moddates.get(ppi) or 0) / 1000 > entry[1]:
+                    self.stale += 1
+                    to_fetch.append(ppi)
+                else:
+                    self.hits += 1
+                    fresh[ppi] = json.loads(entry[0])
+
+            self.connection.executemany(
+                "UPDATE parcels SET accessed_at = ? WHERE ppi = ?", [(now, ppi) for ppi in fresh]
+            )
+            self.connection.commit()
+        return fresh, to_fetch
+
+    def put_many(self, attribute_records, now=None):
+        """Store freshly fetched layer 12 attribute records, grouped by PPI"""
+        now = now or time.time()
+        grouped = {}
+        for attributes in attribute_records:
+            grouped.setdefault(attributes.get('PPI'), []).append(attributes)
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO parcels (ppi, records, fetched_at, accessed_at) VALUES (?, ?, ?, ?)",
+                [(ppi, json.dumps(records, separators=(',', ':')), now, now) for ppi, records in grouped.items()],
+            )
+            self.connection.commit()
+        self.evict()
+
+    def evict(self):
+        """Drop the least recently read entries beyond max_entries"""
+        with self.lock:
+            count = self.connection.execute("SELECT COUNT(*) FROM parcels").fetchone()[0]
+            excess = count - self.max_entries
+            if excess > 0:
+                self.connection.execute(
+                    "DELETE FROM parcels WHERE ppi IN (SELECT ppi FROM parcels ORDER BY accessed_at LIMIT ?)",
+                    (excess,),
+                )
+                self.connection.commit()
+            return max(excess, 0)
+
+    def stats(self):
+        """Return hit/miss counters and the current entry count"""
+        with self.lock:
+            entries = self.connection.execute("SELECT COUNT(*) FROM parcels").fetchone()[0]
+        lookups = self.hits + self.misses + self.stale
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'stale': self.stale,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': entries,
+        }
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,139 @@
+"""Compact report rows backed by a tuple of layer 12 values
+
+A PropertyRecord keeps the 25 layer 12 values in one tuple (built in C
+from the response dict), the MODDATE as integer epoch milliseconds and a
+precomputed sort key, instead of a dict of dicts per row. Renderers and
+saved-search matching and snapshot diffs read a few values per row through
+a zero-copy mapping view, `record.full_attributes`, which behaves like
+the attribute dict it replaces. Renderers that read every field take a
+short-lived dict from `record.to_dict()` instead, which is built in C and
+is faster than dozens of view lookups. The readable MODDATE is only
+formatted when it is asked for.
+"""
+from collections.abc import Mapping
+import time
+from types import MappingProxyType
+
+FIELDS = (
+    'PPI', 'Schedule', 'Filing', 'Phase', 'ShortDesc', 'HouseNum', 'FullStreet', 'StreetName', 'TownName',
+    'PostCode', 'FullAdd', 'TotAcres', 'SquareFeet', 'SqeFtLiving', 'BsmtType', 'GarageType', 'NumOfCars',
+    'GarSqFt', 'NumOfRms', 'NumBedRms', 'NumLofts', 'NumKitch', 'MasterBath', 'FullBath', 'TotBath',
+)
+FIELD_INDEX = {field: index for index, field in enumerate(FIELDS)}
+FIELD_SET = frozenset(FIELDS)
+
+DETAIL_URL = 'https://gis.summitcountyco.gov/map/DetailData.aspx?Schno={}'
+# Sort key of rows without a usable MODDATE, so they sort after every dated row
+UNDATED_SORT_KEY = -2 ** 63
+NO_CHANGES = MappingProxyType({})
+_MISSING = object()
+
+def parse_moddate(timestamp):
+    """Return a layer 19 MODDATE as integer epoch milliseconds, or None"""
+    if timestamp is None or timestamp == 'N/A':
+        return None
+    try:
+        return int(timestamp)
+    except (ValueError, TypeError):
+        return None
+
+def format_moddate(moddate_ms):
+    """Format epoch milliseconds the way reports show MODDATE"""
+    if moddate_ms is None:
+        return 'N/A'
+    try:
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(moddate_ms // 1000))
+    except (ValueError, OverflowError, OSError):
+        return 'Invalid Date'
+
+class PropertyRecord:
+    """One report row: a layer 12 record joined with its layer 19 MODDATE"""
+
+    __slots__ = ('values', 'moddate_ms', 'sort_key', 'changed_fields', 'extra')
+
+    def __init__(self, attributes, moddate=None, changed_fields=NO_CHANGES):
+        self.values = tuple(map(attributes.get, FIELDS))
+        self.moddate_ms = parse_moddate(moddate)
+        self.sort_key = UNDATED_SORT_KEY if self.moddate_ms is None else self.moddate_ms
+        self.changed_fields = changed_fields
+        # Fields outside the known layer 12 schema are rare, so they only cost a dict when present
+        self.extra = None if attributes.keys() <= FIELD_SET else {
+            field: value for field, value in attributes.items() if field not in FIELD_INDEX
+        }
+
+    @property
+    def full_attributes(self):
+        return AttributesView(self)
+
+    def to_dict(self):
+        """Return a new {field: value} dict of every attribute, including the readable MODDATE"""
+        attributes = dict(zip(FIELDS, self.values))
+        if self.extra:
+            attributes.update(self.extra)
+        attributes['MODDATE'] = self.moddate
+        return attributes
+
+    @property
+    def ppi(self):
+        return self.values[0]
+
+    @property
+    def schedule(self):
+        return self.values[1]
+
+    @property
+    def address(self):
+        return self.values[10]
+
+    @property
+    def living_sqft(self):
+        return self.values[13]
+
+    @property
+    def acres(self):
+        return self.values[11]
+
+    @property
+    def url(self):
+        return DETAIL_URL.format(self.values[1])
+
+    @property
+    def moddate(self):
+        return format_moddate(self.moddate_ms)
+
+class AttributesView(Mapping):
+    """Read-only {field: value} view of a PropertyRecord, including the readable MODDATE"""
+
+    __slots__ = ('record',)
+
+    def __init__(self, record):
+        self.record = record
+
+    def get(self, field, default=None):
+        index = FIELD_INDEX.get(field)
+        if index is not None:
+            return self.record.values[index]
+        if field == 'MODDATE':
+            return self.record.moddate
+        extra = self.record.extra
+        if extra and field in extra:
+            return extra[field]
+        return default
+
+    def __getitem__(self, field):
+        value = self.get(field, _MISSING)
+        if value is _MISSING:
+            raise KeyError(field)
+        return value
+
+    def __contains__(self, field):
+        return field in FIELD_INDEX or field == 'MODDATE' or bool(self.record.extra and field in self.record.extra)
+
+    def __iter__(self):
+        yield from FIELDS
+        if self.record.extra:
+            yield from self.record.extra
+        yield 'MODDATE'
+
+    def __len__(self):
+        return len(FIELDS) + len(self.record.extra or ()) + 1
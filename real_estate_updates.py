@@ -1,527 +1,556 @@
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from operator import attrgetter
+import argparse
 import requests
-import urllib.parse
-import smtplib
+import json
+import time
 import os
 from dotenv import load_dotenv
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
+from delivery import (
+    SMTPPool, RateLimiter, deliver_reports, load_subscribers,
+    SMTP_HOST, SMTP_PORT, SMTP_POOL_SIZE, SEND_RATE_PER_SECOND, SUBSCRIBERS_FILE,
+)
+from alerts import has_spatial_rules
+from arcgis_client import close_session
+from metrics import REGISTRY, configure as configure_metrics, serve_metrics, write_prometheus_file
+from daemon import run_daemon
+from enrichment import DetailCache, enrich_report, DETAIL_CACHE_FILE, DETAIL_CACHE_MAX_AGE_HOURS, DETAIL_MAX_WORKERS
+from snapshot import diff_against_latest, record_key, SNAPSHOT_DIR
+from history import append_records, HISTORY_DIR
+from geometry import GeometryCache, GEOMETRY_CACHE_FILE, GEOMETRY_CACHE_TTL_DAYS, locate_parcels
+from parcel_cache import ParcelCache, PARCEL_CACHE_FILE, PARCEL_CACHE_TTL_HOURS, PARCEL_CACHE_MAX_ENTRIES
+from property_record import PropertyRecord, FIELDS as PROPERTY_FIELDS
+from sources import DEFAULT_SOURCE, SOURCES_FILE, load_sources
 
-def convert_timestamp_to_datetime_obj(timestamp, as_string=False):
-    """Convert Unix timestamp (in milliseconds) to datetime object or string"""
-    if timestamp == 'N/A' or timestamp is None:
-        return 'N/A' if as_string else datetime.min
-    try:
-        timestamp_seconds = int(timestamp) / 1000
-        dt = datetime.fromtimestamp(timestamp_seconds)
-        return dt.strftime('%Y-%m-%d %H:%M:%S') if as_string else dt
-    except (ValueError, TypeError, OSError):
-        return 'Invalid Date' if as_string else datetime.min
-
-def format_value(value, no_commas=False):
-    """Format values for display, handling None, empty, and special values"""
-    if value is None or value == '' or value == 'N/A':
-        return '<span style="color: #999; font-style: italic;">N/A</span>'
-    if isinstance(value, (int, float)) and value == -1:
-        return '<span style="color: #999; font-style: italic;">Not Available</span>'
-    if isinstance(value, float):
-        if no_commas:
-            return f"{value:.2f}" if value < 1 else f"{value:.0f}"
-        return f"{value:,.2f}" if value >= 1 else f"{value:.2f}"
-    if isinstance(value, int):
-        if no_commas:
-            return str(value)
-        return f"{value:,}"
-    return str(value)
-
-def create_html_email(report_data, start_date, end_date):
-    """Create HTML formatted email from report data"""
-    
-    html = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta charset="UTF-8">
-        <style>
-            body {{
-                font-family: Arial, sans-serif;
-                line-height: 1.6;
-                color: #333;
-                max-width: 1200px;
-                margin: 0 auto;
-                padding: 20px;
-                background-color: #f5f5f5;
-            }}
-            .header {{
-                background: linear-gradient(135deg, #2c2c2c 0%, #1a1a1a 100%);
-                color: white;
-                padding: 30px;
-                border-radius: 10px;
-                margin-bottom: 30px;
-                text-align: center;
-            }}
-            .header h1 {{
-                margin: 0 0 10px 0;
-                font-size: 28px;
-            }}
-            .header p {{
-                margin: 5px 0;
-                font-size: 16px;
-                opacity: 0.9;
-            }}
-
-            .property-card {{
-                background: white;
-                margin-bottom: 30px;
-                border-radius: 10px;
-                box-shadow: 0 2px 10px rgba(0,0,0,0.1);
-                overflow: hidden;
-            }}
-            .property-header {{
-                background: #404040;
-                color: white;
-                padding: 20px;
-            }}
-            .property-header h3 {{
-                margin: 0 0 10px 0;
-                font-size: 20px;
-            }}
-            .property-header .address {{
-                font-size: 16px;
-                opacity: 0.9;
-            }}
-            .property-header .schedule {{
-                font-size: 14px;
-                opacity: 0.8;
-                margin-top: 5px;
-            }}
-            .property-details {{
-                padding: 25px;
-            }}
-            .details-grid {{
-                display: grid;
-                grid-template-columns: repeat(auto-fit, minmax(250px, 1fr));
-                gap: 20px;
-            }}
-            .detail-section {{
-                background: #f8f8f8;
-                padding: 15px;
-                border-radius: 8px;
-                border-left: 3px solid #666;
-            }}
-            .detail-section h4 {{
-                margin: 0 0 15px 0;
-                color: #333;
-                font-size: 16px;
-                border-bottom: 1px solid #ddd;
-                padding-bottom: 8px;
-            }}
-            .detail-row {{
-                display: flex;
-                justify-content: space-between;
-                margin-bottom: 8px;
-                padding: 5px 0;
-            }}
-            .detail-row:nth-child(even) {{
-                background: rgba(0, 0, 0, 0.05);
-                margin-left: -10px;
-                margin-right: -10px;
-                padding-left: 10px;
-                padding-right: 10px;
-                border-radius: 4px;
-            }}
-            .detail-label {{
-                font-weight: 600;
-                color: #555;
-                flex: 1;
-            }}
-            .detail-value {{
-                flex: 1;
-                text-align: right;
-                color: #333;
-            }}
-            .view-link {{
-                display: inline-block;
-                background: #333;
-                color: white;
-                padding: 10px 20px;
-                text-decoration: none;
-                border-radius: 5px;
-                margin-top: 15px;
-                font-weight: 600;
-            }}
-            .view-link:hover {{
-                background: #555;
-            }}
-            .footer {{
-                background: #1a1a1a;
-                color: white;
-                padding: 20px;
-                text-align: center;
-                border-radius: 10px;
-                margin-top: 30px;
-            }}
-        </style>
-    </head>
-    <body>
-        <div class="header">
-            <h1>Summit County Property Data Report</h1>
-            <p>Property modifications from {start_date.strftime('%B %d, %Y')}</p>
-            <p>Generated on {datetime.now().strftime('%B %d, %Y at %I:%M %p')}</p>
-        </div>
-    """
-    
-    # Add each property
-    for i, property_data in enumerate(report_data, 1):
-        attrs = property_data.get('full_attributes', {})
-        
-        html += f"""
-        <div class="property-card">
-            <div class="property-header">
-                <h3>Property #{i}</h3>
-                <div class="address">{format_value(property_data.get('address', 'N/A'))}</div>
-                <div class="schedule">Schedule: {format_value(property_data.get('schedule', 'N/A'), no_commas=True)}</div>
-            </div>
-            
-            <div class="property-details">
-                <div class="details-grid">
-                    <!-- Basic Information -->
-                    <div class="detail-section">
-                        <h4>📊 Basic Information</h4>
-                        <div class="detail-row">
-                            <span class="detail-label">PPI:</span>
-                            <span class="detail-value">{format_value(attrs.get('PPI'))}</span>
-                        </div>
-                        <div class="detail-row">
-                            <span class="detail-label">Schedule:</span>
-                            <span class="detail-value">{format_value(attrs.get('Schedule'), no_commas=True)}</span>
-                        </div>
-                        <div class="detail-row">
-                            <span class="detail-label">Filing:</span>
-                            <span class="detail-value">{format_value(attrs.get('Filing'))}</span>
-                        </div>
-                        <div class="detail-row">
-                            <span class="detail-label">Phase:</span>
-                            <span class="detail-value">{format_value(attrs.get('Phase'))}</span>
-                        </div>
-                        <div class="detail-row">
-                            <span class="detail-label">Description:</span>
-                            <span class="detail-value">{format_value(attrs.get('ShortDesc'))}</span>
-                        </div>
-                        <div class="detail-row">
-                            <span class="detail-label">Last Modified:</span>
-                            <span class="detail-value">{format_value(attrs.get('MODDATE'))}</span>
-                        </div>
-                    </div>
-                    
-                    <!-- Address Information -->
-                    <div class="detail-section">
-                        <h4>📍 Address Information</h4>
-                        <div class="detail-row">
-                            <span class="detail-label">House Number:</span>
-                            <span class="detail-value">{format_value(attrs.get('HouseNum'))}</span>
-                        </div>
-                        <div class="detail-row">
-                            <span class="detail-label">Full Street:</span>
-                            <span class="detail-value">{format_value(attrs.get('FullStreet'))}</span>
-                        </div>
-                        <div class="detail-row">
-                            <span class="detail-label">Street Name:</span>
-                            <span class="detail-value">{format_value(attrs.get('StreetName'))}</span>
-                        </div>
-                        <div class="detail-row">
-                            <span class="detail-label">Town:</span>
-                            <span class="detail-value">{format_value(attrs.get('TownName'))}</span>
-                        </div>
-                        <div class="detail-row">
-                            <span class="detail-label">Postal Code:</span>
-                            <span class="detail-value">{format_value(attrs.get('PostCode'))}</span>
-                        </div>
-                        <div class="detail-row">
-                            <span class="detail-label">Full Address:</span>
-                            <span class="detail-value">{format_value(attrs.get('FullAdd'))}</span>
-                        </div>
-                    </div>
-                    
-                    <!-- Property Size -->
-                    <div class="detail-section">
-                        <h4>📐 Property Size</h4>
-                        <div class="detail-row">
-                            <span class="detail-label">Total Acres:</span>
-                            <span class="detail-value">{format_value(attrs.get('TotAcres'))}</span>
-                        </div>
-                        <div class="detail-row">
-                            <span class="detail-label">Total Square Feet:</span>
-                            <span class="detail-value">{format_value(attrs.get('SquareFeet'))}</span>
-                        </div>
-                        <div class="detail-row">
-                            <span class="detail-label">Living Square Feet:</span>
-                            <span class="detail-value">{format_value(attrs.get('SqeFtLiving'))}</span>
-                        </div>
-                    </div>
-                    
-                    <!-- Building Details -->
-                    <div class="detail-section">
-                        <h4>🏠 Building Details</h4>
-                        <div class="detail-row">
-                            <span class="detail-label">Basement Type:</span>
-                            <span class="detail-value">{format_value(attrs.get('BsmtType'))}</span>
-                        </div>
-                        <div class="detail-row">
-                            <span class="detail-label">Garage Type:</span>
-                            <span class="detail-value">{format_value(attrs.get('GarageType'))}</span>
-                        </div>
-                        <div class="detail-row">
-                            <span class="detail-label">Number of Cars:</span>
-                            <span class="detail-value">{format_value(attrs.get('NumOfCars'))}</span>
-                        </div>
-                        <div class="detail-row">
-                            <span class="detail-label">Garage Sq Ft:</span>
-                            <span class="detail-value">{format_value(attrs.get('GarSqFt'))}</span>
-                        </div>
-                    </div>
-                    
-                    <!-- Room Information -->
-                    <div class="detail-section">
-                        <h4>🛏️ Room Information</h4>
-                        <div class="detail-row">
-                            <span class="detail-label">Number of Rooms:</span>
-                            <span class="detail-value">{format_value(attrs.get('NumOfRms'))}</span>
-                        </div>
-                        <div class="detail-row">
-                            <span class="detail-label">Bedrooms:</span>
-                            <span class="detail-value">{format_value(attrs.get('NumBedRms'))}</span>
-                        </div>
-                        <div class="detail-row">
-                            <span class="detail-label">Lofts:</span>
-                            <span class="detail-value">{format_value(attrs.get('NumLofts'))}</span>
-                        </div>
-                        <div class="detail-row">
-                            <span class="detail-label">Kitchens:</span>
-                            <span class="detail-value">{format_value(attrs.get('NumKitch'))}</span>
-                        </div>
-                        <div class="detail-row">
-                            <span class="detail-label">Master Bathrooms:</span>
-                            <span class="detail-value">{format_value(attrs.get('MasterBath'))}</span>
-                        </div>
-                        <div class="detail-row">
-                            <span class="detail-label">Full Bathrooms:</span>
-                            <span class="detail-value">{format_value(attrs.get('FullBath'))}</span>
-                        </div>
-                        <div class="detail-row">
-                            <span class="detail-label">Total Bathrooms:</span>
-                            <span class="detail-value">{format_value(attrs.get('TotBath'))}</span>
-                        </div>
-                    </div>
-                </div>
-                
-                <a href="{property_data.get('url', '#')}" class="view-link" target="_blank">
-                    View Full Details on County Website →
-                </a>
-            </div>
-        </div>
-        """
-    
-    html += """
-        <div class="footer">
-            <p>Summit County Property Data Email Report</p>
-            <p>This report contains the most recent property modifications in Summit County, Colorado</p>
-        </div>
-    </body>
-    </html>
+LAYER_19_FIELDS = "OBJECTID,PPI,SOURCE,MODDATE,MODTYPE,METHOD,OPERATOR"
+
+LAYER_12_FIELDS = ",".join(PROPERTY_FIELDS)
+
+# How far back the very first run looks, before any watermark has been saved
+INITIAL_LOOKBACK_MINUTES = 30
+# Where the last processed MODDATE/OBJECTID is persisted, overridable with WATERMARK_FILE
+WATERMARK_FILE = '.watermark.json'
+
+# Most layer 19 pages fetched at the same time; the shared adaptive limiter
+# in arcgis_client decides how many requests are actually in flight
+MAX_WORKERS = 8
+# Number of PPIs per layer 12 IN (...) query (capped below the layer's maxRecordCount), overridable with LAYER_12_BATCH_SIZE
+LAYER_12_BATCH_SIZE = 250
+# Most layer 12 batches queried at the same time, overridable with LAYER_12_MAX_WORKERS
+LAYER_12_MAX_WORKERS = 8
+
+def send_html_email(report_data, start_date, end_date, config, pool=None, source=DEFAULT_SOURCE):
+    """Send HTML formatted email with property data to every subscriber
+
+    config is the source's settings from load_config/source_config. An
+    open SMTPPool can be passed to reuse its logins across sends.
+    Returns True unless every recipient failed, so one bad address does
+    not make the whole list receive the same changes again.
     """
-    
-    return html
+    sender_email = config['sender_email']
+    password = config['email_password']
 
-def send_html_email(report_data, start_date, end_date):
-    """Send HTML formatted email with property data"""
-    
-    # Load environment variables
-    load_dotenv()
-    
-    # Email configuration
-    sender_email = os.getenv('SENDER_EMAIL')
-    receiver_email = os.getenv('RECEIVER_EMAIL')
-    password = os.getenv('EMAIL_PASSWORD')
-    
-    if not password:
+    if not password and config['smtp_host'] == SMTP_HOST:
         print("ERROR: EMAIL_PASSWORD environment variable not found!")
         return False
-    
-    # Create HTML content
-    html_content = create_html_email(report_data, start_date, end_date)
-    
-    # Create message
-    msg = MIMEMultipart('alternative')
-    msg['Subject'] = f'Summit County Property Report - {len(report_data)} Properties Modified'
-    msg['From'] = sender_email
-    msg['To'] = receiver_email
-    
-    # Create HTML part
-    html_part = MIMEText(html_content, 'html')
-    msg.attach(html_part)
-    
-    try:
-        # Send email
-        server = smtplib.SMTP("smtp.gmail.com", 587)
-        server.starttls()
-        server.login(sender_email, password)
-        server.sendmail(sender_email, receiver_email, msg.as_string())
-        server.quit()
-        
-        print(f"✅ Email sent successfully with {len(report_data)} properties!")
-        return True
-        
-    except Exception as e:
-        print(f"❌ Error sending email: {e}")
+
+    subscribers = load_subscribers(config['subscribers_file'], config['receiver_email'])
+    if not subscribers:
+        print("ERROR: No subscribers or RECEIVER_EMAIL configured!")
         return False
 
-# Main execution code
-def main():
-    # Calculate date range
-    minutes = 30
-    end_date = datetime.now()
-    start_date = end_date - timedelta(minutes=minutes)
-
-    # Format dates as YYYY-MM-DD for ArcGIS DATE 'YYYY-MM-DD' syntax
-    start_date_str = start_date.strftime("%Y-%m-%d")
-    end_date_str = end_date.strftime("%Y-%m-%d")
-
-    # Construct WHERE clause with DATE keyword
-    where_clause = f"SOURCE=1 AND MODDATE >= DATE '{start_date_str}' AND MODDATE <= DATE '{end_date_str}'"
-
-    # URL-encode the WHERE clause
-    encoded_where = urllib.parse.quote(where_clause)
-
-    # Build the full query URL
-    url = (
-        "https://gis.summitcountyco.gov/arcgis/rest/services/ParcelQueryTool/SummitMap1_Pro321/MapServer/19/query?"
-        f"where={encoded_where}&"
-        "text=&objectIds=&time=&timeRelation=esriTimeRelationOverlaps&"
-        "geometry=&geometryType=esriGeometryEnvelope&inSR=&spatialRel=esriSpatialRelIntersects&"
-        "distance=&units=esriSRUnit_Foot&relationParam=&"
-        "outFields=OBJECTID%2C+PPI%2C+SOURCE%2C+MODDATE%2C+MODTYPE%2C+METHOD%2C+OPERATOR&"
-        "returnGeometry=false&returnTrueCurves=false&maxAllowableOffset=&geometryPrecision=&"
-        "outSR=&havingClause=&returnIdsOnly=false&returnCountOnly=false&"
-        "orderByFields=MODDATE&groupByFieldsForStatistics=&outStatistics=&"
-        "returnZ=false&returnM=false&gdbVersion=&historicMoment=&returnDistinctValues=false&"
-        "resultOffset=&resultRecordCount=&returnExtentOnly=false&sqlFormat=none&"
-        "datumTransformation=&parameterValues=&rangeValues=&quantizationParameters=&"
-        "featureEncoding=esriDefault&f=pjson"
+    # Parcel shapes are only needed (and fetched once, then cached) for radius and area searches
+    locations = None
+    if has_spatial_rules(subscribers):
+        geometry_cache = GeometryCache(config['geometry_cache_file'], ttl_days=config['geometry_cache_ttl_days'])
+        try:
+            locations = locate_parcels([property_data.ppi for property_data in report_data], geometry_cache,
+                                       source=source)
+        except requests.RequestException as e:
+            print(f"❌ Error fetching parcel geometry: {e}")
+            return False
+        finally:
+            geometry_cache.close()
+
+    own_pool = pool is None
+    if own_pool:
+        pool = create_smtp_pool(config)
+    try:
+        results = deliver_reports(
+            report_data, start_date, end_date, subscribers, pool, sender_email,
+            limiter=RateLimiter(config['send_rate_per_second']),
+            locations=locations,
+            title=source.title,
+            region=source.region,
+            metric_labels=source.metric_labels,
+        )
+    finally:
+        if own_pool:
+            pool.close()
+
+    failed = [email for email, delivered in results.items() if not delivered]
+    print(f"✅ Email sent successfully to {len(results) - len(failed)} of {len(results)} subscribers "
+          f"with {len(report_data)} properties!")
+    return not results or len(failed) < len(results)
+
+def create_smtp_pool(config):
+    """Create an SMTPPool from the SMTP settings of load_config"""
+    return SMTPPool(
+        config['sender_email'],
+        config['email_password'],
+        size=config['smtp_pool_size'],
+        host=config['smtp_host'],
+        port=config['smtp_port'],
+        starttls=config['smtp_starttls'],
     )
 
-    print(f"🔍 Querying properties modified from {start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}")
-
-    # Send request
-    response = requests.get(url)
-    layer_19_json_data = response.json()
-
-    # Find PPI Values and create PPI to MODDATE mapping
-    if layer_19_json_data and 'features' in layer_19_json_data:
-        ppi_values = [feature['attributes']['PPI'] for feature in layer_19_json_data['features']]
-        
-        # Create mapping from PPI to MODDATE for later assignment
-        ppi_to_moddate = {
-            feature['attributes']['PPI']: feature['attributes']['MODDATE'] 
-            for feature in layer_19_json_data['features']
-        }
-        
-        # Convert timestamps to readable dates in the mapping
-        ppi_to_moddate_readable = {
-            ppi: convert_timestamp_to_datetime_obj(timestamp, as_string=True)
-            for ppi, timestamp in ppi_to_moddate.items()
-        }
-        
-        print(f"📊 Retrieved {len(ppi_values)} PPI values from layer 19")
-
-        # Construct the WHERE clause with IN operator
-        if ppi_values:
-            # Format PPI values as a comma-separated string with single quotes
-            ppi_list = ",".join(f"'{ppi}'" for ppi in ppi_values)
-            where_clause = f"PPI IN ({ppi_list})"
-            encoded_where_clause = urllib.parse.quote(where_clause)
-
-            # Base URL for the query with specified outFields and f=pjson
-            base_url = (
-                "https://gis.summitcountyco.gov/arcgis/rest/services/ParcelQueryTool/SummitMap1_Pro321/MapServer/12/query"
-                "?text=&objectIds=&time=&timeRelation=esriTimeRelationOverlaps"
-                "&geometry=&geometryType=esriGeometryEnvelope&inSR=&spatialRel=esriSpatialRelIntersects"
-                "&distance=&units=esriSRUnit_Foot&relationParam="
-                "&outFields=PPI,Schedule,Filing,Phase,ShortDesc,HouseNum,FullStreet,StreetName,TownName,PostCode,FullAdd,TotAcres,SquareFeet,SqeFtLiving,BsmtType,GarageType,NumOfCars,GarSqFt,NumOfRms,NumBedRms,NumLofts,NumKitch,MasterBath,FullBath,TotBath"
-                "&returnGeometry=false&returnTrueCurves=false&maxAllowableOffset=&geometryPrecision=&outSR="
-                "&havingClause=&returnIdsOnly=false&returnCountOnly=false&orderByFields="
-                "&groupByFieldsForStatistics=&outStatistics=&returnZ=false&returnM=false"
-                "&gdbVersion=&historicMoment=&returnDistinctValues=false&resultOffset="
-                "&resultRecordCount=&returnExtentOnly=false&sqlFormat=none&datumTransformation="
-                "¶meterValues=&rangeValues=&quantizationParameters=&featureEncoding=esriDefault&f=pjson"
+def layer_19_query(where_clause, source=DEFAULT_SOURCE, **params):
+    return source.change_query(where_clause, LAYER_19_FIELDS, **params)
+
+def query_layer_19(where_clause, source=DEFAULT_SOURCE, **params):
+    """Run a change layer (layer 19) query and return the decoded JSON response"""
+    return source.query_changes(layer_19_query(where_clause, source, **params))
+
+def stream_layer_19(where_clause, source=DEFAULT_SOURCE, **params):
+    """Run a change layer (layer 19) query and return a FeatureStream that parses features as they arrive"""
+    return source.stream_changes(layer_19_query(where_clause, source, **params))
+
+def plan_layer_19_pages(where_clause, first_page_size, source=DEFAULT_SOURCE):
+    """Plan the remaining layer 19 pages as query parameter sets
+
+    Pages are planned from returnCountOnly when the server supports
+    resultOffset paging, otherwise from OBJECTID ranges via returnIdsOnly.
+    """
+    if source.change_metadata().supports_pagination is not False:
+        try:
+            total = query_layer_19(where_clause, source, returnCountOnly='true').get('count', 0)
+            return total, [
+                {'resultOffset': offset, 'resultRecordCount': first_page_size}
+                for offset in range(first_page_size, total, first_page_size)
+            ]
+        except requests.RequestException:
+            pass
+    # The first page was ordered by MODDATE, so plan every OBJECTID range and let the caller dedupe
+    object_ids = sorted(query_layer_19(where_clause, source, returnIdsOnly='true').get('objectIds') or [])
+    return len(object_ids), [
+        {'where': source.object_id_range_where(chunk[0], chunk[-1], where_clause)}
+        for chunk in (object_ids[i:i + first_page_size] for i in range(0, len(object_ids), first_page_size))
+    ]
+
+def fetch_layer_19_page(where_clause, params, source=DEFAULT_SOURCE):
+    """Fetch one planned layer 19 page, parsing its features as they stream in"""
+    return list(stream_layer_19(where_clause, source, **params))
+
+def fetch_layer_19_features(where_clause, max_workers=MAX_WORKERS, source=DEFAULT_SOURCE):
+    """Yield layer 19 features as each page arrives, paging past the server's transfer limit
+
+    Attributes carry the report field names (see sources.py).
+    """
+    first_page = stream_layer_19(where_clause, source)
+    seen_object_ids = set()
+    to_report_fields = source.to_report_fields
+    for feature in first_page:
+        attributes = feature['attributes'] = to_report_fields(feature['attributes'])
+        seen_object_ids.add(attributes.get('OBJECTID'))
+        yield feature
+
+    if not first_page.metadata.get('exceededTransferLimit'):
+        return
+
+    # The server caps pages at its own maxRecordCount, so size pages from what it returned
+    total, pages = plan_layer_19_pages(where_clause, len(seen_object_ids), source)
+    print(f"📄 {source.title} layer {source.change_layer} exceeded its transfer limit, "
+          f"fetching {len(pages)} more pages for {total} records")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(fetch_layer_19_page, page.pop('where', where_clause), page, source)
+            for page in pages
+        ]
+        for future in as_completed(futures):
+            for feature in future.result():
+                attributes = feature['attributes'] = to_report_fields(feature['attributes'])
+                object_id = attributes.get('OBJECTID')
+                if object_id not in seen_object_ids:
+                    seen_object_ids.add(object_id)
+                    yield feature
+
+    if len(seen_object_ids) < total:
+        print(f"⚠️ Expected {total} layer {source.change_layer} records but received {len(seen_object_ids)}")
+
+def fetch_layer_12_batch(ppi_batch, source=DEFAULT_SOURCE):
+    """POST an attribute layer (layer 12) PPI IN (...) query and return every record of the batch
+
+    A response cut off at the transfer limit is queried again as two
+    half batches, so PPIs with many schedules are never silently dropped.
+    """
+    form = source.attribute_batch_query(ppi_batch, LAYER_12_FIELDS)
+    to_report_fields = source.to_report_fields
+    stream = source.stream_attributes(form, method='POST')
+    records = [to_report_fields(feature['attributes']) for feature in stream]
+    if not stream.metadata.get('exceededTransferLimit'):
+        return records
+    if len(ppi_batch) == 1:
+        print(f"⚠️ Layer {source.attribute_layer} returned only {len(records)} records for PPI {ppi_batch[0]} "
+              f"(transfer limit reached)")
+        return records
+    middle = len(ppi_batch) // 2
+    return fetch_layer_12_batch(ppi_batch[:middle], source) + fetch_layer_12_batch(ppi_batch[middle:], source)
+
+def query_layer_12_batch(ppi_batch, source=DEFAULT_SOURCE):
+    """Look up the layer 12 records of one PPI batch and return them with the batch's latency"""
+    started = time.perf_counter()
+    records = fetch_layer_12_batch(ppi_batch, source)
+    return records, time.perf_counter() - started
+
+def iter_layer_12_batches(ppi_values, batch_size=LAYER_12_BATCH_SIZE, max_workers=LAYER_12_MAX_WORKERS,
+                          source=DEFAULT_SOURCE):
+    """Look up layer 12 records for the given PPIs in concurrent POST batches, yielding each batch as it completes"""
+    batch_size = source.attribute_metadata().batch_size(batch_size)
+    batches = [ppi_values[i:i + batch_size] for i in range(0, len(ppi_values), batch_size)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(query_layer_12_batch, batch, source): number for number, batch in enumerate(batches, 1)}
+        for future in as_completed(futures):
+            records, elapsed = future.result()
+            print(f"   ⏱️ Layer 12 batch {futures[future]}/{len(batches)}: {len(records)} records in {elapsed:.2f}s")
+            yield records
+
+def fetch_layer_12_features(ppi_values, batch_size=LAYER_12_BATCH_SIZE, max_workers=LAYER_12_MAX_WORKERS,
+                            source=DEFAULT_SOURCE):
+    """Look up layer 12 features for the given PPIs in concurrent POST batches"""
+    return [
+        {'attributes': attributes}
+        for records in iter_layer_12_batches(ppi_values, batch_size=batch_size, max_workers=max_workers, source=source)
+        for attributes in records
+    ]
+
+def iter_layer_12_records_cached(ppi_values, cache, batch_size=LAYER_12_BATCH_SIZE, max_workers=LAYER_12_MAX_WORKERS,
+                                 source=DEFAULT_SOURCE, moddates=None):
+    """Yield layer 12 attribute records from the parcel cache, querying only misses and stale entries
+
+    moddates ({ppi: layer 19 MODDATE}) makes entries cached before a
+    PPI's change stale, so a change is never reported with the old
+    attributes. Fetched batches are written to the cache as they arrive
+    and handed on without being collected, so callers can consume them
+    in one pass.
+    """
+    cached, to_fetch = cache.get_many(ppi_values, moddates=moddates)
+    cached_count = len(cached)
+    for records in cached.values():
+        yield from records
+    del cached
+
+    if to_fetch:
+        for records in iter_layer_12_batches(to_fetch, batch_size=batch_size, max_workers=max_workers, source=source):
+            cache.put_many(records)
+            yield from records
+
+    stats = cache.stats()
+    print(f"💾 Parcel cache: {cached_count} cached, {len(to_fetch)} fetched "
+          f"(lifetime {stats['hits']} hits, {stats['misses']} misses, {stats['stale']} stale)")
+
+def load_watermark(path=WATERMARK_FILE):
+    """Return the saved (MODDATE, OBJECTID) high-water mark, or None before the first run"""
+    try:
+        with open(path) as f:
+            state = json.load(f)
+        return int(state['moddate']), int(state['objectid'])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+def save_watermark(moddate, objectid, path=WATERMARK_FILE):
+    """Persist the high-water mark atomically so a crash never leaves a torn file"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump({'moddate': moddate, 'objectid': objectid}, f)
+    os.replace(temp_path, path)
+
+def build_watermark_where(watermark, end_ms, source=DEFAULT_SOURCE):
+    """Build a layer 19 WHERE clause selecting rows after the watermark, up to end_ms"""
+    return source.watermark_where(watermark, end_ms)
+
+def load_config():
+    """Read run settings from the environment (and .env) once"""
+    load_dotenv()
+    return {
+        'batch_size': int(os.getenv('LAYER_12_BATCH_SIZE', LAYER_12_BATCH_SIZE)),
+        'max_workers': int(os.getenv('LAYER_12_MAX_WORKERS', LAYER_12_MAX_WORKERS)),
+        'watermark_file': os.getenv('WATERMARK_FILE', WATERMARK_FILE),
+        'snapshot_dir': os.getenv('SNAPSHOT_DIR', SNAPSHOT_DIR),
+        'history_dir': os.getenv('HISTORY_DIR', HISTORY_DIR),
+        'parcel_cache_file': os.getenv('PARCEL_CACHE_FILE', PARCEL_CACHE_FILE),
+        'parcel_cache_ttl_hours': float(os.getenv('PARCEL_CACHE_TTL_HOURS', PARCEL_CACHE_TTL_HOURS)),
+        'parcel_cache_max_entries': int(os.getenv('PARCEL_CACHE_MAX_ENTRIES', PARCEL_CACHE_MAX_ENTRIES)),
+        'enrich_details': os.getenv('ENRICH_DETAILS', 'false').lower() == 'true',
+        'detail_cache_file': os.getenv('DETAIL_CACHE_FILE', DETAIL_CACHE_FILE),
+        'detail_cache_max_age_hours': float(os.getenv('DETAIL_CACHE_MAX_AGE_HOURS', DETAIL_CACHE_MAX_AGE_HOURS)),
+        'detail_max_workers': int(os.getenv('DETAIL_MAX_WORKERS', DETAIL_MAX_WORKERS)),
+        'geometry_cache_file': os.getenv('GEOMETRY_CACHE_FILE', GEOMETRY_CACHE_FILE),
+        'geometry_cache_ttl_days': float(os.getenv('GEOMETRY_CACHE_TTL_DAYS', GEOMETRY_CACHE_TTL_DAYS)),
+        'sender_email': os.getenv('SENDER_EMAIL'),
+        'email_password': os.getenv('EMAIL_PASSWORD'),
+        'receiver_email': os.getenv('RECEIVER_EMAIL'),
+        'subscribers_file': os.getenv('SUBSCRIBERS_FILE', SUBSCRIBERS_FILE),
+        'smtp_host': os.getenv('SMTP_HOST', SMTP_HOST),
+        'smtp_port': int(os.getenv('SMTP_PORT', SMTP_PORT)),
+        'smtp_starttls': os.getenv('SMTP_STARTTLS', 'true').lower() != 'false',
+        'smtp_pool_size': int(os.getenv('SMTP_POOL_SIZE', SMTP_POOL_SIZE)),
+        'send_rate_per_second': float(os.getenv('SEND_RATE_PER_SECOND', SEND_RATE_PER_SECOND)),
+        'metrics_log': os.getenv('METRICS_LOG'),
+        'metrics_file': os.getenv('METRICS_FILE'),
+        'metrics_port': int(os.getenv('METRICS_PORT') or 0),
+        'sources_file': os.getenv('SOURCES_FILE', SOURCES_FILE),
+    }
+
+def source_config(config, source):
+    """Return config with the state paths of one source (see Source.state_path)"""
+    paths = ('watermark_file', 'snapshot_dir', 'history_dir', 'parcel_cache_file', 'detail_cache_file',
+             'geometry_cache_file')
+    return dict(config, **{key: source.state_path(config[key]) for key in paths})
+
+def poll_window(watermark_file, source=DEFAULT_SOURCE):
+    """Return (start_date, end_date, watermark, where_clause) for the next poll
+
+    Everything after the last processed row is queried in exact epoch milliseconds.
+    """
+    end_date = datetime.now()
+    end_ms = int(end_date.timestamp() * 1000)
+    watermark = load_watermark(watermark_file)
+    if watermark is None:
+        start_date = end_date - timedelta(minutes=INITIAL_LOOKBACK_MINUTES)
+        watermark = (int(start_date.timestamp() * 1000) - 1, 0)
+    else:
+        start_date = datetime.fromtimestamp(watermark[0] / 1000)
+    return start_date, end_date, watermark, build_watermark_where(watermark, end_ms, source)
+
+def fetch_changes(where_clause, watermark, source=DEFAULT_SOURCE):
+    """Stage 1: stream layer 19 pages into {PPI: latest MODDATE} and the advanced watermark"""
+    ppi_to_moddate = {}
+    new_watermark = watermark
+    for feature in fetch_layer_19_features(where_clause, source=source):
+        ppi = feature['attributes']['PPI']
+        moddate = feature['attributes']['MODDATE']
+        # Pages arrive out of order, so keep the most recent MODDATE per PPI
+        if ppi not in ppi_to_moddate or (moddate or 0) > (ppi_to_moddate[ppi] or 0):
+            ppi_to_moddate[ppi] = moddate
+        if moddate is not None:
+            new_watermark = max(new_watermark, (moddate, feature['attributes']['OBJECTID']))
+    return ppi_to_moddate, new_watermark
+
+def fetch_parcel_records(ppi_to_moddate, cache, batch_size=LAYER_12_BATCH_SIZE, max_workers=LAYER_12_MAX_WORKERS,
+                         source=DEFAULT_SOURCE):
+    """Stage 2: stream the layer 12 attribute records of the changed PPIs ({ppi: MODDATE}) as batches arrive"""
+    return iter_layer_12_records_cached(list(ppi_to_moddate), cache, batch_size=batch_size, max_workers=max_workers,
+                                        source=source, moddates=ppi_to_moddate)
+
+def join_report(property_attributes, ppi_to_moddate, record_type=PropertyRecord):
+    """Stage 3: join layer 12 records with their layer 19 MODDATE into PropertyRecord rows
+
+    Consumes any iterable in a single pass, so records can stream straight
+    from fetch_parcel_records; each row keeps its values in one tuple.
+    record_type is the source's record class (see Source.record_type).
+    """
+    return [record_type(attributes, ppi_to_moddate.get(attributes.get('PPI'))) for attributes in property_attributes]
+
+def mark_changed_fields(report_data, snapshot_dir):
+    """Diff the joined records against the last full-county snapshot and attach each row's changed fields"""
+    changed_fields_by_key = diff_against_latest([record.full_attributes for record in report_data], snapshot_dir)
+    if changed_fields_by_key:
+        for record in report_data:
+            changes = changed_fields_by_key.get(record_key(record.full_attributes))
+            if changes:
+                record.changed_fields = changes
+    return len(changed_fields_by_key)
+
+def sort_report(report_data):
+    """Stage 4: sort report rows by MODDATE (most recent first) on their precomputed epoch-ms keys"""
+    report_data.sort(key=attrgetter('sort_key'), reverse=True)
+    return report_data
+
+def run_cycle(config, cache, smtp_pool=None, source=DEFAULT_SOURCE):
+    """Run one poll: query changes since the watermark, report them, advance the watermark
+
+    config holds the source's own state paths (see source_config).
+    Returns the number of changed PPIs found, or None if a query failed.
+    """
+    prefix = config.get('log_prefix', '')
+    labels = source.metric_labels
+    start_date, end_date, watermark, where_clause = poll_window(config['watermark_file'], source)
+    print(f"{prefix}🔍 Querying properties modified after {start_date.strftime('%Y-%m-%d %H:%M:%S')}")
+
+    try:
+        with REGISTRY.stage('layer_19', labels):
+            ppi_to_moddate, new_watermark = fetch_changes(where_clause, watermark, source)
+    except requests.RequestException as e:
+        print(f"{prefix}❌ Error querying layer {source.change_layer}: {e}")
+        return None
+
+    REGISTRY.inc('records_fetched_total', len(ppi_to_moddate), layer='19', **labels)
+    if not ppi_to_moddate:
+        print(f"{prefix}❌ No features found in layer {source.change_layer} query results")
+        return 0
+    print(f"{prefix}📊 Retrieved {len(ppi_to_moddate)} PPI values from layer {source.change_layer}")
+
+    # Look up layer 12 attributes in batched PPI IN (...) queries, joining records as they stream in
+    try:
+        with REGISTRY.stage('layer_12_join', labels, ppis=len(ppi_to_moddate)):
+            report_data = join_report(
+                fetch_parcel_records(
+                    ppi_to_moddate, cache, batch_size=config['batch_size'], max_workers=config['max_workers'],
+                    source=source,
+                ),
+                ppi_to_moddate,
+                record_type=source.record_type,
             )
+    except requests.RequestException as e:
+        print(f"{prefix}❌ Error querying layer {source.attribute_layer}: {e}")
+        return None
+    print(f"{prefix}🏠 Retrieved {len(report_data)} property records from layer {source.attribute_layer}")
+    REGISTRY.inc('records_fetched_total', len(report_data), layer='12', **labels)
+    cache_stats = cache.stats()
+    for name in ('hits', 'misses', 'stale', 'entries'):
+        REGISTRY.set(f'parcel_cache_{name}', cache_stats[name], **labels)
 
-            # Construct the full URL with the encoded WHERE clause
-            url = f"{base_url}&where={encoded_where_clause}"
+    # Compare against the last full-county snapshot to find which fields changed
+    with REGISTRY.stage('diff', labels):
+        changed_count = mark_changed_fields(report_data, config['snapshot_dir'])
+    if changed_count:
+        print(f"{prefix}🔎 {changed_count} records have field changes since the last snapshot")
 
-            # Make the HTTP request to fetch results
-            try:
-                response = requests.get(url)
-                response.raise_for_status()
-                layer_12_json_data = response.json()
-
-                # Extract schedule values and property attributes with MODDATE assignment
-                schedule_values = [feature['attributes']['Schedule'] for feature in layer_12_json_data['features']]
-                property_attributes = [feature['attributes'] for feature in layer_12_json_data['features']]
-                
-                print(f"🏠 Retrieved {len(schedule_values)} property records from layer 12")
-
-                report_data = []
-                for schedule, attributes in zip(schedule_values, property_attributes):
-                    url = f'https://gis.summitcountyco.gov/map/DetailData.aspx?Schno={schedule}'
-                    address = attributes.get('FullAdd', 'N/A')
-                    living_sqft = attributes.get('SqeFtLiving', 'N/A')
-                    acres = attributes.get('TotAcres', 'N/A')
-                    ppi = attributes.get('PPI')
-                    
-                    # Assign MODDATE from layer 19 if PPI matches
-                    moddate_readable = ppi_to_moddate_readable.get(ppi, 'N/A')
-                    
-                    # Add readable MODDATE to the full attributes
-                    attributes_with_moddate = attributes.copy()
-                    attributes_with_moddate['MODDATE'] = moddate_readable
-                    
-                    report_data.append({
-                        'url': url,
-                        'schedule': schedule,
-                        'address': address,
-                        'living_sqft': living_sqft,
-                        'acres': acres,
-                        'full_attributes': attributes_with_moddate
-                    })
-
-                # Sort report_data by MODDATE (most recent first)
-                report_data.sort(
-                    key=lambda x: convert_timestamp_to_datetime_obj(
-                        ppi_to_moddate.get(x['full_attributes'].get('PPI'))
-                    ),
-                    reverse=True
+    with REGISTRY.stage('sort', labels):
+        sort_report(report_data)
+    print(f"{prefix}✅ Successfully processed {len(report_data)} records (sorted by most recent MODDATE)")
+    
+    # Print summary of MODDATE assignments
+    matched_count = sum(1 for record in report_data if record.moddate_ms is not None)
+    print(f"{prefix}📅 MODDATE assigned to {matched_count} out of {len(report_data)} records")
+    REGISTRY.set('join_match_ratio', matched_count / len(report_data) if report_data else 1.0, **labels)
+    REGISTRY.log('join', records=len(report_data), matched=matched_count, **labels)
+
+    # Add owner, valuation and sale fields from the detail pages (opt-in with ENRICH_DETAILS)
+    if config['enrich_details'] and source.detail_url and report_data:
+        detail_cache = DetailCache(config['detail_cache_file'])
+        try:
+            with REGISTRY.stage('enrich', labels, records=len(report_data)):
+                enrich_report(
+                    report_data, detail_cache,
+                    max_workers=config['detail_max_workers'], max_age_hours=config['detail_cache_max_age_hours'],
+                    url=source.detail_url,
                 )
+        finally:
+            detail_cache.close()
 
-                print(f"✅ Successfully processed {len(report_data)} records (sorted by most recent MODDATE)")
-                
-                # Print summary of MODDATE assignments
-                matched_count = sum(1 for item in report_data if item['full_attributes'].get('MODDATE') != 'N/A')
-                print(f"📅 MODDATE assigned to {matched_count} out of {len(report_data)} records")
-
-                # Send HTML email
-                if report_data:
-                    print("📧 Sending HTML email...")
-                    send_html_email(report_data, start_date, end_date)
-                else:
-                    print("❌ No data to send in email")
-
-            except requests.RequestException as e:
-                print(f"❌ Error querying layer 12: {e}")
-        else:
-            print("❌ No PPI values found to query layer 12")
+    # Send HTML email
+    if report_data:
+        print(f"{prefix}📧 Sending HTML email...")
+        with REGISTRY.stage('deliver', labels, records=len(report_data)):
+            delivered = send_html_email(report_data, start_date, end_date, config, pool=smtp_pool, source=source)
+    else:
+        print(f"{prefix}❌ No data to send in email")
+        delivered = True
+
+    # Only advance past these rows once they have been reported
+    if delivered:
+        # The report is out, so nothing going wrong with the history may hold back the watermark
+        if config['history_dir'] and report_data:
+            try:
+                with REGISTRY.stage('history', labels, records=len(report_data)):
+                    added = append_records(report_data, config['history_dir'])
+                print(f"{prefix}🗄️ Added {added} changes to the history in {config['history_dir']}")
+            except Exception as e:
+                print(f"{prefix}⚠️ Could not append to the history: {e}")
+        save_watermark(*new_watermark, path=config['watermark_file'])
+        REGISTRY.set('watermark_moddate_ms', new_watermark[0], **labels)
+
+    return len(ppi_to_moddate)
+
+def open_parcel_cache(config):
+    return ParcelCache(
+        config['parcel_cache_file'],
+        ttl_hours=config['parcel_cache_ttl_hours'],
+        max_entries=config['parcel_cache_max_entries'],
+    )
+
+def poll_sources(sources, configs, caches, smtp_pool=None):
+    """Run one cycle for every source at the same time over the shared HTTP session
+
+    With several sources, one whose cycle fails or raises is reported and
+    skipped; the others still report and advance. Returns the total
+    number of changed PPIs, or None if every source failed.
+    """
+    def poll(source):
+        try:
+            with REGISTRY.stage('cycle', source.metric_labels):
+                changes = run_cycle(configs[source.name], caches[source.name], smtp_pool, source)
+        except Exception as e:
+            if len(sources) == 1:
+                raise
+            print(f"{configs[source.name]['log_prefix']}❌ Poll cycle failed: {e}")
+            changes = None
+        REGISTRY.inc('cycles_total', status='error' if changes is None else 'ok', **source.metric_labels)
+        return changes
+
+    if len(sources) == 1:
+        results = [poll(sources[0])]
     else:
-        print("❌ No features found in layer 19 query results")
+        with ThreadPoolExecutor(max_workers=len(sources)) as executor:
+            results = list(executor.map(poll, sources))
+    succeeded = [changes for changes in results if changes is not None]
+    return sum(succeeded) if succeeded else None
+
+# Main execution code
+def main():
+    parser = argparse.ArgumentParser(description="Email recently modified parcels of each configured county")
+    parser.add_argument('--daemon', action='store_true',
+                        help="keep running and poll on an adaptive schedule instead of polling once")
+    parser.add_argument('--source', action='append', metavar='NAME',
+                        help="only poll this source from the sources file (repeatable)")
+    args = parser.parse_args()
+
+    config = load_config()
+    configure_metrics(config['metrics_log'])
+    try:
+        sources = load_sources(config['sources_file'])
+    except ValueError as e:
+        parser.error(str(e))
+    if args.source:
+        unknown = set(args.source) - {source.name for source in sources}
+        if unknown:
+            parser.error(f"unknown source: {', '.join(sorted(unknown))}")
+        sources = [source for source in sources if source.name in args.source]
+
+    configs = {
+        source.name: dict(source_config(config, source), log_prefix=f"[{source.name}] " if len(sources) > 1 else '')
+        for source in sources
+    }
+
+    def cycle(smtp_pool=None):
+        changes = poll_sources(sources, configs, caches, smtp_pool)
+        if config['metrics_file']:
+            write_prometheus_file(config['metrics_file'])
+        return changes
+
+    caches = {}
+    try:
+        for source in sources:
+            caches[source.name] = open_parcel_cache(configs[source.name])
+        if args.daemon:
+            # Keep SMTP logins open across cycles alongside the pooled HTTP session
+            smtp_pool = create_smtp_pool(config)
+            metrics_server = serve_metrics(config['metrics_port']) if config['metrics_port'] else None
+            try:
+                run_daemon(lambda: cycle(smtp_pool))
+            finally:
+                smtp_pool.close()
+                if metrics_server is not None:
+                    metrics_server.shutdown()
+        else:
+            cycle()
+    finally:
+        for cache in caches.values():
+            cache.close()
+        close_session()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,472 @@
+"""HTML email rendering for property reports
+
+Templates are compiled once at import into minified format strings and
+every report is assembled with list joins, so rendering time grows
+linearly with the number of properties. create_html_emails() also keeps
+each message under a byte budget (Gmail clips messages at about 102 KB),
+splitting large reports into numbered parts or, past MAX_EMAIL_PARTS,
+into a compact summary table with a CSV attachment.
+
+    python report.py --benchmark 10000
+"""
+import argparse
+import csv
+import html
+import io
+import re
+import time
+from datetime import datetime
+
+from enrichment import MONEY_FIELDS
+
+# Keep each HTML message below Gmail's ~102 KB clipping threshold
+REPORT_BYTE_BUDGET = 95_000
+# Reports needing more parts than this are sent as a summary table with a CSV attachment
+MAX_EMAIL_PARTS = 5
+# County named in report headers, footers and subjects (see Source.title and Source.region)
+REPORT_TITLE = 'Summit County'
+REPORT_REGION = 'Summit County, Colorado'
+
+CSS = """
+body {
+    font-family: Arial, sans-serif;
+    line-height: 1.6;
+    color: #333;
+    max-width: 1200px;
+    margin: 0 auto;
+    padding: 20px;
+    background-color: #f5f5f5;
+}
+.header {
+    background: linear-gradient(135deg, #2c2c2c 0%, #1a1a1a 100%);
+    color: white;
+    padding: 30px;
+    border-radius: 10px;
+    margin-bottom: 30px;
+    text-align: center;
+}
+.header h1 {
+    margin: 0 0 10px 0;
+    font-size: 28px;
+}
+.header p {
+    margin: 5px 0;
+    font-size: 16px;
+    opacity: 0.9;
+}
+
+.property-card {
+    background: white;
+    margin-bottom: 30px;
+    border-radius: 10px;
+    box-shadow: 0 2px 10px rgba(0,0,0,0.1);
+    overflow: hidden;
+}
+.property-header {
+    background: #404040;
+    color: white;
+    padding: 20px;
+}
+.property-header h3 {
+    margin: 0 0 10px 0;
+    font-size: 20px;
+}
+.property-header .address {
+    font-size: 16px;
+    opacity: 0.9;
+}
+.property-header .schedule {
+    font-size: 14px;
+    opacity: 0.8;
+    margin-top: 5px;
+}
+.property-details {
+    padding: 25px;
+}
+.details-grid {
+    display: grid;
+    grid-template-columns: repeat(auto-fit, minmax(250px, 1fr));
+    gap: 20px;
+}
+.detail-section {
+    background: #f8f8f8;
+    padding: 15px;
+    border-radius: 8px;
+    border-left: 3px solid #666;
+}
+.detail-section h4 {
+    margin: 0 0 15px 0;
+    color: #333;
+    font-size: 16px;
+    border-bottom: 1px solid #ddd;
+    padding-bottom: 8px;
+}
+.detail-row {
+    display: flex;
+    justify-content: space-between;
+    margin-bottom: 8px;
+    padding: 5px 0;
+}
+.detail-row:nth-child(even) {
+    background: rgba(0, 0, 0, 0.05);
+    margin-left: -10px;
+    margin-right: -10px;
+    padding-left: 10px;
+    padding-right: 10px;
+    border-radius: 4px;
+}
+.detail-label {
+    font-weight: 600;
+    color: #555;
+    flex: 1;
+}
+.detail-value {
+    flex: 1;
+    text-align: right;
+    color: #333;
+}
+.view-link {
+    display: inline-block;
+    background: #333;
+    color: white;
+    padding: 10px 20px;
+    text-decoration: none;
+    border-radius: 5px;
+    margin-top: 15px;
+    font-weight: 600;
+}
+.view-link:hover {
+    background: #555;
+}
+.footer {
+    background: #1a1a1a;
+    color: white;
+    padding: 20px;
+    text-align: center;
+    border-radius: 10px;
+    margin-top: 30px;
+}
+.changed {
+    background: #fff3cd;
+    padding: 0 4px;
+    border-radius: 3px;
+}
+.notice {
+    background: #fff3cd;
+    padding: 12px 16px;
+    border-radius: 8px;
+    margin-bottom: 20px;
+}
+.summary-table {
+    width: 100%;
+    border-collapse: collapse;
+    background: white;
+}
+.summary-table th, .summary-table td {
+    padding: 6px 8px;
+    border-bottom: 1px solid #ddd;
+    text-align: left;
+    font-size: 14px;
+}
+.summary-table th {
+    background: #404040;
+    color: white;
+}
+"""
+
+# (section title, [(label, field, no_commas), ...]) in card display order
+CARD_SECTIONS = [
+    ('📊 Basic Information', [
+        ('PPI:', 'PPI', False),
+        ('Schedule:', 'Schedule', True),
+        ('Filing:', 'Filing', False),
+        ('Phase:', 'Phase', False),
+        ('Description:', 'ShortDesc', False),
+        ('Last Modified:', 'MODDATE', False),
+    ]),
+    ('📍 Address Information', [
+        ('House Number:', 'HouseNum', False),
+        ('Full Street:', 'FullStreet', False),
+        ('Street Name:', 'StreetName', False),
+        ('Town:', 'TownName', False),
+        ('Postal Code:', 'PostCode', False),
+        ('Full Address:', 'FullAdd', False),
+    ]),
+    ('📐 Property Size', [
+        ('Total Acres:', 'TotAcres', False),
+        ('Total Square Feet:', 'SquareFeet', False),
+        ('Living Square Feet:', 'SqeFtLiving', False),
+    ]),
+    ('🏠 Building Details', [
+        ('Basement Type:', 'BsmtType', False),
+        ('Garage Type:', 'GarageType', False),
+        ('Number of Cars:', 'NumOfCars', False),
+        ('Garage Sq Ft:', 'GarSqFt', False),
+    ]),
+    ('🛏️ Room Information', [
+        ('Number of Rooms:', 'NumOfRms', False),
+        ('Bedrooms:', 'NumBedRms', False),
+        ('Lofts:', 'NumLofts', False),
+        ('Kitchens:', 'NumKitch', False),
+        ('Master Bathrooms:', 'MasterBath', False),
+        ('Full Bathrooms:', 'FullBath', False),
+        ('Total Bathrooms:', 'TotBath', False),
+    ]),
+]
+
+# Detail page fields (see enrichment.py) as (label, field, no_commas), shown as an extra card section on enriched records
+DETAIL_SECTION = ('💰 Owner and Sales', [
+    ('Owner:', 'Owner', False),
+    ('Mailing Address:', 'MailingAddress', False),
+    ('Tax Year:', 'TaxYear', True),
+    ('Actual Value:', 'ActualValue', False),
+    ('Assessed Value:', 'AssessedValue', False),
+    ('Last Sale Date:', 'LastSaleDate', False),
+    ('Last Sale Price:', 'LastSalePrice', False),
+    ('Recorded Sales:', 'SaleCount', False),
+])
+
+# Summary table columns as (heading, field, no_commas)
+SUMMARY_COLUMNS = [
+    ('Schedule', 'Schedule', True),
+    ('Address', 'FullAdd', False),
+    ('Town', 'TownName', False),
+    ('Living Sq Ft', 'SqeFtLiving', False),
+    ('Acres', 'TotAcres', False),
+    ('Last Modified', 'MODDATE', False),
+]
+
+def minify(markup):
+    """Collapse the whitespace that only exists to make templates readable"""
+    markup = re.sub(r'\s+', ' ', markup)
+    return re.sub(r'\s*([{};:,>])\s*', r'\1', markup).strip()
+
+def compile_card_template():
+    """Build the property card format string, with one placeholder per field"""
+    sections = []
+    for title, rows in CARD_SECTIONS:
+        row_markup = ''.join(
+            f'<div class="detail-row"><span class="detail-label">{label}</span>'
+            f'<span class="detail-value">{{{field}}}</span></div>'
+            for label, field, _ in rows
+        )
+        sections.append(f'<div class="detail-section"><h4>{title}</h4>{row_markup}</div>')
+    return (
+        '<div class="property-card"><div class="property-header"><h3>Property #{number}</h3>'
+        '<div class="address">{address}</div><div class="schedule">Schedule: {schedule}</div></div>'
+        '<div class="property-details"><div class="details-grid">' + ''.join(sections) + '{details}</div>'
+        '<a href="{url}" class="view-link" target="_blank">View Full Details on County Website →</a>'
+        '</div></div>'
+    )
+
+CARD_TEMPLATE = compile_card_template()
+CARD_FIELDS = [(field, no_commas) for _, rows in CARD_SECTIONS for _, field, no_commas in rows]
+DOCUMENT_HEAD = f'<!DOCTYPE html><html><head><meta charset="UTF-8"><style>{minify(CSS)}</style></head><body>'
+HEADER_TEMPLATE = (
+    '<div class="header"><h1>{title} Property Data Report{part}</h1>'
+    '<p>Property modifications from {start}</p><p>Generated on {generated}</p></div>'
+)
+TAIL_TEMPLATE = (
+    '<div class="footer"><p>{title} Property Data Email Report</p>'
+    '<p>This report contains the most recent property modifications in {region}</p>'
+    '</div></body></html>'
+)
+DOCUMENT_TAIL = TAIL_TEMPLATE.format(title=REPORT_TITLE, region=REPORT_REGION)
+NOT_AVAILABLE = '<span style="color: #999; font-style: italic;">N/A</span>'
+
+def format_value(value, no_commas=False):
+    """Format values for display, handling None, empty, and special values"""
+    if value is None or value == '' or value == 'N/A':
+        return NOT_AVAILABLE
+    if isinstance(value, (int, float)) and value == -1:
+        return '<span style="color: #999; font-style: italic;">Not Available</span>'
+    if isinstance(value, float):
+        if no_commas:
+            return f"{value:.2f}" if value < 1 else f"{value:.0f}"
+        return f"{value:,.2f}" if value >= 1 else f"{value:.2f}"
+    if isinstance(value, int):
+        if no_commas:
+            return str(value)
+        return f"{value:,}"
+    return html.escape(str(value))
+
+def format_field(attrs, changed_fields, field, no_commas=False):
+    """Format an attribute, highlighting it as "old → new" if it changed since the last snapshot"""
+    if field not in changed_fields:
+        return format_value(attrs.get(field), no_commas=no_commas)
+    before, after = changed_fields[field]
+    return (
+        f'<span class="changed">{format_value(before, no_commas=no_commas)} → '
+        f'<strong>{format_value(after, no_commas=no_commas)}</strong></span>'
+    )
+
+def render_details(extra):
+    """Render the detail page section of an enriched record, or nothing"""
+    if not extra or not any(field in extra for _, field, _ in DETAIL_SECTION[1]):
+        return ''
+    rows = []
+    for label, field, no_commas in DETAIL_SECTION[1]:
+        value = extra.get(field)
+        shown = f"${value:,}" if field in MONEY_FIELDS and isinstance(value, int) else format_value(value, no_commas)
+        rows.append(f'<div class="detail-row"><span class="detail-label">{label}</span>'
+                    f'<span class="detail-value">{shown}</span></div>')
+    return f'<div class="detail-section"><h4>{DETAIL_SECTION[0]}</h4>{"".join(rows)}</div>'
+
+def render_card(number, property_data):
+    """Render one property card"""
+    attrs = property_data.to_dict()
+    changed = property_data.changed_fields
+    values = {field: format_field(attrs, changed, field, no_commas) for field, no_commas in CARD_FIELDS}
+    return CARD_TEMPLATE.format(
+        number=number,
+        address=format_value(property_data.address),
+        schedule=format_value(property_data.schedule, no_commas=True),
+        url=html.escape(property_data.url, quote=True),
+        details=render_details(property_data.extra),
+        **values,
+    )
+
+def render_header(start_date, part='', title=REPORT_TITLE):
+    return HEADER_TEMPLATE.format(
+        title=html.escape(title),
+        part=part,
+        start=start_date.strftime('%B %d, %Y'),
+        generated=datetime.now().strftime('%B %d, %Y at %I:%M %p'),
+    )
+
+def render_tail(title=REPORT_TITLE, region=REPORT_REGION):
+    if title == REPORT_TITLE and region == REPORT_REGION:
+        return DOCUMENT_TAIL
+    return TAIL_TEMPLATE.format(title=html.escape(title), region=html.escape(region))
+
+def create_html_email(report_data, start_date, end_date, title=REPORT_TITLE, region=REPORT_REGION):
+    """Create HTML formatted email from report data"""
+    parts = [DOCUMENT_HEAD, render_header(start_date, title=title)]
+    parts.extend(render_card(number, property_data) for number, property_data in enumerate(report_data, 1))
+    parts.append(render_tail(title, region))
+    return ''.join(parts)
+
+def render_summary(report_data, start_date, byte_budget, title=REPORT_TITLE, region=REPORT_REGION):
+    """Render a compact summary table that fits the byte budget, noting any rows left to the CSV"""
+    head = DOCUMENT_HEAD + render_header(start_date, title=title)
+    tail = render_tail(title, region)
+    table_head = '<table class="summary-table"><tr>' + ''.join(
+        f'<th>{heading}</th>' for heading, _, _ in SUMMARY_COLUMNS
+    ) + '<th></th></tr>'
+    # Leave room for the notice, which is only known once the rows are counted
+    used = len(head.encode()) + len(table_head.encode()) + len(tail.encode()) + 400
+    rows = []
+    for property_data in report_data:
+        attrs = property_data.to_dict()
+        row = '<tr>' + ''.join(
+            f'<td>{format_value(attrs.get(field), no_commas=no_commas)}</td>' for _, field, no_commas in SUMMARY_COLUMNS
+        ) + f'<td><a href="{html.escape(property_data.url, quote=True)}">Details</a></td></tr>'
+        size = len(row.encode())
+        if used + size > byte_budget:
+            break
+        used += size
+        rows.append(row)
+    notice = (
+        f'<div class="notice">{len(report_data):,} properties were modified. '
+        f'This summary lists {len(rows):,} of them; every property is in the attached CSV.</div>'
+    )
+    return ''.join([head, notice, table_head, *rows, '</table>', tail])
+
+def create_csv_attachment(report_data):
+    """Return every report row as CSV text, one column per attribute"""
+    columns = ['url']
+    seen = set(columns)
+    for property_data in report_data:
+        # Rows share the layer 12 schema, so only the first row and rows with extra fields can add columns
+        if len(columns) == 1 or property_data.extra:
+            for field in property_data.full_attributes:
+                if field not in seen:
+                    seen.add(field)
+                    columns.append(field)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    # csv writes None as an empty cell
+    for property_data in report_data:
+        writer.writerow([property_data.url, *map(property_data.to_dict().get, columns[1:])])
+    return buffer.getvalue()
+
+def create_html_emails(report_data, start_date, end_date, byte_budget=REPORT_BYTE_BUDGET, max_parts=MAX_EMAIL_PARTS,
+                       title=REPORT_TITLE, region=REPORT_REGION):
+    """Split a report into messages that each fit the byte budget
+
+    Returns a list of {'html': ..., 'part': i, 'parts': n, 'attachments': [(filename, text)]}.
+    """
+    # Reserve room for the longest possible "Part i of n" header
+    tail = render_tail(title, region)
+    overhead = len(DOCUMENT_HEAD.encode()) + len(render_header(start_date, ' (Part 999 of 999)', title).encode())
+    overhead += len(tail.encode())
+
+    groups, current, used = [], [], overhead
+    overflow = False
+    for number, property_data in enumerate(report_data, 1):
+        card = render_card(number, property_data)
+        size = len(card.encode())
+        if current and used + size > byte_budget:
+            groups.append(current)
+            current, used = [], overhead
+            # Stop rendering cards as soon as a part past max_parts would be needed
+            if len(groups) == max_parts:
+                overflow = True
+                break
+        current.append(card)
+        used += size
+    if not overflow and (current or not groups):
+        groups.append(current)
+
+    if overflow:
+        filename = f"{'_'.join(title.lower().split())}_properties_{start_date.strftime('%Y%m%d_%H%M')}.csv"
+        return [{
+            'html': render_summary(report_data, start_date, byte_budget, title, region),
+            'part': 1,
+            'parts': 1,
+            'attachments': [(filename, create_csv_attachment(report_data))],
+        }]
+
+    messages = []
+    for index, group in enumerate(groups, 1):
+        part = f' (Part {index} of {len(groups)})' if len(groups) > 1 else ''
+        messages.append({
+            'html': ''.join([DOCUMENT_HEAD, render_header(start_date, part, title), *group, tail]),
+            'part': index,
+            'parts': len(groups),
+            'attachments': [],
+        })
+    return messages
+
+def benchmark(count):
+    """Render a synthetic report of `count` properties and print timings and sizes"""
+    from fake_mapserver import generate_parcels
+    from property_record import PropertyRecord
+
+    layer_12, _ = generate_parcels(count)
+    moddate = int(datetime(2025, 6, 16, 13, 55, 55).timestamp() * 1000)
+    report_data = [PropertyRecord(feature['attributes'], moddate) for feature in layer_12]
+    now = datetime.now()
+
+    started = time.perf_counter()
+    document = create_html_email(report_data, now, now)
+    single = time.perf_counter() - started
+    print(f"📝 Single document: {count:,} properties, {len(document.encode()) / 1024:,.0f} KB in {single * 1000:.0f} ms")
+
+    started = time.perf_counter()
+    messages = create_html_emails(report_data, now, now)
+    split = time.perf_counter() - started
+    largest = max(len(message['html'].encode()) for message in messages)
+    attachments = sum(len(message['attachments']) for message in messages)
+    print(f"✂️ Split: {len(messages)} messages (largest {largest / 1024:.0f} KB, {attachments} attachments) "
+          f"in {split * 1000:.0f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark report rendering")
+    parser.add_argument('--benchmark', type=int, default=10_000, metavar='N', help="number of synthetic properties")
+    args = parser.parse_args()
+    benchmark(args.benchmark)
+
+if __name__ == "__main__":
+    main()
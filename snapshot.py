@@ -0,0 +1,223 @@
+"""Full-county layer 12 snapshots and a vectorized field-level diff
+
+A snapshot stores every layer 12 record as NumPy columns in a compressed
+.npz file, sorted by a "PPI/Schedule" key. Downloads parse pages as they
+stream in and append each record straight onto its columns, so a
+full-county pull never holds the raw responses or a list of record dicts. Diffing two snapshots aligns
+them on that key and compares whole columns at once, so only the
+records that actually changed are touched in Python.
+
+    python snapshot.py download
+    python snapshot.py download --source lake
+    python snapshot.py diff snapshots/layer12_20250101_000000.npz snapshots/layer12_20250102_000000.npz
+"""
+import argparse
+import glob
+import itertools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import numpy as np
+
+from sources import DEFAULT_SOURCE, SOURCES_FILE, load_sources
+
+# Directory holding snapshot files, overridable with SNAPSHOT_DIR
+SNAPSHOT_DIR = 'snapshots'
+# Number of layer 12 pages downloaded at the same time
+SNAPSHOT_MAX_WORKERS = 8
+
+# Layer 12 fields stored as float64 (None becomes NaN); all others are stored as strings
+NUMERIC_FIELDS = {
+    'Schedule', 'TotAcres', 'SquareFeet', 'SqeFtLiving', 'NumOfCars', 'GarSqFt', 'NumOfRms',
+    'NumBedRms', 'NumLofts', 'NumKitch', 'MasterBath', 'FullBath', 'TotBath',
+}
+
+_loaded_snapshots = {}
+
+def record_key(attributes):
+    """Return the snapshot key of a layer 12 record (a PPI can carry several schedules)"""
+    return f"{attributes.get('PPI')}/{attributes.get('Schedule')}"
+
+def fetch_page(params, source=DEFAULT_SOURCE):
+    """Download one layer 12 page, parsing features as they stream in"""
+    return [source.to_report_fields(feature['attributes']) for feature in source.stream_attributes(params)]
+
+def fetch_layer_12_records(out_fields, max_workers=SNAPSHOT_MAX_WORKERS, source=DEFAULT_SOURCE):
+    """Yield every attribute record of source with the report field names, downloading pages in parallel"""
+    selected = source.attribute_metadata().select_fields(source.out_fields(out_fields), required=(source.field('PPI'),))
+    order_by = [field for field in map(source.field, ('PPI', 'Schedule')) if field in selected.split(',')]
+    base = {'where': '1=1', 'outFields': selected, 'orderByFields': ','.join(order_by), 'returnGeometry': 'false'}
+    total = source.query_attributes(dict(base, returnCountOnly='true')).get('count', 0)
+    first_page = source.stream_attributes(base)
+    page_size = 0
+    for feature in first_page:
+        page_size += 1
+        yield source.to_report_fields(feature['attributes'])
+    if not first_page.metadata.get('exceededTransferLimit') or not page_size:
+        return
+
+    offsets = range(page_size, total, page_size)
+    print(f"📥 Downloading {total} {source.name} layer {source.attribute_layer} records in {len(offsets) + 1} pages")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(fetch_page, dict(base, resultOffset=offset, resultRecordCount=page_size), source)
+            for offset in offsets
+        ]
+        for future in as_completed(futures):
+            yield from future.result()
+            # Release each page as soon as it has been consumed
+            futures.remove(future)
+
+def parse_number(value):
+    """Return value as a float, or NaN if it is missing or not a number (e.g. an alphanumeric schedule)"""
+    if value is None or value == '':
+        return np.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+def to_column(field, values):
+    if field in NUMERIC_FIELDS:
+        return np.array([parse_number(v) for v in values], dtype=np.float64)
+    return np.array(['' if v is None else str(v) for v in values], dtype=str)
+
+def build_snapshot(records, fields=None):
+    """Build a columnar snapshot {'key': ..., field: ...} sorted by key
+
+    Records are consumed in a single pass, so a generator is never
+    materialized. Of records sharing a key, the last one is kept.
+    """
+    records = iter(records)
+    if fields is None:
+        first = next(records, None)
+        fields = list(first) if first else []
+        if first is not None:
+            records = itertools.chain([first], records)
+    keys = []
+    columns = {field: [] for field in fields}
+    for attributes in records:
+        keys.append(record_key(attributes))
+        for field, column in columns.items():
+            column.append(attributes.get(field))
+
+    keys = np.array(keys, dtype=str)
+    order = np.argsort(keys, kind='stable')
+    # Keep the last record of each run of equal keys, so keys are unique
+    sorted_keys = keys[order]
+    order = order[np.append(sorted_keys[1:] != sorted_keys[:-1], True)] if len(keys) else order
+    snapshot = {'key': keys[order]}
+    for field in fields:
+        snapshot[field] = to_column(field, columns.pop(field))[order]
+    return snapshot
+
+def save_snapshot(snapshot, directory=SNAPSHOT_DIR):
+    """Write a snapshot to a timestamped .npz file and return its path"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"layer12_{datetime.now().strftime('%Y%m%d_%H%M%S')}.npz")
+    np.savez_compressed(path, **snapshot)
+    return path
+
+def load_snapshot(path):
+    """Load a snapshot file, reusing it while the file is unchanged"""
+    modified = os.path.getmtime(path)
+    cached = _loaded_snapshots.get(path)
+    if cached and cached[0] == modified:
+        return cached[1]
+    with np.load(path) as data:
+        snapshot = {name: data[name] for name in data.files}
+    _loaded_snapshots[path] = (modified, snapshot)
+    return snapshot
+
+def latest_snapshot_path(directory=SNAPSHOT_DIR):
+    """Return the newest snapshot file in directory, or None"""
+    paths = sorted(glob.glob(os.path.join(directory, 'layer12_*.npz')))
+    return paths[-1] if paths else None
+
+def to_python(field, value):
+    """Convert a snapshot cell back to the value layer 12 would have returned"""
+    if field in NUMERIC_FIELDS:
+        if np.isnan(value):
+            return None
+        return int(value) if float(value).is_integer() else float(value)
+    return str(value) or None
+
+def diff_snapshots(old, new):
+    """Compare two snapshots field by field
+
+    Returns {'added': [keys], 'removed': [keys], 'changes': {key: {field: (old, new)}}}.
+    Only fields present in both snapshots are compared.
+    """
+    # Not assume_unique: snapshots saved before keys were deduplicated can repeat a key
+    common, old_index, new_index = np.intersect1d(old['key'], new['key'], return_indices=True)
+    changes = {}
+    for field in old:
+        if field == 'key' or field not in new:
+            continue
+        before = old[field][old_index]
+        after = new[field][new_index]
+        if field in NUMERIC_FIELDS:
+            changed = (before != after) & ~(np.isnan(before) & np.isnan(after))
+        else:
+            changed = before != after
+        for row in np.flatnonzero(changed):
+            changes.setdefault(str(common[row]), {})[field] = (to_python(field, before[row]), to_python(field, after[row]))
+    return {
+        'added': [str(key) for key in np.setdiff1d(new['key'], old['key'])],
+        'removed': [str(key) for key in np.setdiff1d(old['key'], new['key'])],
+        'changes': changes,
+    }
+
+def diff_against_latest(records, directory=SNAPSHOT_DIR):
+    """Diff freshly fetched layer 12 records against the newest snapshot
+
+    Returns {key: {field: (old, new)}}, or {} when no snapshot exists yet.
+    """
+    path = latest_snapshot_path(directory)
+    if path is None or not records:
+        return {}
+    baseline = load_snapshot(path)
+    return diff_snapshots(baseline, build_snapshot(records, fields=[f for f in baseline if f != 'key']))['changes']
+
+def main():
+    parser = argparse.ArgumentParser(description="Download layer 12 snapshots and diff them")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    download = subparsers.add_parser('download', help="download all of layer 12 into a new snapshot")
+    download.add_argument('--source', metavar='NAME', default=DEFAULT_SOURCE.name,
+                          help="download this source from the sources file (default: %(default)s)")
+    download.add_argument('--directory', help="snapshot directory (default: SNAPSHOT_DIR, per source)")
+    download.add_argument('--max-workers', type=int, default=SNAPSHOT_MAX_WORKERS)
+    compare = subparsers.add_parser('diff', help="print field-level changes between two snapshots")
+    compare.add_argument('old')
+    compare.add_argument('new')
+    args = parser.parse_args()
+
+    if args.command == 'download':
+        from real_estate_updates import LAYER_12_FIELDS
+        try:
+            sources = {source.name: source for source in load_sources(os.getenv('SOURCES_FILE', SOURCES_FILE))}
+        except ValueError as e:
+            parser.error(str(e))
+        if args.source not in sources:
+            parser.error(f"unknown source: {args.source}")
+        source = sources[args.source]
+        directory = args.directory or source.state_path(os.getenv('SNAPSHOT_DIR', SNAPSHOT_DIR))
+        started = time.perf_counter()
+        records = fetch_layer_12_records(LAYER_12_FIELDS, max_workers=args.max_workers, source=source)
+        snapshot = build_snapshot(records, fields=LAYER_12_FIELDS.split(','))
+        path = save_snapshot(snapshot, directory)
+        print(f"✅ Saved {len(snapshot['key'])} records to {path} in {time.perf_counter() - started:.1f}s")
+    else:
+        started = time.perf_counter()
+        result = diff_snapshots(load_snapshot(args.old), load_snapshot(args.new))
+        elapsed = time.perf_counter() - started
+        for key, fields in sorted(result['changes'].items()):
+            for field, (before, after) in fields.items():
+                print(f"{key}  {field}: {before} → {after}")
+        print(f"📊 {len(result['changes'])} changed, {len(result['added'])} added, "
+              f"{len(result['removed'])} removed ({elapsed * 1000:.0f} ms)")
+
+if __name__ == "__main__":
+    main()
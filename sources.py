@@ -0,0 +1,237 @@
+"""Declarative ArcGIS sources and the queries built from them
+
+A source is one county MapServer laid out like Summit County's: a change
+layer whose rows carry a parcel key, a modification date and an
+OBJECTID, and an attribute layer holding the report fields of each
+parcel key. SOURCES_FILE (sources.json) lists the sources to poll:
+
+    [
+      {"name": "summit"},
+      {"name": "lake", "title": "Lake County", "region": "Lake County, Colorado",
+       "base_url": "https://gis.example.gov/arcgis/rest/services/Parcels/MapServer",
+       "change_layer": 3, "attribute_layer": 5, "join_key": "PARCELNB",
+       "field_map": {"MODDATE": "last_edited_date", "FullAdd": "SITUS"},
+       "link_template": "https://assessor.example.gov/parcel/{PPI}"}
+    ]
+
+Report fields keep the names of Summit County's layer 12 (property_record.FIELDS)
+plus MODDATE and OBJECTID on the change layer; field_map gives a
+source's own name for any of them, and join_key its name for PPI. Rows
+are renamed to the report names as they arrive, so everything past the
+queries works the same for every source. "summit" needs no settings: it
+is ARCGIS_MAPSERVER_URL (or the county server) with layers 19 and 12.
+Without a sources file, only Summit County is polled.
+
+Every source keeps its own watermark, caches, snapshots and history: the default
+paths with the source name inserted (".watermark.lake.json"), except
+for "summit", which keeps the plain paths.
+"""
+import json
+import os
+
+from arcgis_client import mapserver_url, query_layer, stream_layer
+from enrichment import detail_page_url
+from layer_metadata import get_layer_metadata
+from property_record import PropertyRecord
+from report import REPORT_REGION, REPORT_TITLE
+
+# Sources polled by real_estate_updates.py, overridable with SOURCES_FILE
+SOURCES_FILE = 'sources.json'
+DEFAULT_SOURCE_NAME = 'summit'
+SOURCE_SETTINGS = (
+    'name', 'title', 'region', 'base_url', 'change_layer', 'attribute_layer', 'join_key', 'change_filter',
+    'field_map', 'link_template', 'detail_page_url',
+)
+
+def sql_literal(value):
+    """Return value as a SQL string literal for a WHERE clause"""
+    return "'{}'".format(str(value).replace("'", "''"))
+
+def in_clause(field, values):
+    """Return "field IN ('a','b',...)" """
+    return f"{field} IN ({','.join(map(sql_literal, values))})"
+
+def all_of(*conditions):
+    """AND together the non-empty conditions, each in parentheses when there is more than one"""
+    conditions = [condition for condition in conditions if condition]
+    if len(conditions) == 1:
+        return conditions[0]
+    return ' AND '.join(f"({condition})" for condition in conditions) or '1=1'
+
+class Source:
+    """One MapServer to poll, with its layer numbers, field names and links"""
+
+    def __init__(self, name, title=None, region=None, base_url=None, change_layer=19, attribute_layer=12,
+                 join_key='PPI', change_filter=None, field_map=None, link_template=None, detail_page_url=None):
+        self.name = name
+        self.is_default = name == DEFAULT_SOURCE_NAME
+        if not self.is_default and not base_url:
+            raise ValueError(f"Source {name!r} needs a base_url")
+        self.title = title or (REPORT_TITLE if self.is_default else name.title())
+        self.region = region or (REPORT_REGION if self.is_default else self.title)
+        self.base_url = base_url
+        self.change_layer = change_layer
+        self.attribute_layer = attribute_layer
+        # Summit County's change layer also logs edits from other sources; only SOURCE=1 rows are parcel changes
+        self.change_filter = change_filter if change_filter is not None else ('SOURCE=1' if self.is_default else '')
+        self.field_map = dict(field_map or {})
+        self.field_map['PPI'] = join_key
+        # Source field name -> report field name, for the fields that are named differently
+        self.renames = {source: report for report, source in self.field_map.items() if source != report}
+        self.link_template = link_template
+        self.detail_page_url = detail_page_url
+        self.record_type = PropertyRecord if link_template is None else type(
+            f'{name.title()}Record', (LinkedRecord,), {'__slots__': (), 'link_template': link_template}
+        )
+
+    @classmethod
+    def from_dict(cls, settings):
+        unknown = set(settings) - set(SOURCE_SETTINGS)
+        if unknown:
+            raise ValueError(f"Unknown source settings: {', '.join(sorted(unknown))}")
+        if not settings.get('name'):
+            raise ValueError("Every source needs a name")
+        return cls(**settings)
+
+    def __repr__(self):
+        return f"Source({self.name!r})"
+
+    @property
+    def url(self):
+        """Return the MapServer URL, which ARCGIS_MAPSERVER_URL sets for the default source"""
+        return self.base_url or mapserver_url()
+
+    @property
+    def detail_url(self):
+        """Return the DetailData.aspx URL for enrichment, or None if the source has no detail pages"""
+        if self.detail_page_url is None and self.is_default:
+            return detail_page_url()
+        return self.detail_page_url
+
+    @property
+    def metric_labels(self):
+        """Extra metric labels; the default source keeps the unlabeled single-county metrics"""
+        return {} if self.is_default else {'source': self.name}
+
+    def label(self, layer):
+        """Return the request metric label of one of the source's layers"""
+        return str(layer) if self.is_default else f"{self.name}/{layer}"
+
+    def state_path(self, path):
+        """Return a per-source variant of a state file or directory path"""
+        if self.is_default or not path:
+            return path
+        root, extension = os.path.splitext(path)
+        return f"{root}.{self.name}{extension}"
+
+    def field(self, name):
+        """Return the source's name for a report field"""
+        return self.field_map.get(name, name)
+
+    def out_fields(self, names):
+        """Return the source's names for comma-separated report field names"""
+        if not self.renames:
+            return names
+        return ','.join(map(self.field, names.split(',')))
+
+    def to_report_fields(self, attributes):
+        """Return attributes with the source's field names replaced by the report field names"""
+        if not self.renames:
+            return attributes
+        renames = self.renames
+        return {renames.get(field, field): value for field, value in attributes.items()}
+
+    # --- Change layer ---
+
+    def change_metadata(self):
+        return get_layer_metadata(self.change_layer, base_url=self.base_url)
+
+    def attribute_metadata(self):
+        return get_layer_metadata(self.attribute_layer, base_url=self.base_url)
+
+    def watermark_where(self, watermark, end_ms):
+        """WHERE clause selecting change rows after the (MODDATE, OBJECTID) watermark, up to end_ms"""
+        moddate, objectid = watermark
+        moddate_field, objectid_field = self.field('MODDATE'), self.field('OBJECTID')
+        return all_of(
+            self.change_filter,
+            f"{moddate_field} <= {end_ms}",
+            f"{moddate_field} > {moddate} OR ({moddate_field} = {moddate} AND {objectid_field} > {objectid})",
+        )
+
+    def window_where(self, start_ms, end_ms):
+        """WHERE clause selecting change rows with start_ms <= MODDATE < end_ms"""
+        moddate_field = self.field('MODDATE')
+        return all_of(self.change_filter, f"{moddate_field} >= {start_ms}", f"{moddate_field} < {end_ms}")
+
+    def object_id_range_where(self, first, last, where_clause):
+        objectid_field = self.field('OBJECTID')
+        return all_of(f"{objectid_field} >= {first} AND {objectid_field} <= {last}", where_clause)
+
+    def change_query(self, where_clause, out_fields, **params):
+        """Return change layer query parameters, ordered by MODDATE then OBJECTID"""
+        query = {
+            'where': where_clause,
+            'outFields': self.change_metadata().select_fields(
+                self.out_fields(out_fields), required=tuple(map(self.field, ('OBJECTID', 'PPI', 'MODDATE'))),
+            ),
+            'orderByFields': self.out_fields('MODDATE,OBJECTID'),
+            'returnGeometry': 'false',
+        }
+        query.update(params)
+        return query
+
+    def query_changes(self, query):
+        return query_layer(self.change_layer, query, base_url=self.base_url, metric_label=self.label(self.change_layer))
+
+    def stream_changes(self, query, method='GET'):
+        return stream_layer(self.change_layer, query, method=method, base_url=self.base_url,
+                            metric_label=self.label(self.change_layer))
+
+    # --- Attribute layer ---
+
+    def attribute_batch_query(self, keys, out_fields):
+        """Return the POST form looking up the attribute records of a batch of parcel keys"""
+        return {
+            'where': in_clause(self.field('PPI'), keys),
+            'outFields': self.attribute_metadata().select_fields(self.out_fields(out_fields), required=(self.field('PPI'),)),
+            'returnGeometry': 'false',
+        }
+
+    def query_attributes(self, query):
+        return query_layer(self.attribute_layer, query, base_url=self.base_url,
+                           metric_label=self.label(self.attribute_layer))
+
+    def stream_attributes(self, query, method='GET'):
+        return stream_layer(self.attribute_layer, query, method=method, base_url=self.base_url,
+                            metric_label=self.label(self.attribute_layer))
+
+class LinkedRecord(PropertyRecord):
+    """A PropertyRecord whose detail link comes from its source's link_template"""
+
+    __slots__ = ()
+    link_template = None
+
+    @property
+    def url(self):
+        return self.link_template.format_map(self.to_dict())
+
+DEFAULT_SOURCE = Source(DEFAULT_SOURCE_NAME)
+
+def load_sources(path=SOURCES_FILE):
+    """Return the Sources listed in path, or just the default source if there is no such file
+
+    Raises ValueError for invalid settings or duplicate names.
+    """
+    try:
+        with open(path) as f:
+            settings = json.load(f)
+    except FileNotFoundError:
+        return [DEFAULT_SOURCE]
+    sources = [DEFAULT_SOURCE if entry == {'name': DEFAULT_SOURCE_NAME} else Source.from_dict(entry)
+               for entry in settings]
+    names = [source.name for source in sources]
+    duplicates = {name for name in names if names.count(name) > 1}
+    if duplicates:
+        raise ValueError(f"Duplicate source names in {path}: {', '.join(sorted(duplicates))}")
+    return sources